@@ -8,169 +8,378 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import base64
+import collections
+import contextlib
+import fnmatch
+import gzip
+import hashlib
 import json
+import math
+import ntpath
 import os
 import os.path
 import shutil
 import tempfile
+import threading
+import time
 import traceback
 import zipfile
 
 from ansible import constants as C
-from ansible.errors import AnsibleError, AnsibleFileNotFound
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.errors import AnsibleActionFail, AnsibleConnectionFailure, AnsibleError, AnsibleFileNotFound
 from ansible.module_utils.common.text.converters import to_bytes, to_native, to_text
+from ansible.module_utils.common.text.formatters import human_to_bytes
+from ansible.module_utils.common.validation import check_type_int, check_type_list
 from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.parsing.vault import b_HEADER, is_encrypted
 from ansible.plugins.action import ActionBase
-from ansible.utils.hashing import checksum
+from ansible.utils.display import Display
+
+from ..plugin_utils._checksum import CHECKSUM_ALGORITHMS, LocalChecksumCache, checksum_data, checksum_file, checksum_files
+
+display = Display()
+
+# File extensions of formats that are already compressed, deflating these
+# again costs CPU time for little to no reduction in size.
+_COMPRESSED_EXTENSIONS = frozenset([
+    '.7z', '.appx', '.appxbundle', '.bz2', '.cab', '.docx', '.gif', '.gz', '.jar', '.jpeg', '.jpg', '.lz', '.lzma',
+    '.mp3', '.mp4', '.msi', '.msix', '.msu', '.nupkg', '.png', '.pptx', '.rar', '.tgz', '.vsix', '.webp', '.whl',
+    '.xlsx', '.xz', '.zip', '.zst',
+])
+
+# The number of bytes read from the start of a file to probe its entropy and
+# the Shannon entropy, in bits per byte, where the data is treated as already
+# compressed or random and is not worth deflating.
+_ENTROPY_SAMPLE_SIZE = 16384
+_ENTROPY_THRESHOLD = 7.5
+
+# The header of the manifest file sent to the remote host for a directory copy
+# query, this must match the value win_copy.ps1 expects.
+_MANIFEST_HEADER = u"win_copy-manifest\t1"
+
+# The difference between the Unix and Windows FILETIME epoch in 100ns ticks.
+_FILETIME_EPOCH_OFFSET = 116444736000000000
 
+# The smallest part a file is split into when it is transferred over multiple
+# streams, below this the cost of the extra connection outweighs the gain.
+_MIN_STREAM_PART_SIZE = 1024 * 1024
 
-def _walk_dirs(topdir, loader, decrypt=True, base_path=None, local_follow=False, trailing_slash_detector=None, checksum_check=False):
+# The number of times a staged single file transfer is resumed after a
+# connection failure or rejected chunk without making any progress.
+_STAGE_RETRIES = 3
+
+# The number of files hashed in parallel at a time while a source directory is
+# walked, the entries are held until their batch has been hashed.
+_CHECKSUM_BATCH_SIZE = 1024
+
+# The checksum algorithms strong enough to treat files with the same checksum
+# as the same content, a file is only copied from a duplicate on the remote
+# host with one of these.
+_DEDUPE_ALGORITHMS = frozenset(['sha1', 'sha256'])
+
+
+class _WalkEntry:
     """
-    Walk a filesystem tree returning enough information to copy the files.
-    This is similar to the _walk_dirs function in ``copy.py`` but returns
-    a dict instead of a tuple for each entry and includes the checksum of
-    a local file if wanted.
+    A file, directory or symlink found when walking a source directory. The
+    type is 'f' for a file, 'd' for a directory or 'l' for a symlink, the src
+    of a symlink is the target to create it with on the remote host.
 
-    :arg topdir: The directory that the filesystem tree is rooted at
-    :arg loader: The self._loader object from ActionBase
-    :kwarg decrypt: Whether to decrypt a file encrypted with ansible-vault
-    :kwarg base_path: The initial directory structure to strip off of the
-        files for the destination directory.  If this is None (the default),
-        the base_path is set to ``top_dir``.
-    :kwarg local_follow: Whether to follow symlinks on the source.  When set
-        to False, no symlinks are dereferenced.  When set to True (the
-        default), the code will dereference most symlinks.  However, symlinks
-        can still be present if needed to break a circular link.
-    :kwarg trailing_slash_detector: Function to determine if a path has
-        a trailing directory separator. Only needed when dealing with paths on
-        a remote machine (in which case, pass in a function that is aware of the
-        directory separator conventions on the remote machine).
-    :kawrg whether to get the checksum of the local file and add to the dict
-    :returns: dictionary of dictionaries. All of the path elements in the structure are text string.
-            This separates all the files, directories, and symlinks along with
-            import information about each::
+    This uses __slots__ rather than a dict as an entry is kept for every file
+    in a large tree. It can still be read like a dict, e.g. entry['dest'], so
+    the copy stages can handle it the same as a single file dict.
+    """
 
-                {
-                    'files'; [{
-                        src: '/absolute/path/to/copy/from',
-                        dest: 'relative/path/to/copy/to',
-                        checksum: 'b54ba7f5621240d403f06815f7246006ef8c7d43'
-                    }, ...],
-                    'directories'; [{
-                        src: '/absolute/path/to/copy/from',
-                        dest: 'relative/path/to/copy/to'
-                    }, ...],
-                    'symlinks'; [{
-                        src: '/symlink/target/path',
-                        dest: 'relative/path/to/copy/to'
-                    }, ...],
+    __slots__ = ('type', 'src', 'dest', 'checksum', 'size', 'mtime', 'directory')
 
-                }
+    def __init__(self, entry_type, src, dest, size=None, mtime=None, directory=False):
+        self.type = entry_type
+        self.src = src
+        self.dest = dest
+        self.checksum = None
+        self.size = size
+        self.mtime = mtime
+        self.directory = directory
 
-        The ``symlinks`` field is only populated if ``local_follow`` is set to False
-        *or* a circular symlink cannot be dereferenced. The ``checksum`` entry is set
-        to None if checksum_check=False.
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, _WalkEntry):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "_WalkEntry(%s)" % ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
 
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """Get the entry as a dict that can be sent as a module argument."""
+        if self.type == 'l':
+            return {"src": self.src, "dest": self.dest, "directory": self.directory}
+        elif self.type == 'd':
+            return {"src": self.src, "dest": self.dest}
+        return {"src": self.src, "dest": self.dest, "checksum": self.checksum}
+
+
+def _iter_manifest_index(path):
+    """
+    Reads the _WalkEntry objects of the files and directories of a manifest
+    from the local index written by ActionModule._transfer_manifest, in the
+    order they are in the manifest.
     """
-    # Convert the path segments into byte strings
+    with open(to_bytes(path, errors='surrogate_or_strict'), 'r', encoding='utf-8') as index:
+        for line in index:
+            entry_type, src, dest, checksum, size, mtime = json.loads(line)
+            entry = _WalkEntry(entry_type, src, dest, size=size, mtime=mtime)
+            entry.checksum = checksum
+            yield entry
 
-    r_files = {'files': [], 'directories': [], 'symlinks': []}
 
-    def _recurse(topdir, rel_offset, parent_dirs, rel_base=u'', checksum_check=False):
+def _get_symlink_entry(link_path, dest_path, root):
+    """
+    Get the entry used to recreate a local symlink on the remote host. A
+    relative target is kept as is while an absolute target inside root is made
+    relative to the link so it still resolves once copied. A link to an
+    absolute path outside root cannot be recreated and is skipped, as is a
+    relative target that resolves to a path outside of the destination, like
+    ``../../..``, from dest_path.
+    """
+    target = os.readlink(link_path)
+    if os.path.isabs(target):
+        real_target = os.path.realpath(target)
+        if real_target != root and not real_target.startswith(root.rstrip(os.path.sep) + os.path.sep):
+            display.warning("Skipping symlink '%s' as its target '%s' is outside of the source directory" % (link_path, target))
+            return None
+        target = os.path.relpath(real_target, os.path.realpath(os.path.dirname(link_path)))
+
+    # the remote host resolves the target from where the link is created in
+    # dest, it must not point outside of it
+    remote_target = os.path.normpath(os.path.join(os.path.dirname(dest_path), target))
+    if remote_target == os.path.pardir or remote_target.startswith(os.path.pardir + os.path.sep):
+        display.warning("Skipping symlink '%s' as its target '%s' is outside of the destination directory" % (link_path, target))
+        return None
+
+    return _WalkEntry('l', target.replace(os.path.sep, '\\'), dest_path, directory=os.path.isdir(link_path))
+
+
+def _get_file_entry(real_file, dest_path, file_stat=None):
+    """
+    Get the entry of a local file to copy. The mtime is a Windows FILETIME
+    value, this is the number of 100ns ticks since 1601-01-01 UTC. The
+    file_stat can be passed in when already known to avoid another stat call.
+    """
+    if file_stat is None:
+        file_stat = os.stat(to_bytes(real_file, errors='surrogate_or_strict'))
+    return _WalkEntry('f', real_file, dest_path, size=file_stat.st_size,
+                      mtime=file_stat.st_mtime_ns // 100 + _FILETIME_EPOCH_OFFSET)
+
+
+def _get_path_filter(exclude=None, include=None):
+    """
+    Get the filter used by _iter_walk_dirs to skip entries by the exclude and
+    include glob patterns. Returns None when there are no patterns, otherwise
+    a function that is called with the path of the entry relative to the
+    source directory, using / as the separator, and whether it is a directory.
+    It returns False for an entry that should be skipped.
+
+    A pattern without a / is matched against the name of the entry, otherwise
+    it is matched against the whole relative path. A pattern ending with / only
+    matches a directory. Excluded directories are skipped along with everything
+    inside them. The include patterns only apply to files, a directory is
+    always walked unless excluded.
+    """
+    if not exclude and not include:
+        return None
+
+    def _compile(patterns):
+        compiled = []
+        for pattern in patterns or []:
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            compiled.append((pattern, '/' in pattern, dir_only))
+        return compiled
+
+    exclude = _compile(exclude)
+    include = _compile(include)
+
+    def _matches(patterns, rel_path, is_dir):
+        name = rel_path.rsplit('/', 1)[-1]
+        for pattern, full_path, dir_only in patterns:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(rel_path if full_path else name, pattern):
+                return True
+        return False
+
+    def path_filter(rel_path, is_dir):
+        if exclude and _matches(exclude, rel_path, is_dir):
+            return False
+        if include and not is_dir and not _matches(include, rel_path, is_dir):
+            return False
+        return True
+
+    return path_filter
+
+
+def _scan_dir(path):
+    """
+    Lists a directory with os.scandir, returning the DirEntry objects of the
+    files and directories sorted by name. A symlink is listed with the type
+    of its target, a broken symlink is listed as a file. Like os.walk, a
+    directory that cannot be read is treated as empty.
+    """
+    try:
+        with os.scandir(path) as scanned:
+            dir_entries = sorted(scanned, key=lambda e: e.name)
+    except OSError:
+        return [], []
+
+    files = []
+    directories = []
+    for dir_entry in dir_entries:
+        try:
+            is_dir = dir_entry.is_dir()
+        except OSError:
+            is_dir = False
+        (directories if is_dir else files).append(dir_entry)
+
+    return files, directories
+
+
+def _iter_walk_dirs(topdir, base_path=None, local_follow=False, trailing_slash_detector=None, path_filter=None):
+    """
+    Walk a filesystem tree yielding a _WalkEntry for each file, directory and
+    symlink as it is found. Nothing is kept for the entries already yielded so
+    the memory used does not grow with the size of the tree. The entries of
+    each directory are yielded in sorted order so the same tree is always
+    walked in the same order.
+
+    The tree is listed with os.scandir so the type of each entry comes from
+    the directory listing and a file is only stat'd once. Symlinks are only
+    resolved for the entries that are symlinks.
+
+    The entries rejected by path_filter, see _get_path_filter, are skipped
+    before they are stat'd and an excluded directory is not listed at all.
+
+    See _walk_dirs for the meaning of each argument. The size and mtime, as a
+    Windows FILETIME, of each file is set from the local file. No file is
+    opened, use _read_entries to decrypt vault files and set the checksum.
+    """
+    root = os.path.realpath(topdir)
+
+    def _symlink(link_path, dest_path, link_root=root):
+        entry = _get_symlink_entry(link_path, dest_path, link_root)
+        return [entry] if entry else []
+
+    def _keep(dest_path, is_dir):
+        if path_filter is None:
+            return True
+        # the filter patterns are relative to topdir rather than dest
+        return path_filter(dest_path[match_offset:].replace(os.path.sep, '/'), is_dir)
+
+    def _recurse(topdir, rel_offset, parent_dirs, rel_base=u''):
         """
-        This is a closure (function utilizing variables from it's parent
-        function's scope) so that we only need one copy of all the containers.
-        Note that this function uses side effects (See the Variables used from
-        outer scope).
+        Yields the entries of the topdir tree, each directory is yielded
+        before the entries inside it.
 
         :arg topdir: The directory we are walking for files
         :arg rel_offset: Integer defining how many characters to strip off of
             the beginning of a path
-        :arg parent_dirs: Directories that we're copying that this directory is in.
+        :arg parent_dirs: The (st_dev, st_ino) of the directories being copied
+            that this directory is in. This set is shared by the whole walk,
+            the entries added when following a symlink are removed once it
+            has been walked.
         :kwarg rel_base: String to prepend to the path after ``rel_offset`` is
             applied to form the relative path.
-
-        Variables used from the outer scope
-        ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-        :r_files: Dictionary of files in the hierarchy.  See the return value
-            for :func:`walk` for the structure of this dictionary.
-        :local_follow: Read-only inside of :func:`_recurse`. Whether to follow symlinks
         """
-        for base_path, sub_folders, files in os.walk(topdir):
-            for filename in files:
-                filepath = os.path.join(base_path, filename)
+        pending = [topdir]
+        while pending:
+            files, sub_folders = _scan_dir(pending.pop())
+            for dir_entry in files:
+                filepath = dir_entry.path
                 dest_filepath = os.path.join(rel_base, filepath[rel_offset:])
+                if not _keep(dest_filepath, False):
+                    continue
 
-                if os.path.islink(filepath):
+                if dir_entry.is_symlink():
                     # Dereference the symlnk
-                    real_file = loader.get_real_file(os.path.realpath(filepath), decrypt=decrypt)
+                    real_file = os.path.realpath(filepath)
                     if local_follow and os.path.isfile(real_file):
                         # Add the file pointed to by the symlink
-                        r_files['files'].append(
-                            {
-                                "src": real_file,
-                                "dest": dest_filepath,
-                                "checksum": _get_local_checksum(checksum_check, real_file)
-                            }
-                        )
+                        yield _get_file_entry(real_file, dest_filepath)
                     else:
                         # Mark this file as a symlink to copy
-                        r_files['symlinks'].append({"src": os.readlink(filepath), "dest": dest_filepath})
+                        yield from _symlink(filepath, dest_filepath)
                 else:
                     # Just a normal file
-                    real_file = loader.get_real_file(filepath, decrypt=decrypt)
-                    r_files['files'].append(
-                        {
-                            "src": real_file,
-                            "dest": dest_filepath,
-                            "checksum": _get_local_checksum(checksum_check, real_file)
-                        }
-                    )
+                    yield _get_file_entry(filepath, dest_filepath, file_stat=dir_entry.stat())
 
-            for dirname in sub_folders:
-                dirpath = os.path.join(base_path, dirname)
+            walk_dirs = []
+            for dir_entry in sub_folders:
+                dirpath = dir_entry.path
                 dest_dirpath = os.path.join(rel_base, dirpath[rel_offset:])
-                real_dir = os.path.realpath(dirpath)
-                dir_stats = os.stat(real_dir)
+                if not _keep(dest_dirpath, True):
+                    continue
 
-                if os.path.islink(dirpath):
-                    if local_follow:
-                        if (dir_stats.st_dev, dir_stats.st_ino) in parent_dirs:
-                            # Just insert the symlink if the target directory
-                            # exists inside of the copy already
-                            r_files['symlinks'].append({"src": os.readlink(dirpath), "dest": dest_dirpath})
-                        else:
-                            # Walk the dirpath to find all parent directories.
-                            new_parents = set()
-                            parent_dir_list = os.path.dirname(dirpath).split(os.path.sep)
-                            for parent in range(len(parent_dir_list), 0, -1):
-                                parent_stat = os.stat(u'/'.join(parent_dir_list[:parent]))
-                                if (parent_stat.st_dev, parent_stat.st_ino) in parent_dirs:
-                                    # Reached the point at which the directory
-                                    # tree is already known.  Don't add any
-                                    # more or we might go to an ancestor that
-                                    # isn't being copied.
-                                    break
-                                new_parents.add((parent_stat.st_dev, parent_stat.st_ino))
-
-                            if (dir_stats.st_dev, dir_stats.st_ino) in new_parents:
-                                # This was a a circular symlink.  So add it as
-                                # a symlink
-                                r_files['symlinks'].append({"src": os.readlink(dirpath), "dest": dest_dirpath})
-                            else:
-                                # Walk the directory pointed to by the symlink
-                                r_files['directories'].append({"src": real_dir, "dest": dest_dirpath})
-                                offset = len(real_dir) + 1
-                                _recurse(real_dir, offset, parent_dirs.union(new_parents),
-                                         rel_base=dest_dirpath,
-                                         checksum_check=checksum_check)
-                    else:
-                        # Add the symlink to the destination
-                        r_files['symlinks'].append({"src": os.readlink(dirpath), "dest": dest_dirpath})
-                else:
+                if not dir_entry.is_symlink():
                     # Just a normal directory
-                    r_files['directories'].append({"src": dirpath, "dest": dest_dirpath})
+                    yield _WalkEntry('d', dirpath, dest_dirpath)
+                    walk_dirs.append(dirpath)
+                    continue
+                elif not local_follow:
+                    # Add the symlink to the destination
+                    yield from _symlink(dirpath, dest_dirpath)
+                    continue
+
+                real_dir = os.path.realpath(dirpath)
+                dir_stats = os.stat(real_dir)
+                if (dir_stats.st_dev, dir_stats.st_ino) in parent_dirs:
+                    # Just insert the symlink if the target directory
+                    # exists inside of the copy already
+                    yield from _symlink(dirpath, dest_dirpath)
+                    continue
+
+                # Walk the dirpath to find all parent directories.
+                new_parents = set()
+                parent_dir_list = os.path.dirname(dirpath).split(os.path.sep)
+                for parent in range(len(parent_dir_list), 0, -1):
+                    parent_stat = os.stat(u'/'.join(parent_dir_list[:parent]))
+                    if (parent_stat.st_dev, parent_stat.st_ino) in parent_dirs:
+                        # Reached the point at which the directory
+                        # tree is already known.  Don't add any
+                        # more or we might go to an ancestor that
+                        # isn't being copied.
+                        break
+                    new_parents.add((parent_stat.st_dev, parent_stat.st_ino))
+
+                if (dir_stats.st_dev, dir_stats.st_ino) in new_parents:
+                    # This was a a circular symlink.  So add it as
+                    # a symlink
+                    yield from _symlink(dirpath, dest_dirpath)
+                    continue
+
+                # Walk the directory pointed to by the symlink
+                yield _WalkEntry('d', real_dir, dest_dirpath)
+                new_parents.difference_update(parent_dirs)
+                parent_dirs.update(new_parents)
+                try:
+                    yield from _recurse(real_dir, len(real_dir) + 1, parent_dirs, rel_base=dest_dirpath)
+                finally:
+                    parent_dirs.difference_update(new_parents)
+
+            # walk the sub directories depth first in sorted order
+            pending.extend(reversed(walk_dirs))
 
     # Check if the source ends with a "/" so that we know which directory
     # level to work at (similar to rsync)
@@ -197,29 +406,499 @@ def _walk_dirs(topdir, loader, decrypt=True, base_path=None, local_follow=False,
     elif not base_path.endswith(os.path.sep):
         offset += 1
 
+    # The number of characters to strip off of the dest of an entry to get
+    # its path relative to topdir
+    match_offset = max(len(topdir.rstrip(os.path.sep)) - offset + 1, 0)
+
     if os.path.islink(topdir) and not local_follow:
-        r_files['symlinks'].append({"src": os.readlink(topdir), "dest": os.path.basename(topdir)})
-        return r_files
+        yield from _symlink(topdir, os.path.basename(topdir),
+                            link_root=os.path.realpath(os.path.dirname(os.path.abspath(topdir))))
+        return
 
     dir_stats = os.stat(topdir)
-    parents = frozenset(((dir_stats.st_dev, dir_stats.st_ino),))
     # Actually walk the directory hierarchy
-    _recurse(topdir, offset, parents, checksum_check=checksum_check)
+    yield from _recurse(topdir, offset, {(dir_stats.st_dev, dir_stats.st_ino)})
+
+
+def _has_vault_header(path):
+    try:
+        with open(to_bytes(path, errors='surrogate_or_strict'), 'rb') as fd:
+            return is_encrypted(fd.read(len(b_HEADER)))
+    except (IOError, OSError):
+        # Let the copy report the error when it tries to read the file
+        return False
+
+
+def _is_not_vault(b_header):
+    return not is_encrypted(b_header[:len(b_HEADER)])
+
+
+def _read_entries(entries, loader, decrypt=True, checksum_check=False, checksum_cache=None, tempfiles=None,
+                  batch_size=_CHECKSUM_BATCH_SIZE, algorithm='sha1'):
+    """
+    Reads the files from an iterable of _WalkEntry objects as they are
+    yielded. The files are read in parallel batches of batch_size so only one
+    batch of entries is held at a time.
+
+    Each file is only opened once. The first bytes read are checked for the
+    ansible-vault header and, when checksum_check is set, the rest of the file
+    is hashed in the same read. A file found in checksum_cache is not read at
+    all, only the checksum of a file without the header is cached whether
+    decrypt is set or not.
+
+    Only a file with the vault header is passed to the loader, its entry is
+    changed to the decrypted tempfile and the tempfile is added to tempfiles
+    for the caller to clean up once the copy is done. The mtime of the entry
+    is kept as the vault file so an unchanged file is still unchanged on the
+    next run.
+
+    The checksum is calculated with algorithm, checksum_cache must be for the
+    same algorithm.
+    """
+    batch = []
+    files = []
+    vault_files = set()
+    decrypted = {}
+
+    def _is_vault(path, b_header):
+        if is_encrypted(b_header[:len(b_HEADER)]):
+            vault_files.add(path)
+            return True
+        return False
+
+    def _decrypt(file_entry):
+        real_file = decrypted.get(file_entry.src)
+        if real_file is None:
+            real_file = loader.get_real_file(file_entry.src, decrypt=True)
+            decrypted[file_entry.src] = real_file
+            if tempfiles is not None:
+                tempfiles.append(real_file)
+
+        file_entry.src = real_file
+        file_entry.size = os.path.getsize(to_bytes(real_file, errors='surrogate_or_strict'))
+        if checksum_check:
+            file_entry.checksum = checksum_file(real_file, algorithm=algorithm)
+
+    def _flush():
+        if checksum_check:
+            # a vault file is never cached, even when it is not decrypted, so
+            # a run that decrypts it never finds the checksum of the vault
+            checksums = checksum_files([f.src for f in files], cache=checksum_cache,
+                                       header_check=_is_vault if decrypt else None, algorithm=algorithm,
+                                       cache_check=_is_not_vault)
+            for file_entry, file_checksum in zip(files, checksums):
+                file_entry.checksum = file_checksum
+        elif decrypt:
+            with ThreadPoolExecutor(max_workers=min(len(files), 8)) as executor:
+                for file_entry, is_vault in zip(files, executor.map(_has_vault_header, [f.src for f in files])):
+                    if is_vault:
+                        vault_files.add(file_entry.src)
+
+        for file_entry in files:
+            if file_entry.src in vault_files:
+                _decrypt(file_entry)
+        vault_files.clear()
+
+    for entry in entries:
+        batch.append(entry)
+        if entry.type == 'f':
+            files.append(entry)
+
+        if len(files) >= batch_size:
+            _flush()
+            yield from batch
+            batch = []
+            files = []
+
+    if files:
+        _flush()
+    yield from batch
+
+
+def _walk_dirs(topdir, loader, decrypt=True, base_path=None, local_follow=False, trailing_slash_detector=None, checksum_check=False,
+               checksum_cache=None, path_filter=None):
+    """
+    Walk a filesystem tree returning enough information to copy the files.
+    This is similar to the _walk_dirs function in ``copy.py`` but returns
+    a _WalkEntry instead of a tuple for each entry and includes the checksum
+    of a local file if wanted.
+
+    This collects every entry of _iter_walk_dirs into lists, use that
+    directly to process the entries of a large tree as they are found.
+
+    :arg topdir: The directory that the filesystem tree is rooted at
+    :arg loader: The self._loader object from ActionBase
+    :kwarg decrypt: Whether to decrypt a file encrypted with ansible-vault
+    :kwarg base_path: The initial directory structure to strip off of the
+        files for the destination directory.  If this is None (the default),
+        the base_path is set to ``top_dir``.
+    :kwarg local_follow: Whether to follow symlinks on the source.  When set
+        to False, no symlinks are dereferenced.  When set to True (the
+        default), the code will dereference most symlinks.  However, symlinks
+        can still be present if needed to break a circular link.
+    :kwarg trailing_slash_detector: Function to determine if a path has
+        a trailing directory separator. Only needed when dealing with paths on
+        a remote machine (in which case, pass in a function that is aware of the
+        directory separator conventions on the remote machine).
+    :kwarg checksum_check: Whether to get the checksum of the local file and add to the dict.
+        The files are hashed in parallel batches as the tree is walked, see
+        _read_entries.
+    :kwarg checksum_cache: An optional LocalChecksumCache used to lookup and
+        store the checksums of the files walked.
+    :kwarg path_filter: An optional filter from _get_path_filter to skip
+        entries by glob patterns.
+    :returns: dictionary of lists. All of the path elements in the structure are text string.
+            This separates all the files, directories, and symlinks along with
+            import information about each::
+
+                {
+                    'files'; [_WalkEntry(
+                        src: '/absolute/path/to/copy/from',
+                        dest: 'relative/path/to/copy/to',
+                        checksum: 'b54ba7f5621240d403f06815f7246006ef8c7d43'
+                    ), ...],
+                    'directories'; [_WalkEntry(
+                        src: '/absolute/path/to/copy/from',
+                        dest: 'relative/path/to/copy/to'
+                    ), ...],
+                    'symlinks'; [{
+                        src: 'relative\\windows\\target\\path',
+                        dest: 'relative/path/to/copy/to',
+                        directory: False
+                    }, ...],
+
+                }
+
+        The ``symlinks`` field is only populated if ``local_follow`` is set to False
+        *or* a circular symlink cannot be dereferenced. The symlink ``src`` is the
+        target to create the link with on the remote host, links to a path outside
+        of ``topdir`` are skipped. The ``checksum`` entry is set to None if
+        checksum_check=False.
+
+    """
+    r_files = {'files': [], 'directories': [], 'symlinks': []}
+
+    entries = _iter_walk_dirs(topdir, base_path=base_path, local_follow=local_follow,
+                              trailing_slash_detector=trailing_slash_detector, path_filter=path_filter)
+    entries = _read_entries(entries, loader, decrypt=decrypt, checksum_check=checksum_check,
+                            checksum_cache=checksum_cache)
+
+    for entry in entries:
+        if entry.type == 'f':
+            r_files['files'].append(entry)
+        elif entry.type == 'd':
+            r_files['directories'].append(entry)
+        else:
+            r_files['symlinks'].append(entry.to_dict())
 
     return r_files
 
 
-def _get_local_checksum(get_checksum, local_path):
-    if get_checksum:
-        return checksum(local_path)
-    else:
+def _is_compressible(local_path, archive_path):
+    """
+    Determines whether a file is worth compressing in the zip archive. Files
+    with the extension of a known compressed format are skipped, otherwise the
+    entropy of a sample from the start of the file is used.
+
+    :arg local_path: The path to the file to read the sample from
+    :arg archive_path: The destination path of the file, this is used for the
+        extension check as the local path may be a decrypted vault tempfile
+    :returns: Whether the file should be deflated
+    """
+    if os.path.splitext(archive_path)[1].lower() in _COMPRESSED_EXTENSIONS:
+        return False
+
+    try:
+        with open(to_bytes(local_path, errors='surrogate_or_strict'), 'rb') as fd:
+            sample = fd.read(_ENTROPY_SAMPLE_SIZE)
+    except (IOError, OSError):
+        # Let zipfile report the error when it tries to add the file
+        return True
+
+    if not sample:
+        return True
+
+    sample_length = len(sample)
+    entropy = 0.0
+    for count in collections.Counter(sample).values():
+        probability = count / sample_length
+        entropy -= probability * math.log(probability, 2)
+
+    return entropy < _ENTROPY_THRESHOLD
+
+
+def _get_local_checksum(get_checksum, local_path, checksum_cache=None, algorithm='sha1'):
+    if not get_checksum or algorithm == 'size_mtime':
         return None
 
+    return checksum_files([local_path], cache=checksum_cache, algorithm=algorithm)[0]
+
+
+def _group_by_common_dir(dests):
+    """
+    Groups the Windows file paths in dests by their common parent directory
+    so each group can be queried and extracted with one module call. Returns
+    a list of (common_dir, [(index, relative_path)]) where index is the
+    position of the path in dests. Paths on different drives or shares, or
+    paths that cannot be compared like an absolute and relative path, are in
+    separate groups.
+    """
+    by_drive = collections.OrderedDict()
+    for idx, dest in enumerate(dests):
+        path = ntpath.normpath(dest)
+        by_drive.setdefault(ntpath.splitdrive(path)[0].lower(), []).append((idx, path))
+
+    groups = []
+    for entries in by_drive.values():
+        try:
+            common_dir = ntpath.commonpath([ntpath.dirname(path) for dummy, path in entries])
+        except ValueError:
+            groups.extend((ntpath.dirname(path), [(idx, ntpath.basename(path))]) for idx, path in entries)
+            continue
+
+        # commonpath keeps the prefix of the first path, the others only
+        # differ by case so the same length is stripped from each
+        groups.append((common_dir, [(idx, path[len(common_dir):].lstrip('\\')) for idx, path in entries]))
+
+    return groups
+
+
+def _dedupe_files(files, existing_files=None):
+    """
+    Splits the files to copy into the unique files that need to be sent and
+    the duplicates that the remote host can copy from a file with the same
+    checksum, either one being sent or one in existing_files that is already
+    up to date on the remote host. Files without a checksum or content are
+    always sent.
+
+    Returns a tuple of the unique files, a list of dicts with the relative
+    src path of a file and the dest paths of its duplicates to copy it to, and
+    the number of bytes that no longer need to be sent.
+    """
+    sources = {}
+    for file in existing_files or []:
+        if file.get('checksum') and file.get('size'):
+            sources.setdefault(file['checksum'], file['dest'])
+
+    unique = []
+    duplicates = collections.OrderedDict()
+    bytes_saved = 0
+    for file in files:
+        file_checksum = file.get('checksum')
+        size = file.get('size')
+        if size is None:
+            size = os.path.getsize(to_bytes(file['src'], errors='surrogate_or_strict'))
+
+        if not file_checksum or not size:
+            unique.append(file)
+        elif file_checksum in sources:
+            duplicates.setdefault(sources[file_checksum], []).append(file['dest'])
+            bytes_saved += size
+        else:
+            sources[file_checksum] = file['dest']
+            unique.append(file)
+
+    return unique, [dict(src=src, dest=dest) for src, dest in duplicates.items()], bytes_saved
+
+
+class _ChunkedWriter:
+    """
+    A write only file like object that splits the data written to it into
+    local chunk files of chunk_size bytes. Once a chunk is full it is passed to
+    callback and deleted so only one chunk is on disk at any time. The final,
+    possibly smaller, chunk is sent when the writer is closed.
+    """
+
+    def __init__(self, tmpdir, chunk_size, callback):
+        self._tmpdir = tmpdir
+        self._chunk_size = chunk_size
+        self._callback = callback
+        self._position = 0
+        self._chunk = None
+        self._chunk_path = None
+        self._chunk_length = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def write(self, data):
+        data = memoryview(data)
+        written = len(data)
+
+        while data:
+            if self._chunk is None:
+                fd, self._chunk_path = tempfile.mkstemp(dir=self._tmpdir)
+                self._chunk = os.fdopen(fd, 'wb')
+                self._chunk_length = 0
+
+            length = min(len(data), self._chunk_size - self._chunk_length)
+            self._chunk.write(data[:length])
+            self._chunk_length += length
+            data = data[length:]
+
+            if self._chunk_length == self._chunk_size:
+                self._send_chunk()
+
+        self._position += written
+        return written
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._chunk is not None:
+            self._send_chunk()
+
+    def _send_chunk(self):
+        self._chunk.close()
+        try:
+            self._callback(self._chunk_path)
+        finally:
+            os.remove(self._chunk_path)
+            self._chunk = None
+            self._chunk_path = None
+
+    def _discard(self):
+        if self._chunk is not None:
+            self._chunk.close()
+            os.remove(self._chunk_path)
+            self._chunk = None
+            self._chunk_path = None
+
+
+class _Timings:
+    """
+    Collects the wall time of each stage of a run along with the bytes and
+    entries it handled, returned as the timings result key. Stages can be
+    nested, the time of an inner stage is not counted in the outer one so the
+    stage times add up to the time spent in them. When not enabled nothing is
+    recorded so the stages can be timed unconditionally.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.bytes = {}
+        self.entries = {}
+        self.remote = {}
+        self._start = time.perf_counter()
+        self._active = []
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        self._active.append([time.perf_counter(), 0.0])
+
+    def _exit(self, name):
+        start, inner = self._active.pop()
+        elapsed = time.perf_counter() - start
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed - inner
+        if self._active:
+            self._active[-1][1] += elapsed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Adds the time spent in the with block to the stage name."""
+        if not self.enabled:
+            yield
+            return
+
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name)
+
+    def iter(self, name, iterable):
+        """
+        Yields the items of iterable, the time spent getting each item is
+        added to the stage name. This times a stage of a generator pipeline
+        separately from the stages consuming it.
+        """
+        if not self.enabled:
+            return iterable
+
+        return self._iter(name, iterable)
+
+    def _iter(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(name)
+
+            yield item
+
+    def add_bytes(self, name, value):
+        """Adds value to the byte count name, this is safe to call from any thread."""
+        if self.enabled:
+            with self._lock:
+                self.bytes[name] = self.bytes.get(name, 0) + value
+
+    def set_entries(self, **counts):
+        if self.enabled:
+            self.entries.update(counts)
+
+    def add_remote(self, mode, timings):
+        """Adds the stage timings returned by a win_copy module call in mode."""
+        if self.enabled and timings:
+            mode_timings = self.remote.setdefault(mode, {})
+            for name, value in timings.items():
+                mode_timings[name] = mode_timings.get(name, 0.0) + value
+
+    def to_dict(self):
+        return dict(
+            total=round(time.perf_counter() - self._start, 6),
+            stages=dict((k, round(v, 6)) for k, v in self.stages.items()),
+            bytes=dict(self.bytes),
+            entries=dict(self.entries),
+            remote=dict((m, dict((k, round(v, 6)) for k, v in t.items())) for m, t in self.remote.items()),
+        )
+
 
 class ActionModule(ActionBase):
 
     WIN_PATH_SEPARATOR = "\\"
 
+    # replaced with an enabled instance by run() when timings=true
+    _timings = _Timings()
+
+    def _execute_win_copy(self, module_args, task_vars):
+        """
+        Runs the win_copy module with module_args. The time of the call and
+        the stage timings returned by the module are added to the timings
+        under the _copy_mode of the call.
+        """
+        copy_mode = module_args.get('_copy_mode', 'single')
+        with self._timings.stage(copy_mode):
+            module_return = self._execute_module(module_name="ansible.windows.win_copy",
+                                                 module_args=module_args,
+                                                 task_vars=task_vars)
+
+        self._timings.add_remote(copy_mode, module_return.pop('timings', None))
+        return module_return
+
+    def _put_file(self, local_path, remote_path):
+        """
+        Transfers local_path to remote_path over the task connection, the
+        time and bytes are added to the transfer timings.
+        """
+        with self._timings.stage('transfer'):
+            self._transfer_file(local_path, remote_path)
+        self._timings.add_bytes('transferred', os.path.getsize(to_bytes(local_path, errors='surrogate_or_strict')))
+
     def _create_content_tempfile(self, content):
         ''' Create a tempfile containing defined content '''
         fd, content_tempfile = tempfile.mkstemp(dir=C.DEFAULT_LOCAL_TMP)
@@ -234,11 +913,7 @@ class ActionModule(ActionBase):
             f.close()
         return content_tempfile
 
-    def _create_zip_tempfile(self, files, directories):
-        tmpdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
-        zip_file_path = os.path.join(tmpdir, "win_copy.zip")
-        zip_file = zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_STORED, True)
-
+    def _write_zip_entries(self, zip_file, files, directories, compression=None):
         # encoding the file/dir name with base64 so Windows can unzip a unicode
         # filename and get the right name, Windows doesn't handle unicode names
         # very well
@@ -249,20 +924,528 @@ class ActionModule(ActionBase):
             encoded_path = to_text(base64.b64encode(archive_path), errors='surrogate_or_strict')
             zip_file.write(directory_path, encoded_path, zipfile.ZIP_DEFLATED)
 
+        compression_mode, compression_level = compression or ('auto', 6)
         for file in files:
             file_path = to_bytes(file['src'], errors='surrogate_or_strict')
             archive_path = to_bytes(file['dest'], errors='surrogate_or_strict')
 
+            if compression_mode == 'always' or (compression_mode == 'auto' and _is_compressible(file['src'], file['dest'])):
+                compress_type = zipfile.ZIP_DEFLATED
+            else:
+                compress_type = zipfile.ZIP_STORED
+
             encoded_path = to_text(base64.b64encode(archive_path), errors='surrogate_or_strict')
-            zip_file.write(file_path, encoded_path, zipfile.ZIP_DEFLATED)
+            zip_file.write(file_path, encoded_path, compress_type, compression_level)
+
+    def _create_zip_tempfile(self, files, directories, compression=None):
+        tmpdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
+        zip_file_path = os.path.join(tmpdir, "win_copy.zip")
+        try:
+            with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_STORED, True) as zip_file:
+                self._write_zip_entries(zip_file, files, directories, compression=compression)
+        except BaseException:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
 
         return zip_file_path
 
-    def _remove_tempfile_if_content_defined(self, content, content_tempfile):
-        if content is not None:
+    def _transfer_zip_stream(self, files, directories, tmp_src, chunk_size, compression=None):
+        """
+        Builds the zip archive in chunks of chunk_size bytes, each chunk is
+        transferred to the remote host as soon as it is complete and removed
+        locally. Returns the list of remote paths of the parts in order so the
+        module can join them back into tmp_src.
+        """
+        src_parts = []
+
+        def upload_part(part_path):
+            remote_part = "%s.%d" % (tmp_src, len(src_parts))
+            self._put_file(part_path, remote_part)
+            src_parts.append(remote_part)
+
+        tmpdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
+        try:
+            with _ChunkedWriter(tmpdir, chunk_size, upload_part) as writer:
+                # The writer is not seekable so zipfile uses data descriptors
+                # rather than going back to update each local file header.
+                with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED, True) as zip_file:
+                    self._write_zip_entries(zip_file, files, directories, compression=compression)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        return src_parts
+
+    def _create_manifest_tempfile(self, entries):
+        """
+        Creates the gzip compressed manifest of a directory copy that is sent
+        to the remote host for the query. Each line after the header is a tab
+        separated entry of the type, size, mtime, checksum and relative
+        destination path. Windows does not allow a tab or newline in a path so
+        no escaping is needed.
+        """
+        fd, manifest_path = tempfile.mkstemp(dir=C.DEFAULT_LOCAL_TMP, suffix='.gz')
+        try:
+            with os.fdopen(fd, 'wb') as b_file, gzip.GzipFile(fileobj=b_file, mode='wb') as manifest:
+                lines = [_MANIFEST_HEADER]
+                for entry in entries:
+                    if entry['type'] == 'd':
+                        lines.append(u"d\t\t\t\t%s" % entry['dest'])
+                    else:
+                        lines.append(u"f\t%d\t%d\t%s\t%s" % (entry['size'], entry['mtime'], entry['checksum'] or u'', entry['dest']))
+
+                    if len(lines) >= 1024:
+                        manifest.write(to_bytes(u"\n".join(lines) + u"\n", errors='surrogate_or_strict'))
+                        lines = []
+
+                if lines:
+                    manifest.write(to_bytes(u"\n".join(lines) + u"\n", errors='surrogate_or_strict'))
+        except BaseException:
+            # the entries are walked and hashed while the manifest is written,
+            # remove it whatever stopped the walk
+            os.remove(manifest_path)
+            raise
+
+        return manifest_path
+
+    def _transfer_manifest(self, entries, tmp):
+        """
+        Creates the manifest of a directory copy from an iterable of
+        _WalkEntry objects and transfers it to tmp. Each entry is written as
+        it is yielded so the walk, hashing and manifest are done as one
+        stream.
+
+        The entries are not kept in memory, they are also written to a local
+        index file that the query reads back to map the changed entries to
+        their local source. Returns a dict with the path of the local index,
+        which the caller must remove, the number of files and directories,
+        the total size of the files, the symlinks to create and the remote
+        path of the manifest.
+        """
+        manifest = dict(files=0, directories=0, size=0, symlinks=[],
+                        path=self._connection._shell.join_path(tmp, 'manifest.gz'))
+
+        fd, manifest['index'] = tempfile.mkstemp(dir=C.DEFAULT_LOCAL_TMP, suffix='.json')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as index:
+                def manifest_entries():
+                    for entry in entries:
+                        if entry.type == 'l':
+                            manifest['symlinks'].append(entry.to_dict())
+                            continue
+
+                        if entry.type == 'f':
+                            manifest['files'] += 1
+                            manifest['size'] += entry.size or 0
+                        else:
+                            manifest['directories'] += 1
+                        index.write(json.dumps([entry.type, entry.src, entry.dest, entry.checksum, entry.size,
+                                                entry.mtime]) + "\n")
+                        yield entry
+
+                local_manifest = self._create_manifest_tempfile(manifest_entries())
+
+            try:
+                self._put_file(local_manifest, manifest['path'])
+            finally:
+                os.remove(local_manifest)
+        except BaseException:
+            os.remove(manifest['index'])
+            raise
+
+        return manifest
+
+    def _query_manifest(self, dest, force, manifest, task_vars, mirror_root=None, mirror_recurse=False):
+        """
+        Runs the query for a directory copy using the manifest returned by
+        _transfer_manifest rather than sending every entry as a module
+        argument. The remote side compares the size and mtime of each file
+        first and only calculates the checksum when they differ. Returns the
+        query result with the files and directories that need to be copied.
+
+        When mirror_root is set, the path relative to dest of the directory
+        being mirrored, the result also contains the extra_entries inside it
+        that are not in the manifest. The entries inside an extra directory
+        are only returned with mirror_recurse, this is needed when some of
+        them may be kept by the exclude or include patterns.
+        """
+        query_args = self._task.args.copy()
+        query_args.update(
+            dict(
+                _copy_mode="query",
+                _manifest=manifest['path'],
+                dest=dest,
+                force=force,
+                mirror=mirror_root is not None,
+                symlinks=manifest['symlinks'],
+            )
+        )
+        if mirror_root is not None:
+            query_args['_mirror_root'] = mirror_root
+            query_args['_mirror_recurse'] = mirror_recurse
+        query_args.pop('src', None)
+        query_args.pop('content', None)
+        query_return = self._execute_win_copy(query_args, task_vars)
+        if query_return.get('failed') is True:
+            return query_return
+
+        # only the changed entries are read from the local index into memory
+        changed_idx = set(query_return.pop('changed_entries', []))
+        changed_entries = [e for idx, e in enumerate(_iter_manifest_index(manifest['index'])) if idx in changed_idx]
+        query_return['files'] = [e for e in changed_entries if e['type'] == 'f']
+        query_return['directories'] = [e for e in changed_entries if e['type'] == 'd']
+
+        # an unchanged file is only needed as the source of a changed file
+        # with the same content
+        checksums = set(e['checksum'] for e in query_return['files'] if e['checksum'])
+        query_return['unchanged_files'] = []
+        if checksums:
+            query_return['unchanged_files'] = [
+                e for idx, e in enumerate(_iter_manifest_index(manifest['index']))
+                if e['type'] == 'f' and idx not in changed_idx and e['checksum'] in checksums
+            ]
+        query_return['manifest'] = manifest['path']
+
+        return query_return
+
+    def _get_mirror_purge(self, query_return, mirror_root, path_filter=None):
+        """
+        Gets the paths, relative to dest, of the extra entries from the query
+        that are removed to mirror the source directory. An entry that the
+        exclude or include patterns would skip is kept as it is not part of
+        the copy, as is everything inside a kept directory.
+
+        The extra entries are in walk order, a directory before the entries
+        inside it. An extra directory is removed as a whole unless an entry
+        inside it is kept, then only the entries inside it that are not kept
+        are removed.
+        """
+        extras = query_return.pop('extra_entries', None) or []
+        sep = self.WIN_PATH_SEPARATOR
+
+        def parents(path):
+            parts = path.split(sep)
+            return [sep.join(parts[:idx]) for idx in range(1, len(parts))]
+
+        kept = set()
+        kept_parents = set()
+        for extra in extras:
+            rel_path = extra['dest'].replace(sep, '/')
+            if mirror_root:
+                rel_path = rel_path[len(mirror_root) + 1:]
+            if any(p in kept for p in parents(extra['dest'])) or \
+                    (path_filter is not None and not path_filter(rel_path, extra['directory'])):
+                kept.add(extra['dest'])
+                kept_parents.update(parents(extra['dest']))
+
+        purge = []
+        removed_dirs = set()
+        for extra in extras:
+            if extra['dest'] in kept or any(p in removed_dirs for p in parents(extra['dest'])):
+                continue
+            if extra['directory']:
+                if extra['dest'] in kept_parents:
+                    continue
+                removed_dirs.add(extra['dest'])
+            purge.append(extra['dest'])
+
+        return purge
+
+    def _get_query_dest(self, dest, original_basename):
+        """
+        Gets the dest to copy to, the dest to query and the remote filename
+        of a single file copy. original_basename is None when copying a
+        directory.
+        """
+        if original_basename is None:
+            # If it's recursive copy, destination is always a dir,
+            # explicitly mark it so (note - win_copy module relies on this).
+            if not self._connection._shell.path_has_trailing_slash(dest):
+                dest = "%s%s" % (dest, self.WIN_PATH_SEPARATOR)
+
+            return dest, dest, None
+
+        # check if dest ends with / or \ and append source filename to dest
+        if self._connection._shell.path_has_trailing_slash(dest):
+            return dest, dest, original_basename
+
+        # replace \\ with / so we can use os.path to get the filename or dirname
+        unix_path = dest.replace(self.WIN_PATH_SEPARATOR, os.path.sep)
+        return dest, os.path.dirname(unix_path), os.path.basename(unix_path)
+
+    def _get_chunk_size(self):
+        chunk_size = self._task.args.get('chunk_size', None)
+        if chunk_size is None:
+            return None
+
+        try:
+            chunk_size = human_to_bytes(chunk_size)
+        except ValueError as e:
+            raise AnsibleActionFail("chunk_size is invalid: %s" % to_native(e))
+
+        if chunk_size < 1:
+            raise AnsibleActionFail("chunk_size must be greater than 0")
+
+        return chunk_size
+
+    def _get_transfer_streams(self):
+        try:
+            streams = check_type_int(self._task.args.get('transfer_streams', 1))
+        except TypeError as e:
+            raise AnsibleActionFail("transfer_streams is invalid: %s" % to_native(e))
+
+        if streams < 1:
+            raise AnsibleActionFail("transfer_streams must be greater than 0")
+
+        return streams
+
+    def _get_compression(self):
+        mode = self._task.args.get('compression', 'auto')
+        if mode not in ('always', 'auto', 'never'):
+            raise AnsibleActionFail("compression must be one of: always, auto, never")
+
+        try:
+            level = check_type_int(self._task.args.get('compression_level', 6))
+        except TypeError as e:
+            raise AnsibleActionFail("compression_level is invalid: %s" % to_native(e))
+
+        if level < 1 or level > 9:
+            raise AnsibleActionFail("compression_level must be between 1 and 9")
+
+        return mode, level
+
+    def _get_path_filter(self):
+        patterns = {}
+        for name in ['exclude', 'include']:
+            try:
+                patterns[name] = [to_text(p, errors='surrogate_or_strict') for p in check_type_list(self._task.args.get(name) or [])]
+            except TypeError as e:
+                raise AnsibleActionFail("%s is invalid: %s" % (name, to_native(e)))
+
+        return _get_path_filter(**patterns)
+
+    def _get_checksum_algorithm(self):
+        algorithm = self._task.args.get('checksum_algorithm', 'sha1')
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise AnsibleActionFail("checksum_algorithm must be one of: %s" % ", ".join(CHECKSUM_ALGORITHMS))
+
+        return algorithm
+
+    def _get_transfer_options(self, rendered=False):
+        """
+        Gets the chunk_size, compression, transfer_streams, path filter and
+        checksum_algorithm options of the task. rendered is set when the
+        content is rendered in memory, which has no mtime to compare.
+        """
+        chunk_size = self._get_chunk_size()
+        compression = self._get_compression()
+        streams = self._get_transfer_streams()
+        path_filter = self._get_path_filter()
+        algorithm = self._get_checksum_algorithm()
+        if rendered and algorithm == 'size_mtime':
+            raise AnsibleActionFail("checksum_algorithm=size_mtime cannot be used with rendered content as it has "
+                                    "no modification time")
+
+        return chunk_size, compression, streams, path_filter, algorithm
+
+    def _get_checksum_cache(self, force, algorithm='sha1'):
+        # nothing is cached on the controller unless local_checksum_cache is set
+        cache_path = self._task.args.get('local_checksum_cache', None)
+        if not force or not cache_path or algorithm == 'size_mtime':
+            return None
+
+        return LocalChecksumCache(os.path.expanduser(to_text(cache_path, errors='surrogate_or_strict')),
+                                  algorithm=algorithm)
+
+    def _remove_content_tempfile(self, content_tempfile):
+        # the tempfile of rendered content is only created when the remote
+        # file is out of date
+        if content_tempfile is not None:
             os.remove(content_tempfile)
 
-    def _copy_single_file(self, local_file, dest, source_rel, dest_rel, task_vars, tmp, backup):
+    def _create_chunk_tempfile(self, src_file, chunk_size):
+        """
+        Copies the next chunk_size bytes of src_file to a local temp file.
+        Returns the path of the temp file and the SHA1 checksum of the chunk.
+        """
+        sha1 = hashlib.sha1()
+        fd, chunk_path = tempfile.mkstemp(dir=C.DEFAULT_LOCAL_TMP)
+        try:
+            with os.fdopen(fd, 'wb') as chunk_file:
+                remaining = chunk_size
+                while remaining:
+                    data = src_file.read(min(remaining, 1024 * 1024))
+                    if not data:
+                        break
+                    sha1.update(data)
+                    chunk_file.write(data)
+                    remaining -= len(data)
+        except Exception:
+            os.remove(chunk_path)
+            raise
+
+        return chunk_path, sha1.hexdigest()
+
+    def _create_transfer_connection(self):
+        """
+        Creates a new connection to the host with the same options as the task
+        connection, used to transfer a file part in parallel.
+        """
+        connection = self._shared_loader_obj.connection_loader.get(
+            self._connection._load_name,
+            self._play_context,
+            new_stdin=None,
+            task_uuid=self._task._uuid,
+            ansible_playbook_pid=to_text(os.getppid()),
+        )
+        try:
+            var_options = {}
+            if self._connection.has_option('_extras'):
+                var_options['_extras'] = self._connection.get_option('_extras')
+            connection.set_options(var_options=var_options, direct=self._connection.get_options())
+        except BaseException:
+            connection.close()
+            raise
+
+        return connection
+
+    def _transfer_file_streams(self, local_path, remote_path, streams):
+        """
+        Splits local_path into up to streams parts and transfers them in
+        parallel, the first part over the task connection and each other part
+        over its own connection to the host. Returns the remote paths of the
+        parts in order for the win_copy module to join, or None if the file
+        was small enough to be transferred as is to remote_path.
+        """
+        b_local_path = to_bytes(local_path, errors='surrogate_or_strict')
+        size = os.path.getsize(b_local_path)
+        streams = min(streams, int(math.ceil(size / float(_MIN_STREAM_PART_SIZE))))
+        if streams < 2:
+            self._put_file(local_path, remote_path)
+            return None
+
+        part_size = int(math.ceil(size / float(streams)))
+        streams = int(math.ceil(size / float(part_size)))
+        put_file = [self._transfer_file]
+        connections = []
+        self._timings.add_bytes('transferred', size)
+        with self._timings.stage('transfer'):
+            try:
+                for dummy in range(streams - 1):
+                    connection = self._create_transfer_connection()
+                    connections.append(connection)
+                    put_file.append(connection.put_file)
+
+                def transfer_part(idx):
+                    with open(b_local_path, 'rb') as src_file:
+                        src_file.seek(idx * part_size)
+                        part_path = self._create_chunk_tempfile(src_file, part_size)[0]
+
+                    remote_part = "%s.%d" % (remote_path, idx)
+                    try:
+                        put_file[idx](part_path, remote_part)
+                    finally:
+                        os.remove(part_path)
+
+                    return remote_part
+
+                with ThreadPoolExecutor(max_workers=streams) as executor:
+                    return list(executor.map(transfer_part, range(streams)))
+            finally:
+                # a failure to close one connection should not leave the
+                # others open or hide the error of the transfer
+                for connection in connections:
+                    try:
+                        connection.close()
+                    except Exception as e:
+                        display.warning("Failed to close transfer connection: %s" % to_text(e))
+
+    def _stage_single_file(self, local_file, dest, source_rel, task_vars, tmp, chunk_size, file_checksum):
+        """
+        Sends a single file in chunks of chunk_size to a staging file next to
+        dest. The remote host verifies the checksum of each chunk before it is
+        appended and records the offset of the last good chunk. After a
+        connection failure the connection is reset and the transfer resumes
+        from that offset, a failed task also resumes from it on the next run.
+        Returns the result of the last stage call which contains the
+        staging_path.
+        """
+        stage_args = self._task.args.copy()
+        stage_args.update(
+            dict(
+                dest=dest,
+                _original_basename=source_rel,
+                _copy_mode="stage",
+                _checksum=file_checksum,
+            )
+        )
+        stage_args.pop('src', None)
+        stage_args.pop('content', None)
+
+        tmp_src = self._connection._shell.join_path(tmp, 'source.chunk')
+        b_local_file = to_bytes(local_file, errors='surrogate_or_strict')
+        file_size = os.path.getsize(b_local_file)
+        host = task_vars.get('inventory_hostname', None)
+
+        offset = None
+        failures = 0
+        with open(b_local_file, 'rb') as src_file:
+            while True:
+                try:
+                    if offset is None:
+                        # get the offset of the last chunk the remote host
+                        # verified, this resumes an interrupted transfer
+                        stage_return = self._execute_win_copy(stage_args, task_vars)
+                        if stage_return.get('failed') is True:
+                            return stage_return
+                        offset = stage_return['offset']
+                        if offset:
+                            display.vv("Resuming the transfer of %s at offset %d" % (local_file, offset), host=host)
+
+                    if offset >= file_size:
+                        return stage_return
+
+                    src_file.seek(offset)
+                    chunk_path, chunk_checksum = self._create_chunk_tempfile(src_file, chunk_size)
+                    try:
+                        self._put_file(chunk_path, tmp_src)
+                    finally:
+                        os.remove(chunk_path)
+
+                    chunk_args = stage_args.copy()
+                    chunk_args.update(
+                        dict(
+                            src=tmp_src,
+                            _offset=offset,
+                            _chunk_checksum=chunk_checksum,
+                        )
+                    )
+                    stage_return = self._execute_win_copy(chunk_args, task_vars)
+                except AnsibleConnectionFailure as e:
+                    failures += 1
+                    if failures > _STAGE_RETRIES:
+                        raise
+
+                    display.vv("Connection failure when staging %s, resetting the connection and resuming: %s"
+                               % (local_file, to_text(e)), host=host)
+                    self._connection.reset()
+                    offset = None
+                    continue
+
+                if stage_return.get('failed') is True:
+                    failures += 1
+                    if failures > _STAGE_RETRIES:
+                        return stage_return
+
+                    display.vv("Failed to stage the chunk of %s at offset %d, retrying: %s"
+                               % (local_file, offset, stage_return.get('msg', '')), host=host)
+                    offset = None
+                    continue
+
+                failures = 0
+                offset = stage_return['offset']
+
+    def _copy_single_file(self, local_file, dest, source_rel, dest_rel, task_vars, tmp, backup, mtime=None,
+                          checksum=None, chunk_size=None, streams=1):
         if self._task.check_mode:
             module_return = dict(changed=True)
             if backup:
@@ -270,9 +1453,22 @@ class ActionModule(ActionBase):
 
             return module_return
 
-        # copy the file across to the server
-        tmp_src = self._connection._shell.join_path(tmp, 'source')
-        self._transfer_file(local_file, tmp_src)
+        # copy the file across to the server, a file larger than chunk_size is
+        # staged in chunks next to dest so the transfer can be resumed
+        staged = False
+        src_parts = None
+        if chunk_size and os.path.getsize(to_bytes(local_file, errors='surrogate_or_strict')) > chunk_size:
+            file_checksum = checksum or _get_local_checksum(True, local_file)
+            stage_return = self._stage_single_file(local_file, dest, source_rel, task_vars, tmp, chunk_size,
+                                                   file_checksum)
+            if stage_return.get('failed') is True:
+                return stage_return
+
+            tmp_src = stage_return['staging_path']
+            staged = True
+        else:
+            tmp_src = self._connection._shell.join_path(tmp, 'source')
+            src_parts = self._transfer_file_streams(local_file, tmp_src, streams)
 
         copy_args = self._task.args.copy()
         copy_args.update(
@@ -281,26 +1477,39 @@ class ActionModule(ActionBase):
                 src=tmp_src,
                 _original_basename=source_rel,
                 _copy_mode="single",
+                _mtime=mtime,
+                _checksum=checksum,
+                _src_staged=staged,
+                _src_parts=src_parts,
                 backup=backup,
             )
         )
         copy_args.pop('content', None)
 
-        copy_result = self._execute_module(module_name="ansible.windows.win_copy",
-                                           module_args=copy_args,
-                                           task_vars=task_vars)
+        copy_result = self._execute_win_copy(copy_args, task_vars)
 
         return copy_result
 
-    def _copy_zip_file(self, dest, files, directories, task_vars, tmp, backup):
-        # create local zip file containing all the files and directories that
-        # need to be copied to the server
-        if self._task.check_mode:
-            module_return = dict(changed=True)
-            return module_return
+    def _transfer_zip_file(self, files, directories, tmp, chunk_size=None, compression=None, streams=1):
+        """
+        Creates the zip archive of the files and directories and transfers it
+        to the remote host. Returns the remote path of the archive, the list of
+        remote parts explode needs to join into it, if any, and the failure
+        result if the archive could not be created.
+        """
+        # send zip file to remote, file must end in .zip so
+        # Com Shell.Application works
+        tmp_src = self._connection._shell.join_path(tmp, 'source.zip')
 
+        zip_path = None
+        src_parts = None
         try:
-            zip_file = self._create_zip_tempfile(files, directories)
+            with self._timings.stage('zip'):
+                if chunk_size:
+                    src_parts = self._transfer_zip_stream(files, directories, tmp_src, chunk_size,
+                                                          compression=compression)
+                else:
+                    zip_file = self._create_zip_tempfile(files, directories, compression=compression)
         except Exception as e:
             module_return = dict(
                 changed=False,
@@ -308,15 +1517,19 @@ class ActionModule(ActionBase):
                 msg="failed to create tmp zip file: %s" % to_text(e),
                 exception=traceback.format_exc()
             )
-            return module_return
+            return tmp_src, None, module_return
 
-        zip_path = self._loader.get_real_file(zip_file)
+        if src_parts is None:
+            zip_path = self._loader.get_real_file(zip_file)
+            try:
+                src_parts = self._transfer_file_streams(zip_path, tmp_src, streams)
+            finally:
+                shutil.rmtree(os.path.dirname(zip_path))
 
-        # send zip file to remote, file must end in .zip so
-        # Com Shell.Application works
-        tmp_src = self._connection._shell.join_path(tmp, 'source.zip')
-        self._transfer_file(zip_path, tmp_src)
+        return tmp_src, src_parts, None
 
+    def _explode_zip_file(self, dest, tmp_src, task_vars, backup, src_parts=None, manifest=None, symlinks=None,
+                          duplicates=None, purge=None):
         # run the explode operation of win_copy on remote
         copy_args = self._task.args.copy()
         copy_args.update(
@@ -324,18 +1537,298 @@ class ActionModule(ActionBase):
                 src=tmp_src,
                 dest=dest,
                 _copy_mode="explode",
+                _src_parts=src_parts,
+                _manifest=manifest,
+                symlinks=symlinks,
+                _duplicates=duplicates,
+                _purge=purge,
                 backup=backup,
             )
         )
         copy_args.pop('content', None)
-        module_return = self._execute_module(module_name='ansible.windows.win_copy',
-                                             module_args=copy_args,
-                                             task_vars=task_vars)
-        shutil.rmtree(os.path.dirname(zip_path))
-        return module_return
+        return self._execute_win_copy(copy_args, task_vars)
+
+    def _copy_zip_file(self, dest, files, directories, task_vars, tmp, backup, chunk_size=None, compression=None,
+                       manifest=None, streams=1, symlinks=None, duplicates=None, purge=None):
+        # create local zip file containing all the files and directories that
+        # need to be copied to the server
+        if self._task.check_mode:
+            module_return = dict(changed=True)
+            return module_return
+
+        tmp_src, src_parts, failed_return = self._transfer_zip_file(files, directories, tmp, chunk_size=chunk_size,
+                                                                    compression=compression, streams=streams)
+        if failed_return:
+            return failed_return
+
+        return self._explode_zip_file(dest, tmp_src, task_vars, backup, src_parts=src_parts, manifest=manifest,
+                                      symlinks=symlinks, duplicates=duplicates, purge=purge)
+
+    def _copy_to_dests(self, dests, source_files, original_basename, force, backup, task_vars, manifest=None,
+                       chunk_size=None, compression=None, streams=1, mirror_root=None, path_filter=None,
+                       algorithm='sha1'):
+        """
+        Copies the source to multiple dests. The source is walked, hashed and
+        transferred once, each dest is then queried and only the dests with
+        changes have the transferred file copied or archive extracted to them.
+        The changed entries of every dest are sent in one archive so each
+        changed dest may have some unchanged files extracted again.
+        """
+        if self._connection._shell.tmpdir is None:
+            self._connection._shell.tmpdir = self._make_tmp_path()
+        tmp = self._connection._shell.tmpdir
+
+        bytes_saved = 0
+        dest_results = []
+        changed_dests = []
+        files = collections.OrderedDict()
+        directories = collections.OrderedDict()
+        symlinks = collections.OrderedDict()
+        for dest in dests:
+            dest, check_dest, filename = self._get_query_dest(dest, original_basename)
+            dest_result = dict(dest=dest, changed=False)
+            dest_results.append(dest_result)
+
+            if original_basename is None:
+                query_return = self._query_manifest(check_dest, force, manifest, task_vars, mirror_root=mirror_root,
+                                                    mirror_recurse=path_filter is not None)
+            else:
+                query_args = self._task.args.copy()
+                query_args.update(
+                    dict(
+                        _copy_mode="query",
+                        dest=check_dest,
+                        force=force,
+                        files=[dict(source_files['files'][0], dest=filename)],
+                        directories=[],
+                        symlinks=[],
+                    )
+                )
+                query_args.pop('src', None)
+                query_args.pop('content', None)
+                query_return = self._execute_win_copy(query_args, task_vars)
+                if original_basename and self._connection._shell.path_has_trailing_slash(dest):
+                    dest_result['dest'] = self._connection._shell.join_path(dest, filename)
+
+            if query_return.get('failed') is True:
+                dest_result.update(query_return)
+                continue
+
+            dest_symlinks = query_return.get('symlinks') or []
+            purge = []
+            if mirror_root is not None:
+                purge = self._get_mirror_purge(query_return, mirror_root, path_filter=path_filter)
+                dest_result['removed'] = purge
+            if not (query_return['files'] or query_return['directories'] or dest_symlinks or purge):
+                continue
+
+            changed_dests.append((dest_result, dest, purge))
+            for file in query_return['files']:
+                files.setdefault(file['dest'], file)
+            for directory in query_return['directories']:
+                directories.setdefault(directory['dest'], directory)
+            for symlink in dest_symlinks:
+                symlinks.setdefault(symlink['dest'], symlink)
+
+        self._timings.set_entries(changed=len(files) + len(directories) + len(symlinks)
+                                  + sum(len(purge) for dummy, dummy, purge in changed_dests))
+        if changed_dests and self._task.check_mode:
+            for dest_result, dummy, dummy in changed_dests:
+                dest_result['changed'] = True
+        elif changed_dests and original_basename is not None:
+            # send the single file once and copy it to each dest that differs
+            tmp_src = self._connection._shell.join_path(tmp, 'source')
+            src_parts = self._transfer_file_streams(source_files['files'][0]['src'], tmp_src, streams)
+            for dest_result, dest, dummy in changed_dests:
+                copy_args = self._task.args.copy()
+                copy_args.update(
+                    dict(
+                        dest=dest,
+                        src=tmp_src,
+                        _original_basename=original_basename,
+                        _copy_mode="single",
+                        _mtime=source_files['files'][0].get('mtime'),
+                        _src_parts=src_parts,
+                        backup=backup,
+                    )
+                )
+                copy_args.pop('content', None)
+                dest_result.update(self._execute_win_copy(copy_args, task_vars))
+                dest_result['changed'] = True
+                # the parts are joined into tmp_src by the first copy
+                src_parts = None
+        elif changed_dests:
+            unique, duplicates = list(files.values()), []
+            if algorithm in _DEDUPE_ALGORITHMS:
+                unique, duplicates, bytes_saved = _dedupe_files(unique)
+            tmp_src, src_parts, failed_return = self._transfer_zip_file(unique, list(directories.values()), tmp,
+                                                                        chunk_size=chunk_size, compression=compression,
+                                                                        streams=streams)
+            for dest_result, dest, purge in changed_dests:
+                if failed_return:
+                    dest_result.update(failed_return)
+                    continue
+
+                dest_result.update(self._explode_zip_file(dest, tmp_src, task_vars, backup, src_parts=src_parts,
+                                                          manifest=manifest['path'], symlinks=list(symlinks.values()),
+                                                          duplicates=duplicates, purge=purge))
+                dest_result['changed'] = True
+                src_parts = None
+
+        result = dict(
+            changed=any(r['changed'] for r in dest_results),
+            dest=[r['dest'] for r in dest_results],
+            destinations=dest_results,
+        )
+        if bytes_saved:
+            result['bytes_saved'] = bytes_saved
+
+        failed = [r for r in dest_results if r.get('failed') is True]
+        if failed:
+            result['failed'] = True
+            result['msg'] = "failed to copy to %d of %d dests, first failure for %s: %s" \
+                % (len(failed), len(dest_results), failed[0]['dest'], failed[0].get('msg', ''))
+
+        return result
+
+    def run_rendered(self, basename, b_content, task_vars=None):
+        """
+        Copies content rendered in memory, like the output of win_template,
+        to dest as if it was the local file basename. The checksum of
+        b_content is sent with the query and it is only written to a local
+        tempfile and transferred when the remote file is out of date.
+        """
+        return self._run_copy(None, task_vars, rendered=(basename, b_content))
+
+    def run_rendered_files(self, rendered, task_vars=None):
+        """
+        Copies multiple contents rendered in memory, like the templates of a
+        win_template task, a list of dicts with the local src, dest and
+        content of each file. A dest ending with a path separator gets the
+        file name of src.
+
+        The dests are grouped by their common parent directory, one group
+        unless they are on different drives, and each group is queried with
+        one module call. The changed contents are then written to local
+        tempfiles and sent in one archive that explode extracts into the
+        common directory, creating any missing parent directories.
+        """
+        if task_vars is None:
+            task_vars = dict()
+
+        self._timings = _Timings(enabled=boolean(self._task.args.get('timings', False), strict=False))
+        result = super(ActionModule, self).run(task_vars=task_vars)
+        force = boolean(self._task.args.get('force', True), strict=False)
+
+        try:
+            chunk_size, compression, streams, dummy, algorithm = self._get_transfer_options(rendered=True)
+        except AnsibleActionFail as e:
+            result['failed'] = True
+            result['msg'] = to_text(e)
+            return result
+
+        files = []
+        for rendered_file in rendered:
+            dest = rendered_file['dest']
+            if self._connection._shell.path_has_trailing_slash(dest):
+                dest = self._connection._shell.join_path(dest, os.path.basename(rendered_file['src']))
+
+            file_checksum = None
+            if force:
+                with self._timings.stage('hash'):
+                    file_checksum = checksum_data(rendered_file['content'], algorithm=algorithm)
+            files.append(dict(src=rendered_file['src'], dest=dest, changed=False, checksum=file_checksum,
+                              size=len(rendered_file['content'])))
+            self._timings.add_bytes('source', len(rendered_file['content']))
+        self._timings.set_entries(files=len(files), directories=0, symlinks=0)
+
+        local_tempdir = None
+        try:
+            for common_dir, entries in _group_by_common_dir([f['dest'] for f in files]):
+                query_args = self._task.args.copy()
+                query_args.update(
+                    dict(
+                        _copy_mode="query",
+                        dest=common_dir,
+                        force=force,
+                        files=[dict(src=os.path.basename(files[idx]['src']), dest=name, checksum=files[idx]['checksum'],
+                                    index=idx) for idx, name in entries],
+                        directories=[],
+                        symlinks=[],
+                    )
+                )
+                query_args.pop('src', None)
+                query_args.pop('content', None)
+                query_return = self._execute_win_copy(query_args, task_vars)
+                if query_return.get('failed') is True:
+                    result.update(query_return)
+                    return result
+
+                # the query sets the dest of a file whose dest is an existing
+                # directory to the file of that name in the directory
+                changed_files = query_return['files']
+                for changed_file in changed_files:
+                    files[changed_file['index']]['changed'] = True
+                if not changed_files or self._task.check_mode:
+                    continue
+
+                if local_tempdir is None:
+                    local_tempdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
+                zip_files = []
+                for changed_file in changed_files:
+                    local_path = os.path.join(local_tempdir, str(changed_file['index']))
+                    with open(to_bytes(local_path, errors='surrogate_or_strict'), 'wb') as fd:
+                        fd.write(rendered[changed_file['index']]['content'])
+                    zip_files.append(dict(src=local_path, dest=changed_file['dest']))
+
+                if self._connection._shell.tmpdir is None:
+                    self._connection._shell.tmpdir = self._make_tmp_path()
+                copy_return = self._copy_zip_file(common_dir, zip_files, [], task_vars, self._connection._shell.tmpdir,
+                                                  False, chunk_size=chunk_size, compression=compression,
+                                                  streams=streams)
+                if copy_return.get('failed') is True:
+                    result.update(copy_return)
+                    return result
+        finally:
+            if local_tempdir is not None:
+                shutil.rmtree(to_bytes(local_tempdir, errors='surrogate_or_strict'))
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+
+            self._timings.set_entries(changed=len([f for f in files if f['changed']]))
+            if self._timings.enabled:
+                result['timings'] = self._timings.to_dict()
+
+        result['changed'] = any(f['changed'] for f in files)
+        result['dest'] = [f['dest'] for f in files]
+        result['files'] = files
+        return result
 
     def run(self, tmp=None, task_vars=None):
         ''' handler for file transfer operations '''
+        return self._run_copy(tmp, task_vars)
+
+    def _run_copy(self, tmp, task_vars, rendered=None):
+        # the vault files decrypted for the copy and the local tempfiles kept
+        # for the whole copy are removed together once it is done rather than
+        # being left until the worker exits
+        self._timings = _Timings(enabled=boolean(self._task.args.get('timings', False), strict=False))
+        vault_tempfiles = []
+        local_tempfiles = []
+        try:
+            result = self._run(tmp, task_vars, vault_tempfiles, local_tempfiles, rendered=rendered)
+        finally:
+            for vault_tempfile in vault_tempfiles:
+                self._loader.cleanup_tmp_file(vault_tempfile)
+            for local_tempfile in local_tempfiles:
+                os.remove(local_tempfile)
+
+        if self._timings.enabled:
+            result['timings'] = self._timings.to_dict()
+        return result
+
+    def _run(self, tmp, task_vars, vault_tempfiles, local_tempfiles, rendered=None):
+        # rendered is the (basename, b_content) of content rendered in memory
+        # by run_rendered(), it is copied as if it was the local file basename
         if task_vars is None:
             task_vars = dict()
 
@@ -350,25 +1843,43 @@ class ActionModule(ActionBase):
         force = boolean(self._task.args.get('force', True), strict=False)
         decrypt = boolean(self._task.args.get('decrypt', True), strict=False)
         backup = boolean(self._task.args.get('backup', False), strict=False)
+        mirror = boolean(self._task.args.get('mirror', False), strict=False)
 
         result['src'] = source
         result['dest'] = dest
 
+        # dest can be a list of paths to copy the same source to, the source
+        # is walked, hashed and sent once for all of them
+        dests = dest if isinstance(dest, list) else [dest]
+        if len(dests) == 1:
+            dest = dests[0]
+
         result['failed'] = True
-        if (source is None and content is None) or dest is None:
+        if (source is None and content is None and rendered is None) or not dests or any(d is None for d in dests):
             result['msg'] = "src (or content) and dest are required"
         elif source is not None and content is not None:
             result['msg'] = "src and content are mutually exclusive"
-        elif content is not None and dest is not None and (
-                dest.endswith(os.path.sep) or dest.endswith(self.WIN_PATH_SEPARATOR)):
+        elif content is not None and any(d.endswith(os.path.sep) or d.endswith(self.WIN_PATH_SEPARATOR) for d in dests):
             result['msg'] = "dest must be a file if content is defined"
+        elif remote_src and len(dests) > 1:
+            result['msg'] = "dest must be a single path when remote_src=True"
+        elif remote_src and mirror:
+            result['msg'] = "mirror is not supported when remote_src=True"
         else:
             del result['failed']
 
+        try:
+            chunk_size, compression, streams, path_filter, algorithm = self._get_transfer_options(rendered=rendered is not None)
+        except AnsibleActionFail as e:
+            result['failed'] = True
+            result['msg'] = to_text(e)
+
         if result.get('failed'):
             return result
 
         # If content is defined make a temp file and write the content into it
+        # the rendered content is only written to a tempfile once it is known
+        # to be needed
         content_tempfile = None
         if content is not None:
             try:
@@ -396,13 +1907,11 @@ class ActionModule(ActionBase):
                 )
             )
             new_module_args.pop('content', None)
-            result.update(self._execute_module(module_name="ansible.windows.win_copy",
-                                               module_args=new_module_args,
-                                               task_vars=task_vars))
+            result.update(self._execute_win_copy(new_module_args, task_vars))
             return result
         # find_needle returns a path that may not have a trailing slash on a
         # directory so we need to find that out first and append at the end
-        else:
+        elif rendered is None:
             trailing_slash = source.endswith(os.path.sep)
             try:
                 # find in expected paths
@@ -424,20 +1933,64 @@ class ActionModule(ActionBase):
 
         # If source is a directory populate our list else source is a file and translate it to a tuple.
         original_basename = None
-        if os.path.isdir(to_bytes(source, errors='surrogate_or_strict')):
+        manifest = None
+        mirror_root = None
+        if rendered is None and os.path.isdir(to_bytes(source, errors='surrogate_or_strict')):
             result['operation'] = 'folder_copy'
+            if mirror:
+                # the directory mirrored in dest is dest itself when only the
+                # contents of src are copied
+                mirror_root = '' if source.endswith(os.path.sep) else os.path.basename(source)
+
+            # a directory can contain many entries, they are streamed from the
+            # walk into a manifest file that is sent for the query rather than
+            # module args
+            if self._connection._shell.tmpdir is None:
+                self._connection._shell.tmpdir = self._make_tmp_path()
+
+            checksum_cache = self._get_checksum_cache(force, algorithm=algorithm)
+            try:
+                entries = _iter_walk_dirs(source, local_follow=local_follow,
+                                          trailing_slash_detector=self._connection._shell.path_has_trailing_slash,
+                                          path_filter=path_filter)
+                entries = _read_entries(self._timings.iter('walk', entries), self._loader, decrypt=decrypt,
+                                        checksum_check=force and algorithm != 'size_mtime',
+                                        checksum_cache=checksum_cache, tempfiles=vault_tempfiles, algorithm=algorithm)
+                with self._timings.stage('manifest'):
+                    manifest = self._transfer_manifest(self._timings.iter('hash', entries),
+                                                       self._connection._shell.tmpdir)
+            except BaseException:
+                # the local manifest is already removed, make sure the remote
+                # tmpdir with any manifest sent is removed as well
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+                raise
+            finally:
+                if checksum_cache:
+                    checksum_cache.close()
+
+            local_tempfiles.append(manifest['index'])
+
+            self._timings.add_bytes('source', manifest['size'])
+            self._timings.set_entries(files=manifest['files'], directories=manifest['directories'],
+                                      symlinks=len(manifest['symlinks']))
+
+        elif rendered is not None:
+            result['operation'] = 'file_copy'
+            original_basename, b_rendered = rendered
+            result['original_basename'] = original_basename
 
-            # Get a list of the files we want to replicate on the remote side
-            source_files = _walk_dirs(source, self._loader, decrypt=decrypt, local_follow=local_follow,
-                                      trailing_slash_detector=self._connection._shell.path_has_trailing_slash,
-                                      checksum_check=force)
+            file_checksum = None
+            if force:
+                with self._timings.stage('hash'):
+                    file_checksum = checksum_data(b_rendered, algorithm=algorithm)
 
-            # If it's recursive copy, destination is always a dir,
-            # explicitly mark it so (note - win_copy module relies on this).
-            if not self._connection._shell.path_has_trailing_slash(dest):
-                dest = "%s%s" % (dest, self.WIN_PATH_SEPARATOR)
+            # src is set once the content is written to a tempfile
+            source_files['files'].append(dict(src=None, dest=original_basename, checksum=file_checksum))
+            result['checksum'] = file_checksum
+            result['size'] = len(b_rendered)
+            self._timings.add_bytes('source', result['size'])
+            self._timings.set_entries(files=1, directories=0, symlinks=0)
 
-            check_dest = dest
         # Source is a file, add details to source_files dict
         else:
             result['operation'] = 'file_copy'
@@ -449,84 +2002,142 @@ class ActionModule(ActionBase):
                 result['failed'] = True
                 result['msg'] = "could not find src=%s, %s" % (source, to_text(e))
                 return result
+            # only removes source_full if it is a decrypted tempfile
+            vault_tempfiles.append(source_full)
 
             original_basename = os.path.basename(source)
             result['original_basename'] = original_basename
 
-            # check if dest ends with / or \ and append source filename to dest
-            if self._connection._shell.path_has_trailing_slash(dest):
-                check_dest = dest
-                filename = original_basename
-                result['dest'] = self._connection._shell.join_path(dest, filename)
-            else:
-                # replace \\ with / so we can use os.path to get the filename or dirname
-                unix_path = dest.replace(self.WIN_PATH_SEPARATOR, os.path.sep)
-                filename = os.path.basename(unix_path)
-                check_dest = os.path.dirname(unix_path)
-
-            file_checksum = _get_local_checksum(force, source_full)
-            source_files['files'].append(
-                dict(
-                    src=source_full,
-                    dest=filename,
-                    checksum=file_checksum
-                )
+            # There is no point caching the checksum of a content tempfile or
+            # a decrypted vault tempfile, its path is different each run
+            checksum_cache = None
+            if force and content is None and not (decrypt and _has_vault_header(source)):
+                checksum_cache = self._get_checksum_cache(force, algorithm=algorithm)
+            try:
+                with self._timings.stage('hash'):
+                    file_checksum = _get_local_checksum(force, source_full, checksum_cache=checksum_cache,
+                                                        algorithm=algorithm)
+            finally:
+                if checksum_cache:
+                    checksum_cache.close()
+            source_file = dict(
+                src=source_full,
+                dest=original_basename,
+                checksum=file_checksum
             )
+            if algorithm == 'size_mtime':
+                # the remote file is compared by its size and last write time
+                # which is set to the mtime of the source once copied
+                file_entry = _get_file_entry(source_full, original_basename)
+                source_file.update(size=file_entry.size, mtime=file_entry.mtime)
+            source_files['files'].append(source_file)
             result['checksum'] = file_checksum
             result['size'] = os.path.getsize(to_bytes(source_full, errors='surrogate_or_strict'))
+            self._timings.add_bytes('source', result['size'])
+            self._timings.set_entries(files=1, directories=0, symlinks=0)
+
+        if len(dests) > 1:
+            if rendered is not None:
+                content_tempfile = self._create_content_tempfile(rendered[1])
+                source_files['files'][0]['src'] = content_tempfile
+            result.update(self._copy_to_dests(dests, source_files, original_basename, force, backup, task_vars,
+                                              manifest=manifest, chunk_size=chunk_size, compression=compression,
+                                              streams=streams, mirror_root=mirror_root, path_filter=path_filter,
+                                              algorithm=algorithm))
+            self._remove_content_tempfile(content_tempfile)
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        dest, check_dest, filename = self._get_query_dest(dest, original_basename)
+        if original_basename is not None:
+            source_files['files'][0]['dest'] = filename
+            if self._connection._shell.path_has_trailing_slash(dest):
+                result['dest'] = self._connection._shell.join_path(dest, filename)
 
         # find out the files/directories/symlinks that we need to copy to the server
-        query_args = self._task.args.copy()
-        query_args.update(
-            dict(
-                _copy_mode="query",
-                dest=check_dest,
-                force=force,
-                files=source_files['files'],
-                directories=source_files['directories'],
-                symlinks=source_files['symlinks'],
+        if result['operation'] == 'folder_copy':
+            query_return = self._query_manifest(check_dest, force, manifest, task_vars, mirror_root=mirror_root,
+                                                mirror_recurse=path_filter is not None)
+        else:
+            query_args = self._task.args.copy()
+            query_args.update(
+                dict(
+                    _copy_mode="query",
+                    dest=check_dest,
+                    force=force,
+                    files=source_files['files'],
+                    directories=source_files['directories'],
+                    symlinks=source_files['symlinks'],
+                )
             )
-        )
-        # src is not required for query, will fail path validation is src has unix allowed chars
-        query_args.pop('src', None)
+            # src is not required for query, will fail path validation is src has unix allowed chars
+            query_args.pop('src', None)
 
-        query_args.pop('content', None)
-        query_return = self._execute_module(module_name="ansible.windows.win_copy",
-                                            module_args=query_args,
-                                            task_vars=task_vars)
+            query_args.pop('content', None)
+            query_return = self._execute_win_copy(query_args, task_vars)
 
         if query_return.get('failed') is True:
             result.update(query_return)
+            self._remove_tmp_path(self._connection._shell.tmpdir)
             return result
 
-        if len(query_return['files']) > 0 or len(query_return['directories']) > 0 and self._connection._shell.tmpdir is None:
+        files = query_return['files']
+        duplicates = []
+        bytes_saved = 0
+        if result['operation'] == 'folder_copy' and algorithm in _DEDUPE_ALGORITHMS:
+            # files with the same content are only sent once, explode copies
+            # the duplicates from the first file or an up to date remote file
+            files, duplicates, bytes_saved = _dedupe_files(files, query_return.get('unchanged_files'))
+
+        symlinks = query_return.get('symlinks') or []
+        purge = []
+        if mirror_root is not None:
+            purge = self._get_mirror_purge(query_return, mirror_root, path_filter=path_filter)
+            result['removed'] = purge
+
+        changed_count = len(files) + len(duplicates) + len(query_return['directories']) + len(symlinks) + len(purge)
+        self._timings.set_entries(changed=changed_count)
+        if changed_count > 0 and self._connection._shell.tmpdir is None:
             self._connection._shell.tmpdir = self._make_tmp_path()
 
-        if len(query_return['files']) == 1 and len(query_return['directories']) == 0:
+        if len(files) == 1 and len(duplicates) == 0 and len(query_return['directories']) == 0 and len(symlinks) == 0 \
+                and len(purge) == 0:
             # we only need to copy 1 file, don't mess around with zips
-            file_src = query_return['files'][0]['src']
-            file_dest = query_return['files'][0]['dest']
+            file_src = files[0]['src']
+            if rendered is not None and not self._task.check_mode:
+                # the remote file is out of date, write out the rendered content
+                content_tempfile = file_src = self._create_content_tempfile(rendered[1])
+            file_dest = files[0]['dest']
             basename = original_basename or file_dest
             result.update(self._copy_single_file(file_src, dest, basename, file_dest,
-                                                 task_vars, self._connection._shell.tmpdir, backup))
+                                                 task_vars, self._connection._shell.tmpdir, backup,
+                                                 mtime=files[0].get('mtime'),
+                                                 checksum=files[0].get('checksum'),
+                                                 chunk_size=chunk_size, streams=streams))
             if result.get('failed') is True:
                 result['msg'] = "failed to copy file %s: %s" % (file_src, result['msg'])
             result['changed'] = True
 
-        elif len(query_return['files']) > 0 or len(query_return['directories']) > 0:
-            # either multiple files or directories need to be copied, compress
-            # to a zip and 'explode' the zip on the server
-            # TODO: handle symlinks
-            result.update(self._copy_zip_file(dest, source_files['files'],
-                                              source_files['directories'],
-                                              task_vars, self._connection._shell.tmpdir, backup))
+        elif changed_count > 0:
+            # either multiple files, directories or symlinks need to be
+            # copied, compress to a zip and 'explode' the zip on the server.
+            # Only the entries the query reported as changed are sent, the
+            # symlinks are created by explode once the zip is extracted.
+            result.update(self._copy_zip_file(dest, files,
+                                              query_return['directories'],
+                                              task_vars, self._connection._shell.tmpdir, backup,
+                                              chunk_size=chunk_size, compression=compression,
+                                              manifest=query_return.get('manifest'), streams=streams,
+                                              symlinks=symlinks, duplicates=duplicates, purge=purge))
             result['changed'] = True
+            if duplicates:
+                result['bytes_saved'] = bytes_saved
         else:
             # no operations need to occur
             result['failed'] = False
             result['changed'] = False
 
         # remove the content tmp file and remote tmp file if it was created
-        self._remove_tempfile_if_content_defined(content, content_tempfile)
+        self._remove_content_tempfile(content_tempfile)
         self._remove_tmp_path(self._connection._shell.tmpdir)
         return result
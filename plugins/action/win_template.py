@@ -5,9 +5,8 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import collections
 import os
-import shutil
-import tempfile
 
 from jinja2.defaults import (
     BLOCK_END_STRING,
@@ -18,7 +17,6 @@ from jinja2.defaults import (
     VARIABLE_START_STRING,
 )
 
-from ansible import constants as C
 from ansible.config.manager import ensure_type
 from ansible.errors import AnsibleError, AnsibleFileNotFound, AnsibleActionFail
 from ansible.module_utils.common.text.converters import to_bytes, to_text, to_native
@@ -45,6 +43,22 @@ except ImportError:
     from ansible.template import AnsibleEnvironment  # type: ignore[no-redef]
 
 
+def _get_template_searchpath(task_vars, basedir, source):
+    """Get the jinja2 search path for includes of the template source. This
+    is ansible_search_path followed by the basedir and template dir, each with
+    its 'templates' subdir searched first. A path is only searched once and
+    the list in task_vars is not changed."""
+    searchpath = []
+    seen = set()
+    for path in list(task_vars.get('ansible_search_path', [])) + [basedir, os.path.dirname(source)]:
+        for search in (os.path.join(path, 'templates'), path):
+            if search not in seen:
+                seen.add(search)
+                searchpath.append(search)
+
+    return searchpath
+
+
 class ActionModule(ActionBase):
 
     TRANSFERS_FILES = True
@@ -78,6 +92,7 @@ class ActionModule(ActionBase):
         # assign to local vars for ease of use
         source = self._task.args.get('src', None)
         dest = self._task.args.get('dest', None)
+        templates = self._task.args.get('templates', None)
         state = self._task.args.get('state', None)
         newline_sequence = self._task.args.get('newline_sequence', "\r\n")
         variable_start_string = self._task.args.get('variable_start_string', VARIABLE_START_STRING)
@@ -107,134 +122,150 @@ class ActionModule(ActionBase):
         if newline_sequence in wrong_sequences:
             newline_sequence = allowed_sequences[wrong_sequences.index(newline_sequence)]
 
+        overrides = dict(
+            block_start_string=block_start_string,
+            block_end_string=block_end_string,
+            variable_start_string=variable_start_string,
+            variable_end_string=variable_end_string,
+            comment_start_string=comment_start_string,
+            comment_end_string=comment_end_string,
+            trim_blocks=trim_blocks,
+            lstrip_blocks=lstrip_blocks
+        )
+
         try:
             # logical validation
             if state is not None:
                 raise AnsibleActionFail("'state' cannot be specified on a template")
+            elif templates is not None:
+                if source is not None or dest is not None:
+                    raise AnsibleActionFail("templates is mutually exclusive with src and dest")
+                elif not isinstance(templates, list) or \
+                        not all(isinstance(t, dict) and t.get('src') and t.get('dest') for t in templates):
+                    raise AnsibleActionFail("templates must be a list of dictionaries with the keys src and dest")
+                elif boolean(self._task.args.get('backup', False), strict=False):
+                    raise AnsibleActionFail("backup cannot be used with templates")
             elif source is None or dest is None:
                 raise AnsibleActionFail("src and dest are required")
-            elif newline_sequence not in allowed_sequences:
+
+            if newline_sequence not in allowed_sequences:
                 raise AnsibleActionFail("newline_sequence needs to be one of: \n, \r or \r\n")
-            else:
+
+            # template the source data locally & get ready to transfer
+            rendered = []
+            for template in templates if templates is not None else [dict(src=source, dest=dest)]:
+                template_src = to_text(template['src'], errors='surrogate_or_strict')
+                template_dest = to_text(template['dest'], errors='surrogate_or_strict')
                 try:
-                    source = self._find_needle('templates', source)
+                    template_path = self._find_needle('templates', template_src)
                 except AnsibleError as e:
                     raise AnsibleActionFail(to_text(e))
 
-            # Get vault decrypted tmp file
-            try:
-                tmp_source = self._loader.get_real_file(source)
-            except AnsibleFileNotFound as e:
-                raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e)))
-            b_tmp_source = to_bytes(tmp_source, errors='surrogate_or_strict')
-
-            # template the source data locally & get ready to transfer
-            try:
-                if USE_DATA_TAGGING:
-                    template_data = trust_as_template(self._loader.get_text_file_contents(source))
-
-                else:
-                    with open(b_tmp_source, 'rb') as f:
-                        try:
-                            template_data = to_text(f.read(), errors='surrogate_or_strict')
-                        except UnicodeError:
-                            raise AnsibleActionFail("Template source files must be utf-8 encoded")
-
-                # set jinja2 internal search path for includes
-                searchpath = task_vars.get('ansible_search_path', [])
-                searchpath.extend([self._loader._basedir, os.path.dirname(source)])
-
-                # We want to search into the 'templates' subdir of each search path in
-                # addition to our original search paths.
-                newsearchpath = []
-                for p in searchpath:
-                    newsearchpath.append(os.path.join(p, 'templates'))
-                    newsearchpath.append(p)
-                searchpath = newsearchpath
-
-                # add ansible 'template' vars
-                temp_vars = task_vars.copy()
-                temp_vars.update(
-                    generate_ansible_template_vars(
-                        self._task.args.get('src', None),
-                        fullpath=source,
-                        dest_path=dest,
-                        include_ansible_managed='ansible_managed' not in temp_vars  # do not clobber ansible_managed when set by the user
-                    )
-                )
-
-                overrides = dict(
-                    block_start_string=block_start_string,
-                    block_end_string=block_end_string,
-                    variable_start_string=variable_start_string,
-                    variable_end_string=variable_end_string,
-                    comment_start_string=comment_start_string,
-                    comment_end_string=comment_end_string,
-                    trim_blocks=trim_blocks,
-                    lstrip_blocks=lstrip_blocks
-                )
-
-                if USE_DATA_TAGGING:
-                    overrides['newline_sequence'] = newline_sequence
-                    data_templar = self._templar.copy_with_new_env(searchpath=searchpath, available_variables=temp_vars)
-                    resultant = data_templar.template(
-                        template_data,
-                        preserve_trailing_newlines=True,
-                        escape_backslashes=False,
-                        overrides=overrides,
-                    )
-
-                else:
-                    # force templar to use AnsibleEnvironment to prevent issues with native types
-                    # https://github.com/ansible/ansible/issues/46169
-                    data_templar = self._templar.copy_with_new_env(
-                        environment_class=AnsibleEnvironment,
-                        searchpath=searchpath,
-                        newline_sequence=newline_sequence,
-                        available_variables=temp_vars,
-                    )
-
-                    resultant = data_templar.do_template(
-                        template_data,
-                        preserve_trailing_newlines=True,
-                        escape_backslashes=False,
-                        overrides=overrides,
-                    )
-            finally:
-                self._loader.cleanup_tmp_file(b_tmp_source)
+                resultant = self._render_template(template_src, template_path, template_dest, task_vars, overrides,
+                                                  newline_sequence)
+                rendered.append(dict(
+                    src=template_path,
+                    dest=template_dest,
+                    content=to_bytes(resultant, encoding=output_encoding, errors='surrogate_or_strict'),
+                ))
 
             new_task = self._task.copy()
 
             # remove 'template only' options:
             for remove in ('newline_sequence', 'block_start_string', 'block_end_string', 'variable_start_string', 'variable_end_string',
-                           'comment_start_string', 'comment_end_string', 'trim_blocks', 'lstrip_blocks', 'output_encoding'):
+                           'comment_start_string', 'comment_end_string', 'trim_blocks', 'lstrip_blocks', 'output_encoding',
+                           'templates'):
                 new_task.args.pop(remove, None)
 
-            local_tempdir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
-
-            try:
-                result_file = os.path.join(local_tempdir, os.path.basename(source))
-                with open(to_bytes(result_file, errors='surrogate_or_strict'), 'wb') as f:
-                    f.write(to_bytes(resultant, encoding=output_encoding, errors='surrogate_or_strict'))
-
+            # the rendered output is checksummed in memory and only written to
+            # a local file by win_copy when the remote file is out of date
+            if templates is None:
                 new_task.args.update(
                     dict(
-                        src=result_file,
-                        dest=dest,
+                        src=rendered[0]['src'],
+                        dest=rendered[0]['dest'],
                     ),
                 )
-                copy_action = self._shared_loader_obj.action_loader.get('ansible.windows.win_copy',
-                                                                        task=new_task,
-                                                                        connection=self._connection,
-                                                                        play_context=self._play_context,
-                                                                        loader=self._loader,
-                                                                        templar=self._templar,
-                                                                        shared_loader_obj=self._shared_loader_obj)
-                result.update(copy_action.run(task_vars=task_vars))
-            finally:
-                shutil.rmtree(to_bytes(local_tempdir, errors='surrogate_or_strict'))
-
+            copy_action = self._shared_loader_obj.action_loader.get('ansible.windows.win_copy',
+                                                                    task=new_task,
+                                                                    connection=self._connection,
+                                                                    play_context=self._play_context,
+                                                                    loader=self._loader,
+                                                                    templar=self._templar,
+                                                                    shared_loader_obj=self._shared_loader_obj)
+            if templates is None:
+                result.update(copy_action.run_rendered(os.path.basename(rendered[0]['src']), rendered[0]['content'],
+                                                       task_vars=task_vars))
+            else:
+                # the templates are queried together and the changed ones are
+                # sent in one archive
+                copy_result = copy_action.run_rendered_files(rendered, task_vars=task_vars)
+                copy_result['templates'] = copy_result.pop('files')
+                result.update(copy_result)
         finally:
             self._remove_tmp_path(self._connection._shell.tmpdir)
 
         return result
+
+    def _render_template(self, template_src, source, dest, task_vars, overrides, newline_sequence):
+        """Renders the template at the local path source for dest."""
+        # Get vault decrypted tmp file
+        try:
+            tmp_source = self._loader.get_real_file(source)
+        except AnsibleFileNotFound as e:
+            raise AnsibleActionFail("could not find src=%s, %s" % (source, to_text(e)))
+        b_tmp_source = to_bytes(tmp_source, errors='surrogate_or_strict')
+
+        try:
+            if USE_DATA_TAGGING:
+                template_data = trust_as_template(self._loader.get_text_file_contents(source))
+
+            else:
+                with open(b_tmp_source, 'rb') as f:
+                    try:
+                        template_data = to_text(f.read(), errors='surrogate_or_strict')
+                    except UnicodeError:
+                        raise AnsibleActionFail("Template source files must be utf-8 encoded")
+
+            searchpath = _get_template_searchpath(task_vars, self._loader._basedir, source)
+
+            # add ansible 'template' vars, they are layered over task_vars
+            # rather than copying every host var into a new dict
+            temp_vars = collections.ChainMap(
+                generate_ansible_template_vars(
+                    template_src,
+                    fullpath=source,
+                    dest_path=dest,
+                    include_ansible_managed='ansible_managed' not in task_vars  # do not clobber ansible_managed when set by the user
+                ),
+                task_vars,
+            )
+
+            if USE_DATA_TAGGING:
+                overrides = dict(overrides, newline_sequence=newline_sequence)
+                data_templar = self._templar.copy_with_new_env(searchpath=searchpath, available_variables=temp_vars)
+                return data_templar.template(
+                    template_data,
+                    preserve_trailing_newlines=True,
+                    escape_backslashes=False,
+                    overrides=overrides,
+                )
+
+            else:
+                # force templar to use AnsibleEnvironment to prevent issues with native types
+                # https://github.com/ansible/ansible/issues/46169
+                data_templar = self._templar.copy_with_new_env(
+                    environment_class=AnsibleEnvironment,
+                    searchpath=searchpath,
+                    newline_sequence=newline_sequence,
+                    available_variables=temp_vars,
+                )
+
+                return data_templar.do_template(
+                    template_data,
+                    preserve_trailing_newlines=True,
+                    escape_backslashes=False,
+                    overrides=overrides,
+                )
+        finally:
+            self._loader.cleanup_tmp_file(b_tmp_source)
@@ -6,19 +6,22 @@
 
 #Requires -Module Ansible.ModuleUtils.Legacy
 #Requires -Module Ansible.ModuleUtils.Backup
+#AnsibleRequires -PowerShell Ansible.ModuleUtils.AddType
 
 $ErrorActionPreference = 'Stop'
 
 $params = Parse-Args -arguments $args -supports_check_mode $true
 $check_mode = Get-AnsibleParam -obj $params -name "_ansible_check_mode" -type "bool" -default $false
 $diff_mode = Get-AnsibleParam -obj $params -name "_ansible_diff" -type "bool" -default $false
+$_remote_tmp = Get-AnsibleParam $params "_ansible_remote_tmp" -type "path" -default $env:TMP
 
-# there are 4 modes to win_copy which are driven by the action plugins:
+# there are 5 modes to win_copy which are driven by the action plugins:
 #   explode: src is a zip file which needs to be extracted to dest, for use with multiple files
 #   query: win_copy action plugin wants to get the state of remote files to check whether it needs to send them
 #   remote: all copy action is happening remotely (remote_src=True)
 #   single: a single file has been copied, also used with template
-$copy_mode = Get-AnsibleParam -obj $params -name "_copy_mode" -type "str" -default "single" -validateset "explode", "query", "remote", "single"
+#   stage: src is a chunk of a large single file to append to a staging file next to dest
+$copy_mode = Get-AnsibleParam -obj $params -name "_copy_mode" -type "str" -default "single" -validateset "explode", "query", "remote", "single", "stage"
 
 # used in explode, remote and single mode
 $src = Get-AnsibleParam -obj $params -name "src" -type "path" -failifempty ($copy_mode -in @("explode", "process", "single"))
@@ -28,12 +31,61 @@ $backup = Get-AnsibleParam -obj $params -name "backup" -type "bool" -default $fa
 # used in single mode
 $original_basename = Get-AnsibleParam -obj $params -name "_original_basename" -type "str"
 
+# used in single mode for a file from a directory copy, the FILETIME to set as
+# the last write time of dest and the checksum to store in the checksum cache,
+# also used in stage mode to identify the file being staged
+$mtime = Get-AnsibleParam -obj $params -name "_mtime"
+$src_checksum = Get-AnsibleParam -obj $params -name "_checksum" -type "str"
+
+# used in stage mode, the offset in the staging file src is written to and
+# the checksum of src to verify it was received intact
+$offset = Get-AnsibleParam -obj $params -name "_offset"
+$chunk_checksum = Get-AnsibleParam -obj $params -name "_chunk_checksum" -type "str"
+
+# used in single mode, src is a staging file that can be moved to dest
+$src_staged = Get-AnsibleParam -obj $params -name "_src_staged" -type "bool" -default $false
+
+# used in explode and single mode, src was sent in multiple parts that need to be joined
+$src_parts = Get-AnsibleParam -obj $params -name "_src_parts" -type "list"
+
+# used in explode mode, the relative src path of each file to copy to the
+# relative dest paths of its duplicates that were not sent in src
+$duplicates = Get-AnsibleParam -obj $params -name "_duplicates" -type "list"
+
+# used in query and explode mode, the manifest file of a directory copy
+$manifest = Get-AnsibleParam -obj $params -name "_manifest" -type "path"
+
+# used in query mode with a manifest, the entries inside the directory at
+# mirror_root, relative to dest, that are not in the manifest are returned as
+# extra_entries
+$mirror = Get-AnsibleParam -obj $params -name "mirror" -type "bool" -default $false
+$mirror_root = Get-AnsibleParam -obj $params -name "_mirror_root" -type "str" -default ""
+# also return the entries inside an extra directory, set when some may be kept
+$mirror_recurse = Get-AnsibleParam -obj $params -name "_mirror_recurse" -type "bool" -default $false
+
+# used in explode mode, the paths relative to dest to remove before the zip is
+# extracted
+$purge = Get-AnsibleParam -obj $params -name "_purge" -type "list"
+
 # used in query and remote mode
 $force = Get-AnsibleParam -obj $params -name "force" -type "bool" -default $true
 
+# used in query, explode and single mode for a directory copy
+$remote_checksum_cache = Get-AnsibleParam -obj $params -name "remote_checksum_cache" -type "bool" -default $false
+
+# used in query, explode and single mode, the algorithm the action plugin used
+# for the local checksums, size_mtime compares the size and last write time
+# without a checksum
+$checksum_algorithm = Get-AnsibleParam -obj $params -name "checksum_algorithm" -type "str" -default "sha1" -validateset "sha1", "sha256", "crc32", "size_mtime"
+
 # used in query mode, contains the local files/directories/symlinks that are to be copied
+# symlinks is also used in explode mode with the symlinks to create
 $files = Get-AnsibleParam -obj $params -name "files" -type "list"
 $directories = Get-AnsibleParam -obj $params -name "directories" -type "list"
+$symlinks = Get-AnsibleParam -obj $params -name "symlinks" -type "list"
+
+# used in all modes, return the time taken by each stage of the mode
+$timings = Get-AnsibleParam -obj $params -name "timings" -type "bool" -default $false
 
 $result = @{
     changed = $false
@@ -43,6 +95,20 @@ if ($diff_mode) {
     $result.diff = @{}
 }
 
+$stage_stopwatch = [System.Diagnostics.Stopwatch]::StartNew()
+if ($timings) {
+    $result.timings = @{}
+}
+
+Function Complete-Stage($name) {
+    # add the seconds since the previous stage completed to the timings of
+    # the stage name
+    if ($timings) {
+        $result.timings[$name] = [double]$result.timings[$name] + $stage_stopwatch.Elapsed.TotalSeconds
+        $stage_stopwatch.Restart()
+    }
+}
+
 Function Copy-File($source, $dest) {
     $diff = ""
     $copy_file = $false
@@ -181,53 +247,709 @@ Function Get-FileSize {
     $size
 }
 
-Function Expand-Zip($src, $dest) {
-    $archive = [System.IO.Compression.ZipFile]::Open($src, [System.IO.Compression.ZipArchiveMode]::Read, [System.Text.Encoding]::UTF8)
-    foreach ($entry in $archive.Entries) {
-        $archive_name = $entry.FullName
+Function Join-SourcePart($parts, $dest) {
+    # the action plugin sent src in multiple parts as it was being built, join
+    # them back into one file removing each part once it has been copied so
+    # only one copy of the data is on disk at a time
+    $dest_stream = [System.IO.File]::Open($dest, [System.IO.FileMode]::Create, [System.IO.FileAccess]::Write)
+    try {
+        foreach ($part in $parts) {
+            $part_stream = [System.IO.File]::OpenRead($part)
+            try {
+                $part_stream.CopyTo($dest_stream, 1MB)
+            }
+            finally {
+                $part_stream.Dispose()
+            }
+            Remove-Item -LiteralPath $part -Force
+        }
+    }
+    finally {
+        $dest_stream.Dispose()
+    }
+}
+
+Function Resolve-SingleDest($dest, $original_basename) {
+    # the dest parameter is a directory, we need to append original_basename
+    $remote_dest = $dest
+    if ($dest.EndsWith("/") -or $dest.EndsWith("`\") -or (Test-Path -LiteralPath $dest -PathType Container)) {
+        $remote_dest = Join-Path -Path $dest -ChildPath $original_basename
+    }
+    $parent_dir = Split-Path -LiteralPath $remote_dest
+
+    # check if the dest parent dirs exist, need to fail if they don't
+    if (Test-Path -LiteralPath $parent_dir -PathType Leaf) {
+        Fail-Json -obj $result -message "object at destination parent dir '$parent_dir' is currently a file"
+    }
+    elseif (-not (Test-Path -LiteralPath $parent_dir -PathType Container)) {
+        if ($dest -eq $remote_dest) {
+            Fail-Json -obj $result -message "Destination directory '$parent_dir' does not exist"
+        }
+        else {
+            $null = New-Item -Path $parent_dir -ItemType Directory
+        }
+    }
+
+    return $remote_dest
+}
+
+Function Get-StagingState($path, $checksum) {
+    # the staging state file records the checksum of the file being staged and
+    # the offset of the last chunk that was verified and flushed to disk. The
+    # staging file is only trusted up to that offset and is discarded if it
+    # was for a different source file.
+    $state_path = "$path.state"
+    $state_offset = [Int64]0
+    if ([System.IO.File]::Exists($state_path) -and [System.IO.File]::Exists($path)) {
+        $fields = ([System.IO.File]::ReadAllText($state_path)).Trim().Split([char[]]"`t", 2)
+        if ($fields.Count -eq 2 -and $fields[0] -eq $checksum) {
+            $state_offset = [Math]::Min([Int64]$fields[1], (New-Object -TypeName System.IO.FileInfo -ArgumentList $path).Length)
+        }
+    }
+
+    return $state_offset
+}
 
-        # FullName may be appended with / or \, determine if it is padded and remove it
-        $padding_length = $archive_name.Length % 4
-        if ($padding_length -eq 0) {
-            $is_dir = $false
-            $base64_name = $archive_name
+Function Read-Manifest($path) {
+    # the manifest is a gzip compressed file sent by the action plugin for a
+    # directory copy, each line after the header is a tab separated entry of
+    # the type, size, mtime, checksum and relative dest path
+    $entries = New-Object -TypeName System.Collections.Generic.List[Hashtable]
+    $gzip_stream = New-Object -TypeName System.IO.Compression.GZipStream -ArgumentList @(
+        [System.IO.File]::OpenRead($path),
+        [System.IO.Compression.CompressionMode]::Decompress
+    )
+    $reader = New-Object -TypeName System.IO.StreamReader -ArgumentList $gzip_stream, ([System.Text.Encoding]::UTF8)
+    try {
+        $header = $reader.ReadLine()
+        if ($header -ne "win_copy-manifest`t1") {
+            Fail-Json -obj $result -message "invalid win_copy manifest header '$header'"
         }
-        elseif ($padding_length -eq 1) {
-            $is_dir = $true
-            if ($archive_name.EndsWith("/") -or $archive_name.EndsWith("`\")) {
-                $base64_name = $archive_name.Substring(0, $archive_name.Length - 1)
+
+        while ($null -ne ($line = $reader.ReadLine())) {
+            $fields = $line.Split([char[]]"`t", 5)
+            $entry = @{
+                type = $fields[0]
+                size = $null
+                mtime = $null
+                checksum = $fields[3]
+                dest = $fields[4]
             }
-            else {
-                throw "invalid base64 archive name '$archive_name'"
+            if ($entry.type -eq "f") {
+                $entry.size = [Int64]$fields[1]
+                $entry.mtime = [Int64]$fields[2]
             }
+            $entries.Add($entry)
+        }
+    }
+    finally {
+        $reader.Dispose()
+    }
+
+    return , $entries
+}
+
+Function Get-ManifestFile($path) {
+    # get the manifest entry of each file keyed by the relative dest path so
+    # the last write time and checksum cache can be set once it is written
+    $manifest_files = @{}
+    if ($path) {
+        foreach ($entry in (Read-Manifest -path $path)) {
+            if ($entry.type -eq "f") {
+                $manifest_files[$entry.dest] = $entry
+            }
+        }
+    }
+
+    return $manifest_files
+}
+
+Function Import-WinCopyHelper {
+    Add-CSharpType -TempPath $_remote_tmp -References @'
+using Microsoft.Win32.SafeHandles;
+using System;
+using System.ComponentModel;
+using System.IO;
+using System.Runtime.InteropServices;
+
+namespace Ansible.WinCopy
+{
+    public class FileId
+    {
+        [StructLayout(LayoutKind.Sequential)]
+        private struct BY_HANDLE_FILE_INFORMATION
+        {
+            public UInt32 dwFileAttributes;
+            public System.Runtime.InteropServices.ComTypes.FILETIME ftCreationTime;
+            public System.Runtime.InteropServices.ComTypes.FILETIME ftLastAccessTime;
+            public System.Runtime.InteropServices.ComTypes.FILETIME ftLastWriteTime;
+            public UInt32 dwVolumeSerialNumber;
+            public UInt32 nFileSizeHigh;
+            public UInt32 nFileSizeLow;
+            public UInt32 nNumberOfLinks;
+            public UInt32 nFileIndexHigh;
+            public UInt32 nFileIndexLow;
+        }
+
+        [DllImport("kernel32.dll", CharSet = CharSet.Unicode, SetLastError = true)]
+        private static extern SafeFileHandle CreateFileW(
+            string lpFileName,
+            UInt32 dwDesiredAccess,
+            UInt32 dwShareMode,
+            IntPtr lpSecurityAttributes,
+            UInt32 dwCreationDisposition,
+            UInt32 dwFlagsAndAttributes,
+            IntPtr hTemplateFile);
+
+        [DllImport("kernel32.dll", SetLastError = true)]
+        private static extern bool GetFileInformationByHandle(
+            SafeFileHandle hFile,
+            out BY_HANDLE_FILE_INFORMATION lpFileInformation);
+
+        public static string Get(string path)
+        {
+            // FILE_READ_ATTRIBUTES, FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE, OPEN_EXISTING
+            using (SafeFileHandle handle = CreateFileW(path, 0x80, 0x7, IntPtr.Zero, 3, 0, IntPtr.Zero))
+            {
+                if (handle.IsInvalid)
+                    throw new Win32Exception(Marshal.GetLastWin32Error(), String.Format("CreateFileW({0}) failed", path));
+
+                BY_HANDLE_FILE_INFORMATION info;
+                if (!GetFileInformationByHandle(handle, out info))
+                    throw new Win32Exception(Marshal.GetLastWin32Error(), String.Format("GetFileInformationByHandle({0}) failed", path));
+
+                return String.Format("{0:x8}-{1:x8}{2:x8}", info.dwVolumeSerialNumber, info.nFileIndexHigh, info.nFileIndexLow);
+            }
+        }
+    }
+
+    public class Crc32
+    {
+        // CRC-32 as used by zlib, the table is extended to process 8 bytes at
+        // a time rather than 1
+        private static readonly UInt32[][] Table = CreateTable();
+
+        private static UInt32[][] CreateTable()
+        {
+            UInt32[][] table = new UInt32[8][];
+            for (int t = 0; t < 8; t++)
+                table[t] = new UInt32[256];
+
+            for (UInt32 i = 0; i < 256; i++)
+            {
+                UInt32 value = i;
+                for (int j = 0; j < 8; j++)
+                    value = (value & 1) == 1 ? (value >> 1) ^ 0xEDB88320 : value >> 1;
+                table[0][i] = value;
+            }
+            for (int i = 0; i < 256; i++)
+            {
+                for (int t = 1; t < 8; t++)
+                    table[t][i] = (table[t - 1][i] >> 8) ^ table[0][table[t - 1][i] & 0xFF];
+            }
+
+            return table;
+        }
+
+        public static string GetFileChecksum(string path)
+        {
+            UInt32[] t0 = Table[0], t1 = Table[1], t2 = Table[2], t3 = Table[3];
+            UInt32[] t4 = Table[4], t5 = Table[5], t6 = Table[6], t7 = Table[7];
+            byte[] buffer = new byte[1024 * 1024];
+            UInt32 crc = 0xFFFFFFFF;
+            using (FileStream stream = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite,
+                4096, FileOptions.SequentialScan))
+            {
+                int read;
+                while ((read = stream.Read(buffer, 0, buffer.Length)) > 0)
+                {
+                    int offset = 0;
+                    for (; read - offset >= 8; offset += 8)
+                    {
+                        UInt32 low = crc ^ (UInt32)(buffer[offset] | buffer[offset + 1] << 8 |
+                            buffer[offset + 2] << 16 | buffer[offset + 3] << 24);
+                        crc = t7[low & 0xFF] ^ t6[(low >> 8) & 0xFF] ^ t5[(low >> 16) & 0xFF] ^ t4[low >> 24] ^
+                            t3[buffer[offset + 4]] ^ t2[buffer[offset + 5]] ^ t1[buffer[offset + 6]] ^
+                            t0[buffer[offset + 7]];
+                    }
+                    for (; offset < read; offset++)
+                        crc = (crc >> 8) ^ t0[(crc ^ buffer[offset]) & 0xFF];
+                }
+            }
+
+            return (crc ^ 0xFFFFFFFF).ToString("x8");
+        }
+    }
+
+    public class Link
+    {
+        private const UInt32 SYMBOLIC_LINK_FLAG_DIRECTORY = 0x1;
+        private const UInt32 SYMBOLIC_LINK_FLAG_ALLOW_UNPRIVILEGED_CREATE = 0x2;
+        private const int ERROR_INVALID_PARAMETER = 87;
+
+        [DllImport("kernel32.dll", CharSet = CharSet.Unicode, SetLastError = true)]
+        [return: MarshalAs(UnmanagedType.U1)]
+        private static extern bool CreateSymbolicLinkW(
+            string lpSymlinkFileName,
+            string lpTargetFileName,
+            UInt32 dwFlags);
+
+        public static int CreateSymbolicLink(string path, string target, bool directory)
+        {
+            // Returns the Win32 error code so the caller can fall back to a
+            // junction when the privilege to create a symlink is not held
+            UInt32 flags = directory ? SYMBOLIC_LINK_FLAG_DIRECTORY : 0;
+            if (CreateSymbolicLinkW(path, target, flags | SYMBOLIC_LINK_FLAG_ALLOW_UNPRIVILEGED_CREATE))
+                return 0;
+
+            int error = Marshal.GetLastWin32Error();
+            if (error != ERROR_INVALID_PARAMETER)
+                return error;
+
+            // Older hosts do not support the unprivileged create flag
+            if (CreateSymbolicLinkW(path, target, flags))
+                return 0;
+
+            return Marshal.GetLastWin32Error();
+        }
+    }
+}
+'@
+}
+
+Function Get-WinCopyChecksum($path) {
+    # get the checksum of a file with the same algorithm as the local files
+    switch ($checksum_algorithm) {
+        "sha256" {
+            $hash_algorithm = [System.Security.Cryptography.SHA256]::Create()
+            $stream = [System.IO.File]::Open($path, [System.IO.FileMode]::Open, [System.IO.FileAccess]::Read, [System.IO.FileShare]::ReadWrite)
+            try {
+                return [System.BitConverter]::ToString($hash_algorithm.ComputeHash($stream)).Replace("-", "").ToLowerInvariant()
+            }
+            finally {
+                $stream.Dispose()
+                $hash_algorithm.Dispose()
+            }
+        }
+        "crc32" {
+            Import-WinCopyHelper
+            return [Ansible.WinCopy.Crc32]::GetFileChecksum($path)
+        }
+        default {
+            return Get-FileChecksum -path $path
+        }
+    }
+}
+
+Function Get-LinkTarget($path, $target) {
+    # get the absolute path a link target resolves to from the link path
+    $link_dir = [System.IO.Path]::GetDirectoryName($path)
+    return [System.IO.Path]::GetFullPath([System.IO.Path]::Combine($link_dir, $target)).TrimEnd("\")
+}
+
+Function Assert-LinkTarget($path, $target) {
+    # the action plugin skips a link that resolves outside of dest, this
+    # makes sure one passed in by other means is never created
+    $root = [System.IO.Path]::GetFullPath($dest).TrimEnd("\")
+    $full_target = Get-LinkTarget -path $path -target $target
+    if ([System.IO.Path]::IsPathRooted($target) -or (
+            $full_target -ne $root -and
+            -not $full_target.StartsWith("$root\", [System.StringComparison]::OrdinalIgnoreCase))) {
+        Fail-Json -obj $result -message "cannot create symlink at dest '$path': target '$target' is outside of dest '$dest'"
+    }
+}
+
+Function Test-LinkChanged($path, $target) {
+    # FileInfo.Attributes is -1 when nothing exists at the path, unlike
+    # Test-Path this does not follow a link whose target does not exist
+    $attributes = [int](New-Object -TypeName System.IO.FileInfo -ArgumentList $path).Attributes
+    if ($attributes -eq -1) {
+        return $true
+    }
+    elseif (-not ($attributes -band [int][System.IO.FileAttributes]::ReparsePoint)) {
+        Fail-Json -obj $result -message "cannot create symlink at dest '$path': object at path is not a symlink or junction"
+    }
+
+    $current_target = @((Get-Item -LiteralPath $path -Force).Target)[0]
+    if (-not $current_target) {
+        return $true
+    }
+
+    return (Get-LinkTarget -path $path -target $current_target) -ne (Get-LinkTarget -path $path -target $target)
+}
+
+Function New-Link($path, $target, $directory) {
+    # replace an existing link, only the link itself is removed
+    $attributes = [int](New-Object -TypeName System.IO.FileInfo -ArgumentList $path).Attributes
+    if ($attributes -ne -1) {
+        if ($attributes -band [int][System.IO.FileAttributes]::Directory) {
+            [System.IO.Directory]::Delete($path)
         }
         else {
-            throw "invalid base64 length '$archive_name'"
+            [System.IO.File]::Delete($path)
         }
+    }
 
-        # to handle unicode character, win_copy action plugin has encoded the filename
-        $decoded_archive_name = [System.Text.Encoding]::UTF8.GetString([System.Convert]::FromBase64String($base64_name))
-        # re-add the / to the entry full name if it was a directory
-        if ($is_dir) {
-            $decoded_archive_name = "$decoded_archive_name/"
+    $parent_dir = [System.IO.Path]::GetDirectoryName($path)
+    if (-not [System.IO.Directory]::Exists($parent_dir)) {
+        $null = [System.IO.Directory]::CreateDirectory($parent_dir)
+    }
+
+    $error_code = [Ansible.WinCopy.Link]::CreateSymbolicLink($path, $target, $directory)
+    if ($error_code -eq 1314 -and $directory) {
+        # ERROR_PRIVILEGE_NOT_HELD, a junction can link a directory without
+        # the privilege but it needs an absolute target
+        $null = New-Item -Path $path -ItemType Junction -Value (Get-LinkTarget -path $path -target $target)
+    }
+    elseif ($error_code -ne 0) {
+        $msg = (New-Object -TypeName System.ComponentModel.Win32Exception -ArgumentList $error_code).Message
+        Fail-Json -obj $result -message "failed to create symlink at dest '$path' to '$target': $msg"
+    }
+}
+
+Function Get-ChecksumCacheHeader {
+    # sha1 keeps the header used before other algorithms were added, a cache
+    # of another algorithm is rebuilt
+    if ($checksum_algorithm -eq "sha1") {
+        return "win_copy-cache`t1"
+    }
+
+    return "win_copy-cache`t1`t$checksum_algorithm"
+}
+
+Function Read-ChecksumCache($dest) {
+    # the checksum cache is a gzip compressed sidecar file in the root of a
+    # directory copy dest, each line after the header is a tab separated entry
+    # of the size, last write time, file id, checksum and relative path of a
+    # file whose checksum was previously calculated or written by win_copy
+    Import-WinCopyHelper
+
+    $cache = @{
+        path = [System.IO.Path]::Combine($dest, ".ansible_win_copy_cache")
+        entries = @{}
+        modified = $false
+    }
+    if (-not [System.IO.File]::Exists($cache.path)) {
+        return $cache
+    }
+
+    try {
+        $gzip_stream = New-Object -TypeName System.IO.Compression.GZipStream -ArgumentList @(
+            [System.IO.File]::OpenRead($cache.path),
+            [System.IO.Compression.CompressionMode]::Decompress
+        )
+        $reader = New-Object -TypeName System.IO.StreamReader -ArgumentList $gzip_stream, ([System.Text.Encoding]::UTF8)
+        try {
+            if ($reader.ReadLine() -ne (Get-ChecksumCacheHeader)) {
+                throw "invalid checksum cache header"
+            }
+
+            while ($null -ne ($line = $reader.ReadLine())) {
+                $fields = $line.Split([char[]]"`t", 5)
+                $cache.entries[$fields[4]] = @{
+                    size = [Int64]$fields[0]
+                    mtime = [Int64]$fields[1]
+                    file_id = $fields[2]
+                    checksum = $fields[3]
+                }
+            }
         }
-        $entry_target_path = [System.IO.Path]::Combine($dest, $decoded_archive_name)
-        $entry_dir = [System.IO.Path]::GetDirectoryName($entry_target_path)
+        finally {
+            $reader.Dispose()
+        }
+    }
+    catch {
+        # the cache is only an optimisation, an invalid cache is rebuilt
+        $cache.entries = @{}
+        $cache.modified = $true
+    }
 
-        if (-not (Test-Path -LiteralPath $entry_dir)) {
-            New-Item -Path $entry_dir -ItemType Directory -WhatIf:$check_mode | Out-Null
+    return $cache
+}
+
+Function Write-ChecksumCache($cache) {
+    if ($check_mode -or -not $cache.modified) {
+        return
+    }
+
+    $cache_dir = [System.IO.Path]::GetDirectoryName($cache.path)
+    if (-not [System.IO.Directory]::Exists($cache_dir)) {
+        return
+    }
+
+    # FileMode.Create cannot overwrite a hidden file, truncate it instead
+    $file_stream = [System.IO.File]::Open($cache.path, [System.IO.FileMode]::OpenOrCreate, [System.IO.FileAccess]::Write)
+    $file_stream.SetLength(0)
+    $gzip_stream = New-Object -TypeName System.IO.Compression.GZipStream -ArgumentList @(
+        $file_stream,
+        [System.IO.Compression.CompressionMode]::Compress
+    )
+    $writer = New-Object -TypeName System.IO.StreamWriter -ArgumentList $gzip_stream, (New-Object -TypeName System.Text.UTF8Encoding -ArgumentList $false)
+    try {
+        $writer.Write("$(Get-ChecksumCacheHeader)`n")
+        foreach ($kvp in $cache.entries.GetEnumerator()) {
+            $entry = $kvp.Value
+            $writer.Write("$($entry.size)`t$($entry.mtime)`t$($entry.file_id)`t$($entry.checksum)`t$($kvp.Key)`n")
+        }
+    }
+    finally {
+        $writer.Dispose()
+    }
+
+    $cache_file = New-Object -TypeName System.IO.FileInfo -ArgumentList $cache.path
+    $cache_file.Attributes = $cache_file.Attributes -bor [System.IO.FileAttributes]::Hidden
+}
+
+Function Set-CachedChecksum($cache, $name, $file_info, $checksum) {
+    $file_info.Refresh()
+    $cache.entries[$name] = @{
+        size = $file_info.Length
+        mtime = $file_info.LastWriteTimeUtc.ToFileTimeUtc()
+        file_id = [Ansible.WinCopy.FileId]::Get($file_info.FullName)
+        checksum = $checksum
+    }
+    $cache.modified = $true
+}
+
+Function Get-CachedChecksum($cache, $name, $file_info) {
+    # use the cached checksum if the size, last write time and file id of the
+    # file are unchanged since it was stored, otherwise calculate it again
+    if ($null -eq $cache) {
+        return Get-WinCopyChecksum -path $file_info.FullName
+    }
+
+    $cached = $cache.entries[$name]
+    if (
+        $null -ne $cached -and
+        $cached.size -eq $file_info.Length -and
+        $cached.mtime -eq $file_info.LastWriteTimeUtc.ToFileTimeUtc() -and
+        $cached.file_id -eq [Ansible.WinCopy.FileId]::Get($file_info.FullName)
+    ) {
+        return $cached.checksum
+    }
+
+    $file_checksum = Get-WinCopyChecksum -path $file_info.FullName
+    Set-CachedChecksum -cache $cache -name $name -file_info $file_info -checksum $file_checksum
+    return $file_checksum
+}
+
+Function Complete-ManifestFile($path, $name, $manifest_files, $cache) {
+    # set the last write time of a file written from a directory copy to the
+    # source mtime so a future query can skip the checksum and record it in
+    # the checksum cache if enabled
+    $entry = $manifest_files[$name]
+    if ($null -eq $entry) {
+        return
+    }
+
+    [System.IO.File]::SetLastWriteTimeUtc($path, [DateTime]::FromFileTimeUtc($entry.mtime))
+    if ($null -ne $cache -and $entry.checksum) {
+        $file_info = New-Object -TypeName System.IO.FileInfo -ArgumentList $path
+        Set-CachedChecksum -cache $cache -name $name -file_info $file_info -checksum $entry.checksum
+    }
+}
+
+Function Import-WinCopyExtractor {
+    Add-CSharpType -TempPath $_remote_tmp -References @'
+using System;
+using System.Collections;
+using System.Collections.Concurrent;
+using System.Collections.Generic;
+using System.Collections.ObjectModel;
+using System.IO;
+using System.IO.Compression;
+using System.Runtime.ExceptionServices;
+using System.Text;
+using System.Threading.Tasks;
+
+//AssemblyReference -Name System.IO.Compression.dll -CLR Framework
+//AssemblyReference -Type System.IO.Compression.ZipArchive -CLR Core
+
+namespace Ansible.WinCopy
+{
+    public class ZipExtractor
+    {
+        // Each worker reads and writes in blocks of this size so a large file
+        // is written with few calls and a small file with one
+        private const int BUFFER_SIZE = 1024 * 1024;
+
+        // The default number of files written at the same time, more than
+        // this tends to thrash a spinning disk without helping an SSD much
+        private const int DEFAULT_MAX_PARALLEL = 4;
+
+        private class FileEntry
+        {
+            public int Index;
+            public string Name;
+            public string Path;
+        }
+
+        /// <summary>
+        /// Extracts the zip created by the win_copy action plugin to dest.
+        /// Each entry name is the base64 encoded relative path, directories
+        /// end with a slash. All the directories are created before the files
+        /// are written by up to maxParallel workers, each with its own handle
+        /// of the zip. The last write time of each file is set to the mtime
+        /// of its entry in manifestFiles, if present.
+        /// </summary>
+        /// <returns>The relative path of each file that was written.</returns>
+        public static List<string> Extract(string src, string dest, IDictionary manifestFiles, int maxParallel)
+        {
+            List<FileEntry> files = new List<FileEntry>();
+            HashSet<string> directories = new HashSet<string>(StringComparer.OrdinalIgnoreCase);
+            using (ZipArchive archive = OpenArchive(src))
+            {
+                ReadOnlyCollection<ZipArchiveEntry> entries = archive.Entries;
+                for (int i = 0; i < entries.Count; i++)
+                {
+                    string name = DecodeName(entries[i].FullName);
+                    string path = System.IO.Path.Combine(dest, name);
+                    directories.Add(System.IO.Path.GetDirectoryName(path));
+                    if (!name.EndsWith("/"))
+                        files.Add(new FileEntry() { Index = i, Name = name, Path = path });
+                }
+            }
+
+            foreach (string directory in directories)
+                Directory.CreateDirectory(directory);
+
+            if (maxParallel < 1)
+                maxParallel = Math.Min(Environment.ProcessorCount, DEFAULT_MAX_PARALLEL);
+            int workers = Math.Min(maxParallel, files.Count);
+
+            if (workers < 2)
+            {
+                using (ZipArchive archive = OpenArchive(src))
+                {
+                    byte[] buffer = new byte[BUFFER_SIZE];
+                    foreach (FileEntry file in files)
+                        ExtractFile(archive.Entries[file.Index], file, manifestFiles, buffer);
+                }
+            }
+            else
+            {
+                // the ranges are kept small enough that a worker stuck on a
+                // large file does not hold back the files queued after it
+                int rangeSize = Math.Max(1, files.Count / (workers * 8));
+                ParallelOptions options = new ParallelOptions() { MaxDegreeOfParallelism = workers };
+                try
+                {
+                    Parallel.ForEach(
+                        Partitioner.Create(0, files.Count, rangeSize),
+                        options,
+                        () => new Worker(OpenArchive(src)),
+                        (range, state, worker) =>
+                        {
+                            for (int i = range.Item1; i < range.Item2; i++)
+                            {
+                                FileEntry file = files[i];
+                                ExtractFile(worker.Archive.Entries[file.Index], file, manifestFiles, worker.Buffer);
+                            }
+                            return worker;
+                        },
+                        worker => worker.Archive.Dispose());
+                }
+                catch (AggregateException e)
+                {
+                    ExceptionDispatchInfo.Capture(e.Flatten().InnerExceptions[0]).Throw();
+                }
+            }
+
+            List<string> names = new List<string>(files.Count);
+            foreach (FileEntry file in files)
+                names.Add(file.Name);
+            return names;
+        }
+
+        private class Worker
+        {
+            public ZipArchive Archive;
+            public byte[] Buffer = new byte[BUFFER_SIZE];
+
+            public Worker(ZipArchive archive)
+            {
+                Archive = archive;
+            }
+        }
+
+        private static ZipArchive OpenArchive(string path)
+        {
+            FileStream stream = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, 4096,
+                FileOptions.RandomAccess);
+            return new ZipArchive(stream, ZipArchiveMode.Read, false, Encoding.UTF8);
+        }
+
+        private static string DecodeName(string archiveName)
+        {
+            // the name may be appended with / or \ for a directory, this is
+            // re-added as a / once decoded
+            string suffix = "";
+            switch (archiveName.Length % 4)
+            {
+                case 0:
+                    break;
+                case 1:
+                    if (!(archiveName.EndsWith("/") || archiveName.EndsWith("\\")))
+                        throw new InvalidDataException(String.Format("invalid base64 archive name '{0}'", archiveName));
+                    archiveName = archiveName.Substring(0, archiveName.Length - 1);
+                    suffix = "/";
+                    break;
+                default:
+                    throw new InvalidDataException(String.Format("invalid base64 length '{0}'", archiveName));
+            }
+
+            return Encoding.UTF8.GetString(Convert.FromBase64String(archiveName)) + suffix;
+        }
+
+        private static void ExtractFile(ZipArchiveEntry entry, FileEntry file, IDictionary manifestFiles, byte[] buffer)
+        {
+            // the writes are already done in large blocks so the FileStream
+            // buffer is skipped, the file is sized up front to avoid growing
+            // it on each write
+            using (Stream source = entry.Open())
+            using (FileStream target = new FileStream(file.Path, FileMode.Create, FileAccess.Write, FileShare.None, 1))
+            {
+                if (entry.Length > 0)
+                    target.SetLength(entry.Length);
+
+                int read;
+                while ((read = source.Read(buffer, 0, buffer.Length)) > 0)
+                    target.Write(buffer, 0, read);
+            }
+
+            DateTime lastWriteTime = entry.LastWriteTime.UtcDateTime;
+            IDictionary manifestEntry = manifestFiles == null ? null : manifestFiles[file.Name] as IDictionary;
+            if (manifestEntry != null && manifestEntry["mtime"] != null)
+                lastWriteTime = DateTime.FromFileTimeUtc(Convert.ToInt64(manifestEntry["mtime"]));
+            File.SetLastWriteTimeUtc(file.Path, lastWriteTime);
         }
+    }
+}
+'@
+}
+
+Function Expand-Zip($src, $dest, $manifest_files, $cache, $max_parallel = 0) {
+    # the files are extracted by the compiled helper, only the checksum cache
+    # needs to be updated for each file
+    if ($check_mode) {
+        return
+    }
+
+    Import-WinCopyExtractor
+    $names = [Ansible.WinCopy.ZipExtractor]::Extract($src, $dest, $manifest_files, $max_parallel)
 
-        if ($is_dir -eq $false) {
-            if (-not $check_mode) {
-                [System.IO.Compression.ZipFileExtensions]::ExtractToFile($entry, $entry_target_path, $true)
+    if ($null -ne $cache) {
+        foreach ($name in $names) {
+            $entry = $manifest_files[$name]
+            if ($null -ne $entry -and $entry.checksum) {
+                $file_info = New-Object -TypeName System.IO.FileInfo -ArgumentList ([System.IO.Path]::Combine($dest, $name))
+                Set-CachedChecksum -cache $cache -name $name -file_info $file_info -checksum $entry.checksum
             }
         }
     }
-    $archive.Dispose()  # release the handle of the zip file
 }
 
-Function Expand-ZipLegacy($src, $dest) {
+Function Expand-ZipLegacy($src, $dest, $manifest_files, $cache) {
     if (-not (Test-Path -LiteralPath $dest)) {
         New-Item -Path $dest -ItemType Directory -WhatIf:$check_mode | Out-Null
     }
@@ -262,10 +984,82 @@ Function Expand-ZipLegacy($src, $dest) {
             # once file is extraced, we need to rename it with non base64 name
             $combined_encoded_path = [System.IO.Path]::Combine($dest, $encoded_archive_entry)
             Move-Item -LiteralPath $combined_encoded_path -Destination $entry_target_path -Force | Out-Null
+            Complete-ManifestFile -path $entry_target_path -name $decoded_archive_entry -manifest_files $manifest_files -cache $cache
         }
     }
 }
 
+Function Get-ExtraEntry {
+    <#
+    .SYNOPSIS
+    Gets the entries under the mirror root of dest that are not in the source
+    of a directory copy. An extra directory is returned without the entries
+    inside it as it is removed as a whole, unless recurse is set. Then the
+    entries inside it are returned after it so the action plugin can keep the
+    ones that are excluded. The checksum cache and the staging files of
+    win_copy are not returned.
+    #>
+    param ($dest, $root, $names, [bool]$recurse = $false)
+
+    $extra = New-Object -TypeName System.Collections.Generic.List[Hashtable]
+    if (-not [System.IO.Directory]::Exists([System.IO.Path]::Combine($dest, $root))) {
+        return , $extra
+    }
+
+    $pending = New-Object -TypeName System.Collections.Generic.Stack[String]
+    $pending.Push($root)
+    while ($pending.Count -gt 0) {
+        $rel_dir = $pending.Pop()
+        $dir_info = New-Object -TypeName System.IO.DirectoryInfo -ArgumentList ([System.IO.Path]::Combine($dest, $rel_dir))
+        foreach ($child in $dir_info.EnumerateFileSystemInfos()) {
+            $name = if ($rel_dir) { "$rel_dir\$($child.Name)" } else { $child.Name }
+            $is_dir = $child.Attributes.HasFlag([System.IO.FileAttributes]::Directory)
+            if ($names.Contains($name)) {
+                # only walk a directory from the source, not a link to one
+                if ($is_dir -and -not $child.Attributes.HasFlag([System.IO.FileAttributes]::ReparsePoint)) {
+                    $pending.Push($name)
+                }
+                continue
+            }
+
+            if (-not $is_dir) {
+                if (($rel_dir -eq "" -and $child.Name -eq ".ansible_win_copy_cache") -or
+                    $child.Name.EndsWith(".win_copy_partial", [System.StringComparison]::OrdinalIgnoreCase) -or
+                    $child.Name.EndsWith(".win_copy_partial.state", [System.StringComparison]::OrdinalIgnoreCase)) {
+                    continue
+                }
+            }
+            $extra.Add(@{ dest = $name; directory = $is_dir })
+            if ($recurse -and $is_dir -and -not $child.Attributes.HasFlag([System.IO.FileAttributes]::ReparsePoint)) {
+                $pending.Push($name)
+            }
+        }
+    }
+
+    return , $extra
+}
+
+Function Remove-ExtraEntry($path) {
+    try {
+        $attributes = [System.IO.File]::GetAttributes($path)
+    }
+    catch [System.IO.FileNotFoundException], [System.IO.DirectoryNotFoundException] {
+        return
+    }
+
+    if ($attributes.HasFlag([System.IO.FileAttributes]::Directory)) {
+        # a symlink or junction is removed without touching the directory it
+        # points to, Directory.Delete does not follow them when recursing
+        [System.IO.Directory]::Delete($path, -not $attributes.HasFlag([System.IO.FileAttributes]::ReparsePoint))
+    }
+    else {
+        if ($attributes.HasFlag([System.IO.FileAttributes]::ReadOnly)) {
+            [System.IO.File]::SetAttributes($path, $attributes -band -bnot [System.IO.FileAttributes]::ReadOnly)
+        }
+        [System.IO.File]::Delete($path)
+    }
+}
+
 if ($copy_mode -eq "query") {
     # we only return a list of files/directories that need to be copied over
     # the source of the local file will be the key used
@@ -273,6 +1067,94 @@ if ($copy_mode -eq "query") {
     $changed_directories = @()
     $changed_symlinks = @()
 
+    if ($manifest) {
+        # a directory copy sends its entries in a manifest file, only return
+        # the index of the entries that need to be copied. The size and last
+        # write time are checked first so the checksum is only calculated
+        # when they differ.
+        $changed_entries = New-Object -TypeName System.Collections.Generic.List[Int]
+        $entries = Read-Manifest -path $manifest
+        $cache = $null
+        if ($force -and $remote_checksum_cache -and $checksum_algorithm -ne "size_mtime") {
+            $cache = Read-ChecksumCache -dest $dest
+        }
+        Complete-Stage -name "manifest"
+        for ($i = 0; $i -lt $entries.Count; $i++) {
+            $entry = $entries[$i]
+            $entry_path = [System.IO.Path]::Combine($dest, $entry.dest)
+
+            if ($entry.type -eq "d") {
+                $parent_dir = [System.IO.Path]::GetDirectoryName($entry_path)
+                if ([System.IO.File]::Exists($parent_dir)) {
+                    Fail-Json -obj $result -message "cannot copy folder to dest '$entry_path': object at parent directory path is already a file"
+                }
+                if ([System.IO.File]::Exists($entry_path)) {
+                    Fail-Json -obj $result -message "cannot copy folder to dest '$entry_path': object at path is already a file"
+                }
+                elseif (-not [System.IO.Directory]::Exists($entry_path)) {
+                    $changed_entries.Add($i)
+                }
+            }
+            elseif ([System.IO.Directory]::Exists($entry_path)) {
+                Fail-Json -obj $result -message "cannot copy file to dest '$entry_path': object at path is already a directory"
+            }
+            elseif ([System.IO.File]::Exists($entry_path)) {
+                if ($force) {
+                    $file_info = New-Object -TypeName System.IO.FileInfo -ArgumentList $entry_path
+                    if ($file_info.Length -ne $entry.size) {
+                        $changed_entries.Add($i)
+                    }
+                    elseif ($file_info.LastWriteTimeUtc.ToFileTimeUtc() -ne $entry.mtime) {
+                        if ($checksum_algorithm -eq "size_mtime") {
+                            $changed_entries.Add($i)
+                        }
+                        else {
+                            $file_checksum = Get-CachedChecksum -cache $cache -name $entry.dest -file_info $file_info
+                            if ($file_checksum -ne $entry.checksum) {
+                                $changed_entries.Add($i)
+                            }
+                        }
+                    }
+                }
+            }
+            else {
+                $changed_entries.Add($i)
+            }
+        }
+        $result.changed_entries = $changed_entries
+        Complete-Stage -name "compare"
+
+        if ($null -ne $cache) {
+            # only keep the cached entries of files still in the manifest
+            $manifest_names = @{}
+            foreach ($entry in $entries) {
+                $manifest_names[$entry.dest] = $true
+            }
+            foreach ($name in @($cache.entries.Keys)) {
+                if (-not $manifest_names.ContainsKey($name)) {
+                    $cache.entries.Remove($name)
+                    $cache.modified = $true
+                }
+            }
+            Write-ChecksumCache -cache $cache
+            Complete-Stage -name "cache"
+        }
+
+        if ($mirror) {
+            $names = New-Object -TypeName 'System.Collections.Generic.HashSet[String]' -ArgumentList @(
+                [System.StringComparer]::OrdinalIgnoreCase
+            )
+            foreach ($entry in $entries) {
+                $null = $names.Add($entry.dest.Replace("/", "\"))
+            }
+            foreach ($symlink in $symlinks) {
+                $null = $names.Add($symlink.dest.Replace("/", "\"))
+            }
+            $result.extra_entries = Get-ExtraEntry -dest $dest -root $mirror_root.Replace("/", "\") -names $names -recurse $mirror_recurse
+            Complete-Stage -name "mirror"
+        }
+    }
+
     foreach ($file in $files) {
         $filename = $file.dest
         $local_checksum = $file.checksum
@@ -282,11 +1164,20 @@ if ($copy_mode -eq "query") {
         if (Test-Path -LiteralPath $filepath -PathType Container) {
             $filename = Join-Path $filename -ChildPath (Split-Path -Path $file.src -Leaf)
             $filepath = Join-Path -Path $dest -ChildPath $filename
+            # the file is copied into the directory, return the name it is
+            # copied to
+            $file.dest = $filename
         }
 
         if (Test-Path -LiteralPath $filepath -PathType Leaf) {
-            if ($force) {
-                $checksum = Get-FileChecksum -path $filepath
+            if ($force -and $checksum_algorithm -eq "size_mtime") {
+                $file_info = New-Object -TypeName System.IO.FileInfo -ArgumentList $filepath
+                if ($file_info.Length -ne $file.size -or $file_info.LastWriteTimeUtc.ToFileTimeUtc() -ne $file.mtime) {
+                    $changed_files += $file
+                }
+            }
+            elseif ($force) {
+                $checksum = Get-WinCopyChecksum -path $filepath
                 if ($checksum -ne $local_checksum) {
                     $changed_files += $file
                 }
@@ -316,16 +1207,38 @@ if ($copy_mode -eq "query") {
         }
     }
 
-    # TODO: Handle symlinks
+    if ($symlinks) {
+        Import-WinCopyHelper
+    }
+    foreach ($symlink in $symlinks) {
+        $linkpath = [System.IO.Path]::Combine($dest, $symlink.dest)
+        $parent_dir = [System.IO.Path]::GetDirectoryName($linkpath)
+        if ([System.IO.File]::Exists($parent_dir)) {
+            Fail-Json -obj $result -message "cannot create symlink at dest '$linkpath': object at parent directory path is already a file"
+        }
+        Assert-LinkTarget -path $linkpath -target $symlink.src
+        if (-not $force -and [int](New-Object -TypeName System.IO.FileInfo -ArgumentList $linkpath).Attributes -ne -1) {
+            continue
+        }
+        if (Test-LinkChanged -path $linkpath -target $symlink.src) {
+            $changed_symlinks += $symlink
+        }
+    }
 
     $result.files = $changed_files
     $result.directories = $changed_directories
     $result.symlinks = $changed_symlinks
+    Complete-Stage -name "compare"
 }
 elseif ($copy_mode -eq "explode") {
     # a single zip file containing the files and directories needs to be
     # expanded this will always result in a change as the calculation is done
     # on the win_copy action plugin and is only run if a change needs to occur
+    if ($src_parts) {
+        Join-SourcePart -parts $src_parts -dest $src
+        Complete-Stage -name "join"
+    }
+
     if (-not (Test-Path -LiteralPath $src -PathType Leaf)) {
         Fail-Json -obj $result -message "Cannot expand src zip file: '$src' as it does not exist"
     }
@@ -339,13 +1252,61 @@ elseif ($copy_mode -eq "explode") {
     catch {
         $use_legacy = $true
     }
+    # mirror removes the entries in dest that are not in the source before
+    # the zip is extracted
+    foreach ($name in $purge) {
+        Remove-ExtraEntry -path ([System.IO.Path]::Combine($dest, $name))
+    }
+    Complete-Stage -name "purge"
+
+    $manifest_files = Get-ManifestFile -path $manifest
+    $cache = $null
+    if ($manifest -and $remote_checksum_cache -and $checksum_algorithm -ne "size_mtime") {
+        $cache = Read-ChecksumCache -dest $dest
+    }
+    Complete-Stage -name "manifest"
+
     if ($use_legacy) {
-        Expand-ZipLegacy -src $src -dest $dest
+        Expand-ZipLegacy -src $src -dest $dest -manifest_files $manifest_files -cache $cache
     }
     else {
-        Expand-Zip -src $src -dest $dest
+        Expand-Zip -src $src -dest $dest -manifest_files $manifest_files -cache $cache
+    }
+    Complete-Stage -name "extract"
+
+    # files with the same content as another file are only sent once and are
+    # copied from that file once it has been extracted
+    foreach ($duplicate in $duplicates) {
+        $duplicate_src = [System.IO.Path]::Combine($dest, $duplicate.src)
+        foreach ($name in $duplicate.dest) {
+            $duplicate_path = [System.IO.Path]::Combine($dest, $name)
+            $parent_dir = [System.IO.Path]::GetDirectoryName($duplicate_path)
+            if (-not [System.IO.Directory]::Exists($parent_dir)) {
+                $null = [System.IO.Directory]::CreateDirectory($parent_dir)
+            }
+            [System.IO.File]::Copy($duplicate_src, $duplicate_path, $true)
+            Complete-ManifestFile -path $duplicate_path -name $name -manifest_files $manifest_files -cache $cache
+        }
+    }
+    Complete-Stage -name "duplicates"
+
+    if ($null -ne $cache) {
+        Write-ChecksumCache -cache $cache
+        Complete-Stage -name "cache"
     }
 
+    # the symlinks are created once the files and directories they may point
+    # to have been extracted
+    if ($symlinks) {
+        Import-WinCopyHelper
+    }
+    foreach ($symlink in $symlinks) {
+        $linkpath = [System.IO.Path]::Combine($dest, $symlink.dest)
+        Assert-LinkTarget -path $linkpath -target $symlink.src
+        New-Link -path $linkpath -target $symlink.src -directory ([bool]$symlink.directory)
+    }
+    Complete-Stage -name "symlinks"
+
     $result.changed = $true
 }
 elseif ($copy_mode -eq "remote") {
@@ -423,41 +1384,103 @@ elseif ($copy_mode -eq "remote") {
     if ($diff_mode) {
         $result.diff.prepared = $diff
     }
+    Complete-Stage -name "copy"
 }
 elseif ($copy_mode -eq "single") {
     # a single file is located in src and we need to copy to dest, this will
     # always result in a change as the calculation is done on the Ansible side
     # before this is run. This should also never run in check mode
+    if ($src_parts) {
+        Join-SourcePart -parts $src_parts -dest $src
+        Complete-Stage -name "join"
+    }
+
     if (-not (Test-Path -LiteralPath $src -PathType Leaf)) {
         Fail-Json -obj $result -message "Cannot copy src file: '$src' as it does not exist"
     }
 
-    # the dest parameter is a directory, we need to append original_basename
-    $remote_dest = $dest
-    if ($dest.EndsWith("/") -or $dest.EndsWith("`\") -or (Test-Path -LiteralPath $dest -PathType Container)) {
-        $remote_dest = Join-Path -Path $dest -ChildPath $original_basename
+    $remote_dest = Resolve-SingleDest -dest $dest -original_basename $original_basename
+
+    if ($backup) {
+        $result.backup_file = Backup-File -path $remote_dest -WhatIf:$check_mode
     }
-    $parent_dir = Split-Path -LiteralPath $remote_dest
 
-    # check if the dest parent dirs exist, need to fail if they don't
-    if (Test-Path -LiteralPath $parent_dir -PathType Leaf) {
-        Fail-Json -obj $result -message "object at destination parent dir '$parent_dir' is currently a file"
+    if ($src_staged) {
+        # the staging file is next to dest so it can be renamed in place
+        Move-Item -LiteralPath $src -Destination $remote_dest -Force | Out-Null
+        Remove-Item -LiteralPath "$src.state" -Force -ErrorAction SilentlyContinue
     }
-    elseif (-not (Test-Path -LiteralPath $parent_dir -PathType Container)) {
-        if ($dest -eq $remote_dest) {
-            Fail-Json -obj $result -message "Destination directory '$parent_dir' does not exist"
+    else {
+        Copy-Item -LiteralPath $src -Destination $remote_dest -Force | Out-Null
+    }
+    if ($null -ne $mtime) {
+        # a single file from a directory copy, dest is the root of the copy
+        $cache = $null
+        if ($remote_checksum_cache -and $src_checksum) {
+            $cache = Read-ChecksumCache -dest $dest
         }
-        else {
-            $null = New-Item -Path $parent_dir -ItemType Directory
+        $manifest_files = @{
+            $original_basename = @{ mtime = [Int64]$mtime; checksum = $src_checksum }
+        }
+        Complete-ManifestFile -path $remote_dest -name $original_basename -manifest_files $manifest_files -cache $cache
+        if ($null -ne $cache) {
+            Write-ChecksumCache -cache $cache
         }
     }
+    Complete-Stage -name "copy"
+    $result.changed = $true
+}
+elseif ($copy_mode -eq "stage") {
+    # a large single file is being sent in chunks, each chunk is verified and
+    # appended to a staging file next to dest at the offset the action plugin
+    # expects. When src is not set only the current offset is returned so an
+    # interrupted transfer can be resumed. This should never run in check mode
+    if (-not $src_checksum) {
+        Fail-Json -obj $result -message "_checksum is required in stage mode"
+    }
 
-    if ($backup) {
-        $result.backup_file = Backup-File -path $remote_dest -WhatIf:$check_mode
+    $remote_dest = Resolve-SingleDest -dest $dest -original_basename $original_basename
+    $staging_path = "$remote_dest.win_copy_partial"
+    $result.staging_path = $staging_path
+    $state_offset = Get-StagingState -path $staging_path -checksum $src_checksum
+
+    if ($src) {
+        if ([Int64]$offset -ne $state_offset) {
+            Fail-Json -obj $result -message "chunk offset $offset does not match the staging file offset $state_offset"
+        }
+
+        $actual_checksum = Get-FileChecksum -path $src
+        if ($actual_checksum -ne $chunk_checksum) {
+            Remove-Item -LiteralPath $src -Force
+            Fail-Json -obj $result -message "chunk checksum '$actual_checksum' at offset $offset does not match the expected checksum '$chunk_checksum'"
+        }
+
+        $staging_stream = [System.IO.File]::Open($staging_path, [System.IO.FileMode]::OpenOrCreate, [System.IO.FileAccess]::Write)
+        try {
+            # drop anything written past the last verified chunk
+            $staging_stream.SetLength($state_offset)
+            $null = $staging_stream.Seek($state_offset, [System.IO.SeekOrigin]::Begin)
+            $chunk_stream = [System.IO.File]::OpenRead($src)
+            try {
+                $chunk_stream.CopyTo($staging_stream, 1MB)
+            }
+            finally {
+                $chunk_stream.Dispose()
+            }
+            $staging_stream.Flush($true)
+            $state_offset = $staging_stream.Length
+        }
+        finally {
+            $staging_stream.Dispose()
+        }
+
+        [System.IO.File]::WriteAllText("$staging_path.state", "$src_checksum`t$state_offset")
+        Remove-Item -LiteralPath $src -Force
+        $result.changed = $true
     }
 
-    Copy-Item -LiteralPath $src -Destination $remote_dest -Force | Out-Null
-    $result.changed = $true
+    $result.offset = $state_offset
+    Complete-Stage -name "stage"
 }
 
 Exit-Json -obj $result
@@ -13,6 +13,81 @@ description:
 - The C(win_copy) module copies a file on the local box to remote windows locations.
 - For non-Windows targets, use the M(ansible.builtin.copy) module instead.
 options:
+  checksum_algorithm:
+    description:
+    - The algorithm used to compare a local file with the remote file when
+      C(force=true).
+    - C(sha1) and C(sha256) are cryptographic hashes, files with the same
+      checksum are treated as the same content so a duplicate file is only
+      sent once.
+    - C(crc32) is a much faster non-cryptographic checksum that can detect
+      accidental changes but not deliberate ones. It should only be used on
+      trusted source trees, duplicate files are always sent.
+    - C(size_mtime) does not read the files at all, a remote file is replaced
+      when its size or modification time differs from the local file. The
+      modification time of each copied file is set to the time of the local
+      file. A file whose content changes without changing its size or
+      modification time is not copied. Duplicate files are always sent.
+    - The checksums of each algorithm are kept separately in
+      C(local_checksum_cache) and C(remote_checksum_cache), neither is used
+      with C(size_mtime).
+    - Not used when C(remote_src=true).
+    type: str
+    choices:
+    - sha1
+    - sha256
+    - crc32
+    - size_mtime
+    default: sha1
+    version_added: 3.8.0
+  chunk_size:
+    description:
+    - When copying multiple files, build the zip archive sent to the remote
+      host in chunks of this size and transfer each chunk as soon as it is
+      complete.
+    - This keeps the disk space used on the controller to one chunk rather than
+      the whole archive and allows the transfer to start before the whole
+      archive has been built.
+    - The chunks are joined back together on the remote host before the
+      archive is extracted.
+    - The value can be the number of bytes or a human readable size like
+      C(64MB).
+    - When not set, the whole archive is created on the controller before it
+      is transferred.
+    - When copying a single file larger than this size, the file is sent in
+      chunks to a staging file next to the destination called
+      C(<dest>.win_copy_partial). The remote host verifies the checksum of
+      each chunk and records the offset of the last one written. If the
+      connection fails the transfer is resumed from that offset, and a task
+      that failed part way through resumes from it the next time it is run
+      with the same source file.
+    type: str
+    version_added: 3.8.0
+  compression:
+    description:
+    - Controls which files are compressed in the zip archive used when copying
+      multiple files.
+    - C(auto) will compress each file unless its extension is a known
+      compressed format, like C(.zip), C(.msi), C(.cab), C(.jpg) or C(.nupkg),
+      or a sample from the start of the file has a high entropy. These files
+      are stored in the archive as is.
+    - C(always) will compress every file.
+    - C(never) will store every file without compression.
+    type: str
+    choices:
+    - always
+    - auto
+    - never
+    default: auto
+    version_added: 3.8.0
+  compression_level:
+    description:
+    - The compression level, from C(1) to C(9), used for the files that are
+      compressed in the zip archive.
+    - Lower levels are faster while higher levels produce a smaller archive.
+    type: int
+    default: 6
+    version_added: 3.8.0
   content:
     description:
     - When used instead of C(src), sets the contents of a file directly to the
@@ -36,8 +111,33 @@ options:
       with "/" or "\", or C(src) is a directory.
     - If C(src) and C(dest) are files and if the parent directory of C(dest)
       doesn't exist, then the task will fail.
-    type: path
+    - Can be a list of paths to copy the same C(src) or C(content) to multiple
+      destinations. The source is read, hashed and sent to the remote host
+      once, each destination is then compared and only the destinations that
+      differ are updated on the remote host. The result of each destination is
+      returned in C(destinations).
+    - A list is not supported with C(remote_src=true) and a single file is
+      not sent in chunks to a staging file with C(chunk_size) when copying to
+      a list of destinations.
+    - Added support for a list in version C(3.8.0).
+    type: raw
     required: yes
+  exclude:
+    description:
+    - A list of glob patterns of the files and directories to skip when C(src)
+      is a directory.
+    - A pattern without a C(/) is matched against the name of each entry, like
+      C(*.pdb). A pattern with a C(/) is matched against the path relative to
+      C(src) using C(/) as the separator, like C(bin/Debug).
+    - A pattern ending with C(/) only matches a directory, like C(obj/) or
+      C(.git/).
+    - An excluded directory is skipped along with everything inside it, the
+      entries inside it are not read, hashed or sent to the remote host.
+    - The patterns are case sensitive.
+    - Not used when C(remote_src=true) or C(src) is a file.
+    type: list
+    elements: str
+    version_added: 3.8.0
   backup:
     description:
     - Determine whether a backup should be created.
@@ -55,14 +155,95 @@ options:
       destination does not exist.
     - If set to C(false), no checksuming of the content is performed which can
       help improve performance on larger files.
+    - When copying a directory, a file with the same content as another file
+      being copied or an up to date file in the destination is only sent once
+      and copied on the remote host.
+    - When copying a directory, the size and modification time of each remote
+      file is compared first and the checksum is only calculated when the size
+      is the same but the modification time differs. The modification time of
+      each file copied from a directory is set to the time of the source file
+      so an unchanged file does not need to be hashed again.
     type: bool
     default: yes
+  include:
+    description:
+    - A list of glob patterns of the files to copy when C(src) is a directory,
+      a file that does not match any pattern is skipped.
+    - The patterns are matched in the same way as C(exclude) but only apply to
+      files, each directory is still copied unless it is excluded.
+    - A file that matches both an C(include) and C(exclude) pattern is
+      skipped.
+    - Not used when C(remote_src=true) or C(src) is a file.
+    type: list
+    elements: str
+    version_added: 3.8.0
+  local_checksum_cache:
+    description:
+    - Path to a file on the Ansible controller used to cache the checksums of
+      the local source files between runs.
+    - A cached checksum is only used when the path, size, modification time
+      and inode of the local file are unchanged, otherwise the file is hashed
+      again and the cache is updated.
+    - The cache keeps up to 100000 entries, the least recently used entries are
+      evicted once this limit is reached.
+    - The cache is stored as an SQLite database and can be shared by multiple
+      hosts and tasks.
+    - There is no default path, when not set the checksums are not cached and
+      no cache file is created on the controller.
+    - Only used when C(force=true) and C(remote_src=false).
+    - Regardless of this option, the local files are hashed in parallel when
+      copying a directory.
+    type: path
+    version_added: 3.8.0
   local_follow:
     description:
     - This flag indicates that filesystem links in the source tree, if they
       exist, should be followed.
+    - When C(false), a link in the source tree is created as a symbolic link
+      on the remote host with the same target. A link to a directory is
+      created as a junction if the connection user does not have the
+      privilege to create symbolic links.
+    - A link with an absolute target is only created when the target is
+      inside the source directory, the target is made relative to the link.
+      Other absolute links are skipped with a warning.
+    - A link with a relative target that resolves to a path outside of
+      C(dest), like C(../../..), is skipped with a warning.
     type: bool
     default: yes
+  mirror:
+    description:
+    - When copying a directory, remove the files and directories in the
+      mirrored directory on the remote host that are not in C(src).
+    - The mirrored directory is C(dest) when C(src) ends with a path separator,
+      otherwise it is the directory named after C(src) inside C(dest).
+    - The extra entries are removed in the same step that copies the changed
+      files, no other connection to the remote host is made.
+    - Entries skipped by C(exclude) or C(include) are not removed, nor is the
+      C(.ansible_win_copy_cache) file used by C(remote_checksum_cache).
+    - An extra directory is removed with everything inside it, unless it
+      contains an entry skipped by C(exclude) or C(include). Then only the
+      entries inside it that are not skipped are removed.
+    - An extra directory that is a link is removed without removing the
+      contents of its target.
+    - Only used when C(src) is a directory, not supported when
+      C(remote_src=true).
+    type: bool
+    default: false
+    version_added: 3.8.0
+  remote_checksum_cache:
+    description:
+    - When copying a directory, keep a cache of the checksums of the remote
+      files in a hidden file called C(.ansible_win_copy_cache) in the root of
+      C(dest).
+    - A cached checksum is only used when the size, modification time and file
+      ID of the remote file are unchanged since it was stored, otherwise the
+      file is hashed again and the cache is updated.
+    - The cache is updated with the checksum of each file copied to the remote
+      host so the next run does not need to hash it.
+    - Only used when C(force=true) and C(remote_src=false).
+    type: bool
+    default: false
+    version_added: 3.8.0
   remote_src:
     description:
     - If C(false), it will search for src at originating/controller machine.
@@ -82,9 +263,31 @@ options:
       folder with the same filename.
     - Required unless using C(content).
     type: path
+  timings:
+    description:
+    - Return the time spent in each stage of the copy in the C(timings) key
+      of the result, along with the bytes and entries that were handled.
+    - This is meant to find where the time goes when a copy is slow.
+    type: bool
+    default: false
+    version_added: 3.8.0
+  transfer_streams:
+    description:
+    - The number of parallel connections used to send a file or the zip
+      archive of multiple files to the remote host.
+    - When greater than C(1), the data is split into up to this many parts
+      which are sent at the same time, each over its own connection, and
+      joined back together on the remote host. This can make better use of a
+      link that a single connection cannot saturate.
+    - Each part is at least 1MB so a smaller file is sent over fewer
+      connections.
+    - Not used for data that is sent in chunks with C(chunk_size).
+    type: int
+    default: 1
+    version_added: 3.8.0
 notes:
-- Currently win_copy does not support copying symbolic links from both local to
-  remote and remote to remote.
+- Currently win_copy does not support copying symbolic links from remote to
+  remote.
 - It is recommended that backslashes C(\) are used instead of C(/) when dealing
   with remote paths.
 - Because win_copy runs over WinRM, it is not a very efficient transfer
@@ -126,6 +329,30 @@ EXAMPLES = r"""
     src: files/temp_files
     dest: C:\Temp
 
+- name: Copy a folder to multiple destinations, the folder is only sent once
+  ansible.windows.win_copy:
+    src: files/temp_files/
+    dest:
+    - C:\App1\Config
+    - C:\App2\Config
+
+- name: Copy build output without the debug symbols and intermediate files
+  ansible.windows.win_copy:
+    src: build/output/
+    dest: C:\App
+    exclude:
+    - '*.pdb'
+    - obj/
+    - .git/
+
+- name: Make C:\App match the build output, files removed from the build are removed from C:\App
+  ansible.windows.win_copy:
+    src: build/output/
+    dest: C:\App
+    mirror: true
+    exclude:
+    - logs/
+
 - name: Copy file only if it does not exist on remote host
   ansible.windows.win_copy:
     src: files/config.ini
@@ -174,17 +401,32 @@ backup_file:
     type: str
     sample: C:\Path\To\File.txt.11540.20150212-220915.bak
 dest:
-    description: Destination file/path.
+    description:
+    - Destination file/path.
+    - A list of the destinations when C(dest) is a list.
     returned: changed
     type: str
     sample: C:\Temp\
+destinations:
+    description:
+    - The result of each destination when C(dest) is a list.
+    - Each entry contains the C(dest) and whether it C(changed), as well as
+      the C(failed) and C(msg) keys if the copy to that destination failed.
+    returned: dest is a list
+    type: list
+    elements: dict
+    sample: [{"dest": "C:\\App1\\Config\\", "changed": true}, {"dest": "C:\\App2\\Config\\", "changed": false}]
+    version_added: 3.8.0
 src:
     description: Source file used for the copy on the target machine.
     returned: changed
     type: str
     sample: /home/httpd/.ansible/tmp/ansible-tmp-1423796390.97-147729857856000/source
 checksum:
-    description: SHA1 checksum of the file after running copy.
+    description:
+    - SHA1 checksum of the file after running copy.
+    - This is the checksum of the C(checksum_algorithm) when set, it is
+      null with C(checksum_algorithm=size_mtime).
     returned: success, src is a file
     type: str
     sample: 6e642bb8dd5c2e027bf21dd923337cbb4214f827
@@ -198,6 +440,59 @@ operation:
     returned: success
     type: str
     sample: file_copy
+bytes_saved:
+    description:
+    - The number of bytes that did not need to be sent to the remote host as
+      the files had the same content as another file being copied or an up to
+      date file in the destination directory.
+    - These files are copied from the other file on the remote host.
+    returned: changed, src is a directory with duplicate files
+    type: int
+    sample: 1048576
+    version_added: 3.8.0
+removed:
+    description:
+    - The paths relative to C(dest) of the extra files and directories that
+      were removed.
+    - When C(dest) is a list, this is returned in each entry of
+      C(destinations).
+    returned: mirror=true
+    type: list
+    elements: str
+    sample: ["old.txt", "bin\\unused"]
+    version_added: 3.8.0
+timings:
+    description:
+    - The time spent in each stage of the copy.
+    - C(total) is the wall time, in seconds, of the whole task on the
+      controller.
+    - C(stages) is the wall time, in seconds, of each stage on the
+      controller. This can contain C(walk), C(hash), C(manifest), C(zip) and
+      C(transfer) as well as the time of each call to the win_copy module
+      keyed by the mode it ran in, like C(query), C(explode), C(single),
+      C(stage) or C(remote). The time of a stage does not include the time of
+      the stages run within it so they add up to the time spent in them.
+    - C(bytes) contains the C(source) size of the files found and the bytes
+      C(transferred) to the remote host.
+    - C(entries) contains the number of C(files), C(directories) and
+      C(symlinks) found in the source and the number of entries that
+      C(changed).
+    - C(remote) contains the time, in seconds, of each stage on the remote
+      host for each module mode. The times of the same mode are added together
+      when it is run more than once.
+    returned: timings=true
+    type: dict
+    sample: {
+        "total": 2.41,
+        "stages": {"walk": 0.05, "hash": 0.31, "manifest": 0.01, "query": 0.82, "zip": 0.12, "transfer": 0.44, "explode": 0.63},
+        "bytes": {"source": 10485760, "transferred": 1048576},
+        "entries": {"files": 120, "directories": 8, "symlinks": 0, "changed": 12},
+        "remote": {
+            "query": {"manifest": 0.02, "compare": 0.21},
+            "explode": {"purge": 0.0, "manifest": 0.01, "extract": 0.18, "duplicates": 0.0, "symlinks": 0.0}
+        }
+    }
+    version_added: 3.8.0
 original_basename:
     description: Basename of the copied file.
     returned: changed, src is a file
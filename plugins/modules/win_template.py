@@ -53,8 +53,8 @@ options:
   dest:
     description:
     - Location to render the template to on the remote machine.
+    - Required unless I(templates) is set.
     type: path
-    required: yes
   force:
     description:
     - Determine when the file is being transferred if the destination already exists.
@@ -88,8 +88,30 @@ options:
     - This can be a relative or an absolute path.
     - The file must be encoded with C(utf-8) but I(output_encoding) can be used to control the encoding of the output
       template.
+    - Required unless I(templates) is set.
     type: path
-    required: yes
+  templates:
+    description:
+    - A list of templates to render in the one task, mutually exclusive with I(src) and I(dest).
+    - Each template is rendered with the other options of the task and the destinations are checked with one query
+      of the remote host, the changed files are then sent in one archive.
+    - Destinations on different drives are checked and sent separately.
+    - Unlike a single template the parent directories of each I(dest) are created if they do not exist.
+    - I(backup) cannot be used with this option.
+    type: list
+    elements: dict
+    suboptions:
+      src:
+        description:
+        - Path of a Jinja2 formatted template on the Ansible controller.
+        type: path
+        required: yes
+      dest:
+        description:
+        - Location to render the template to on the remote machine.
+        type: path
+        required: yes
+    version_added: 3.8.0
   trim_blocks:
     description:
     - Determine when newlines should be removed from blocks.
@@ -143,6 +165,16 @@ EXAMPLES = r'''
     newline_sequence: '\n'
     backup: true
 
+- name: Render the config files of a service in one task
+  ansible.windows.win_template:
+    templates:
+    - src: app/appsettings.json.j2
+      dest: C:\App\appsettings.json
+    - src: app/nlog.config.j2
+      dest: C:\App\nlog.config
+    - src: app/web.config.j2
+      dest: C:\App\wwwroot\web.config
+
 - name: Render template with trimmed newlines
   ansible.windows.win_template:
     src: unix/config.conf.j2
@@ -156,4 +188,35 @@ backup_file:
     returned: if backup=true
     type: str
     sample: C:\Path\To\File.txt.11540.20150212-220915.bak
+templates:
+    description: The result of each template when I(templates) is set.
+    returned: templates is set
+    type: list
+    elements: dict
+    contains:
+      src:
+        description: The path of the template on the controller.
+        returned: always
+        type: str
+        sample: /home/user/roles/app/templates/app/web.config.j2
+      dest:
+        description: The path the template was rendered to.
+        returned: always
+        type: str
+        sample: C:\App\wwwroot\web.config
+      changed:
+        description: Whether the file was changed.
+        returned: always
+        type: bool
+        sample: true
+      checksum:
+        description: The SHA1 checksum of the rendered template.
+        returned: always
+        type: str
+        sample: 6e642bb8dd5c2e027bf21dd923337cbb4214f827
+      size:
+        description: The size in bytes of the rendered template.
+        returned: always
+        type: int
+        sample: 1024
 '''
@@ -0,0 +1,359 @@
+# Copyright (c) 2026 Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Local checksum helpers for Windows actions
+
+This contains code to checksum files on the controller for use by the action
+plugins in this collection. Right now it should only be used in ansible.windows
+as the interface is not final and could be subject to change.
+"""
+
+# FOR INTERNAL COLLECTION USE ONLY
+# The interfaces in this file are meant for use within the ansible.windows collection
+# and may not remain stable to outside uses. Changes may be made in ANY release, even a bugfix release.
+# See also: https://github.com/ansible/community/issues/539#issuecomment-780839686
+# Please open an issue if you have questions about this.
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+import typing as t
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.errors import AnsibleError
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+from ansible.utils.display import Display
+
+try:
+    import sqlite3
+except ImportError:  # pragma: nocover
+    sqlite3 = None  # type: ignore[assignment]
+
+
+display = Display()
+
+# The default number of entries kept in a persistent checksum cache, once
+# exceeded the least recently used entries are evicted.
+DEFAULT_CACHE_MAX_ENTRIES = 100000
+
+
+# The size of each read when hashing a file, the first block is also passed to
+# the header check of checksum_files.
+_READ_BLOCK_SIZE = 64 * 1024
+
+# The algorithms that can be used to compare a local and remote file. The
+# hashes must match what win_copy.ps1 calculates, size_mtime only compares the
+# size and modification time so no checksum is calculated.
+CHECKSUM_ALGORITHMS = ('sha1', 'sha256', 'crc32', 'size_mtime')
+
+
+def _default_workers() -> int:
+    # Mirrors the ThreadPoolExecutor default. Hashing is mostly spent in
+    # hashlib and file reads which both release the GIL.
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class _Crc32:
+    """A hashlib like object for the CRC-32 of zlib, formatted as 8 hex digits."""
+
+    def __init__(self) -> None:
+        self._value = 0
+
+    def update(self, data: bytes) -> None:
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self) -> str:
+        return '%08x' % (self._value & 0xFFFFFFFF)
+
+
+def _new_hash(algorithm: str) -> t.Any:
+    if algorithm == 'crc32':
+        return _Crc32()
+    elif algorithm in ('sha1', 'sha256'):
+        return hashlib.new(algorithm)
+    else:
+        raise ValueError("Cannot checksum a file with the algorithm '%s'" % algorithm)
+
+
+class LocalChecksumCache:
+    """Persistent cache of local file checksums.
+
+    Entries are keyed by the path, size, mtime in nanoseconds and inode of the
+    file so a cached value is only used when the file has not changed since it
+    was last hashed. The cache is stored in an SQLite database so multiple
+    forks can safely share the same file. The new checksums are only written
+    by flush() in one short transaction so the database is not locked while
+    the files are hashed. The checksums of each algorithm are kept in their
+    own table.
+
+    Any failure to open or update the database is reported as a warning and
+    the cache is disabled, it should never cause the task itself to fail.
+
+    Args:
+        path: The path to the cache database file.
+        max_entries: The maximum number of entries to keep in the cache.
+        algorithm: The checksum algorithm of the cached values.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+        algorithm: str = 'sha1',
+    ) -> None:
+        if algorithm not in CHECKSUM_ALGORITHMS or algorithm == 'size_mtime':
+            raise ValueError("Cannot cache checksums of the algorithm '%s'" % algorithm)
+
+        self.path = path
+        self.max_entries = max_entries
+        # sha1 keeps the table name used before other algorithms were added
+        self._table = 'checksums' if algorithm == 'sha1' else 'checksums_%s' % algorithm
+        self._conn: t.Optional[t.Any] = None
+        self._hits: t.List[t.Tuple[float, str]] = []
+        self._pending: t.List[t.Tuple[str, int, int, int, str, float]] = []
+
+        if sqlite3 is None:
+            display.warning("Cannot use checksum cache '%s' as the sqlite3 Python library is not available" % path)
+            return
+
+        try:
+            cache_dir = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            self._conn = sqlite3.connect(path, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, checksum TEXT, used REAL)"
+                % self._table
+            )
+            self._conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            self._disable(e)
+
+    def __enter__(self) -> LocalChecksumCache:
+        return self
+
+    def __exit__(self, *args: t.Any, **kwargs: t.Any) -> None:
+        self.close()
+
+    def _disable(self, exc: Exception) -> None:
+        display.warning("Disabling checksum cache '%s' after failure: %s" % (self.path, to_text(exc)))
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+
+    def get(
+        self,
+        path: str,
+        stat: os.stat_result,
+    ) -> t.Optional[str]:
+        """Get the cached checksum for path if it is still current."""
+        if self._conn is None:
+            return None
+
+        text_path = to_text(path, errors='surrogate_or_strict')
+        try:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, checksum FROM %s WHERE path = ?" % self._table,
+                (text_path,),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+
+        if row and tuple(row[:3]) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            self._hits.append((time.time(), text_path))
+            return row[3]
+
+        return None
+
+    def set(
+        self,
+        path: str,
+        stat: os.stat_result,
+        value: str,
+    ) -> None:
+        """Store the checksum of path with the stat it was calculated from.
+        The value is written to the database on the next flush()."""
+        if self._conn is None:
+            return
+
+        self._pending.append(
+            (to_text(path, errors='surrogate_or_strict'), stat.st_size, stat.st_mtime_ns, stat.st_ino, value, time.time())
+        )
+
+    def flush(self) -> None:
+        """Write the pending checksums and usage times to the database."""
+        if self._conn is None or not (self._pending or self._hits):
+            return
+
+        try:
+            with self._conn:
+                if self._pending:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO %s (path, size, mtime_ns, inode, checksum, used) VALUES (?, ?, ?, ?, ?, ?)"
+                        % self._table,
+                        self._pending,
+                    )
+                if self._hits:
+                    self._conn.executemany("UPDATE %s SET used = ? WHERE path = ?" % self._table, self._hits)
+        except sqlite3.Error as e:
+            self._disable(e)
+
+        self._pending = []
+        self._hits = []
+
+    def close(self) -> None:
+        """Flush the pending changes, evict old entries and close the cache."""
+        self.flush()
+        if self._conn is None:
+            return
+
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM {0} WHERE path NOT IN (SELECT path FROM {0} ORDER BY used DESC LIMIT ?)".format(self._table),
+                    (self.max_entries,),
+                )
+            self._conn.close()
+        except sqlite3.Error as e:
+            self._disable(e)
+
+        self._conn = None
+
+
+def _checksum_file(
+    path: str,
+    algorithm: str,
+    header_check: t.Optional[t.Callable[[str, bytes], bool]],
+    cache_check: t.Optional[t.Callable[[bytes], bool]],
+) -> t.Tuple[t.Optional[str], bool]:
+    # returns the checksum and whether it can be stored in a cache
+    digest = _new_hash(algorithm)
+    try:
+        with open(to_bytes(path, errors='surrogate_or_strict'), 'rb') as fd:
+            block = fd.read(_READ_BLOCK_SIZE)
+            if header_check is not None and header_check(path, block):
+                return None, False
+            cacheable = cache_check is None or cache_check(block)
+
+            while block:
+                digest.update(block)
+                block = fd.read(_READ_BLOCK_SIZE)
+    except (FileNotFoundError, IsADirectoryError):
+        return None, False
+    except OSError as e:
+        raise AnsibleError("Error while accessing the file %r." % path) from e
+
+    return digest.hexdigest(), cacheable
+
+
+def checksum_file(
+    path: str,
+    algorithm: str = 'sha1',
+    header_check: t.Optional[t.Callable[[str, bytes], bool]] = None,
+) -> t.Optional[str]:
+    """Get the checksum of a file unless header_check rejects it.
+
+    The file is read once, the first block read is passed to header_check
+    before it is hashed. Like ansible.utils.hashing.checksum, None is returned
+    if the path does not exist or is a directory.
+    """
+    return _checksum_file(path, algorithm, header_check, None)[0]
+
+
+def checksum_data(
+    data: bytes,
+    algorithm: str = 'sha1',
+) -> str:
+    """Get the checksum of data held in memory, the same as checksum_file
+    returns for a file with that content."""
+    digest = _new_hash(algorithm)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def checksum_files(
+    paths: t.List[str],
+    cache: t.Optional[LocalChecksumCache] = None,
+    max_workers: t.Optional[int] = None,
+    header_check: t.Optional[t.Callable[[str, bytes], bool]] = None,
+    algorithm: str = 'sha1',
+    cache_check: t.Optional[t.Callable[[bytes], bool]] = None,
+) -> t.List[t.Optional[str]]:
+    """Get the checksum of multiple local files.
+
+    Files that are not in the cache are hashed on a bounded thread pool. The
+    returned list is in the same order as the input paths.
+
+    A header_check is called with the path and first bytes of each file that
+    is hashed, the file is read once for both. When it returns True the file
+    is not hashed, its checksum is None and it is not stored in the cache.
+
+    A file found in the cache is not read so the header_check is not called
+    for it. A file that a header_check would reject must never be stored in a
+    cache shared with it, whatever header_check the caller that stored it
+    used. The cache_check is called with the first bytes of each file that is
+    hashed and the checksum is only stored in the cache when it returns True.
+
+    Args:
+        paths: The local paths to checksum.
+        cache: An optional cache to lookup and store the checksums in.
+        max_workers: The maximum number of threads to hash with.
+        header_check: An optional callable to skip files by their header.
+        algorithm: The checksum algorithm, the cache must be for the same
+            algorithm.
+        cache_check: An optional callable to not cache files by their header.
+
+    Returns:
+        List[Optional[str]]: The checksum for each path, None if the path
+        could not be hashed.
+    """
+    results: t.List[t.Optional[str]] = [None] * len(paths)
+    stats: t.Dict[int, os.stat_result] = {}
+    misses = []
+
+    for idx, path in enumerate(paths):
+        if cache is not None:
+            try:
+                stats[idx] = os.stat(to_bytes(path, errors='surrogate_or_strict'))
+            except OSError:
+                pass
+            else:
+                value = cache.get(path, stats[idx])
+                if value is not None:
+                    results[idx] = value
+                    continue
+
+        misses.append(idx)
+
+    if not misses:
+        return results
+
+    def hash_func(path):
+        return _checksum_file(path, algorithm, header_check, cache_check)
+
+    workers = min(len(misses), max_workers or _default_workers())
+    if workers < 2:
+        hashed = [hash_func(paths[idx]) for idx in misses]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashed = list(executor.map(hash_func, [paths[idx] for idx in misses]))
+
+    for idx, (value, cacheable) in zip(misses, hashed):
+        results[idx] = value
+        if cache is not None and cacheable and idx in stats:
+            cache.set(paths[idx], stats[idx], value)
+
+    if cache is not None:
+        cache.flush()
+
+    return results
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+# Copyright: Contributors to the Ansible project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Benchmarks for the win_copy action plugin.
+
+These are kept out of tests/unit so the unit tests do not spend time on the
+timing loops. They require pytest-benchmark and are skipped when it is not
+installed. Run them with:
+
+    pytest tests/benchmarks/test_win_copy_benchmark.py --benchmark-only
+
+The remote host is replaced by stand-ins for _transfer_file and
+_execute_module that record the bytes sent and the module calls made. The
+transfer stand-in can also simulate a link with the bandwidth, in bytes per
+second, set by WIN_COPY_BENCHMARK_BANDWIDTH. This defaults to 100 Mbit/s and
+is only used by the benchmarks that measure the transfer.
+
+The size of the synthetic trees is multiplied by WIN_COPY_BENCHMARK_SCALE,
+which defaults to 1. test_walk_scandir compares the os.scandir walker against
+the os.walk based walker it replaced on a larger tree, run it against an NFS
+or other network share with --basetemp to see the difference in syscalls.
+test_hash_algorithm reports the throughput of each checksum_algorithm in
+bytes_per_second.
+
+Each benchmark adds the payload_bytes, transfers and module_calls it caused
+to the extra_info of the report so a change in the data sent or the number of
+round trips shows up next to the timings.
+"""
+
+import gzip
+import ntpath
+import os
+import random
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from ansible.playbook.task import Task
+from ansible_collections.ansible.windows.plugins.action import win_copy
+from ansible_collections.ansible.windows.plugins.plugin_utils._checksum import checksum_files
+
+pytest.importorskip("pytest_benchmark")
+
+BANDWIDTH = int(os.environ.get("WIN_COPY_BENCHMARK_BANDWIDTH", 12500000))
+SCALE = int(os.environ.get("WIN_COPY_BENCHMARK_SCALE", 1))
+
+
+class TransferStandIn:
+    """Records the bytes sent and sleeps to simulate the link bandwidth."""
+
+    def __init__(self, bandwidth=BANDWIDTH):
+        self.bandwidth = bandwidth
+        self.calls = 0
+        self.bytes = 0
+        self.manifests = {}
+
+    def __call__(self, local_path, remote_path):
+        size = os.path.getsize(local_path)
+        self.calls += 1
+        self.bytes += size
+        if remote_path.endswith("manifest.gz"):
+            with open(local_path, "rb") as fd:
+                self.manifests[remote_path] = fd.read()
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+        return remote_path
+
+
+class ModuleStandIn:
+    """Records the win_copy module calls and answers them like a host with an
+    empty destination, every entry sent to query is reported as changed."""
+
+    def __init__(self, transfer):
+        self.transfer = transfer
+        self.calls = []
+
+    def __call__(self, module_name, module_args, task_vars):
+        self.calls.append(module_args["_copy_mode"])
+        if module_args["_copy_mode"] != "query":
+            return {"changed": True}
+
+        if module_args.get("_manifest"):
+            b_manifest = gzip.decompress(self.transfer.manifests[module_args["_manifest"]])
+            count = len(b_manifest.splitlines()) - 1
+            return {"changed_entries": list(range(count)), "symlinks": []}
+
+        return {"files": module_args["files"], "directories": module_args["directories"], "symlinks": []}
+
+
+def _write_text(path, size, rand):
+    words = [b"ansible", b"windows", b"copy", b"config", b"value", b"<node>", b"</node>", b"\r\n"]
+    data = bytearray()
+    while len(data) < size:
+        data += rand.choice(words) + b" "
+    path.write_bytes(bytes(data[:size]))
+
+
+@pytest.fixture(scope="module")
+def mixed_tree(tmp_path_factory):
+    """A tree with a mix of compressible text and already compressed files."""
+    rand = random.Random(0)
+    root = tmp_path_factory.mktemp("mixed")
+    files = []
+
+    for idx in range(40):
+        path = root / ("config%d.xml" % idx)
+        _write_text(path, 64 * 1024, rand)
+        files.append(path)
+
+    for idx, ext in enumerate([".zip", ".msi", ".cab", ".jpg", ".nupkg", ".bin"]):
+        path = root / ("payload%d%s" % (idx, ext))
+        path.write_bytes(os.urandom(1024 * 1024))
+        files.append(path)
+
+    return [{"src": str(f), "dest": f.name} for f in files]
+
+
+def _tiny_files(root):
+    for idx in range(2000 * SCALE):
+        path = root / ("dir%d" % (idx // 100)) / ("file%d.txt" % idx)
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"tiny file %d\n" % idx)
+
+
+def _huge_files(root):
+    for idx in range(3):
+        (root / ("huge%d.bin" % idx)).write_bytes(os.urandom(16 * 1024 * 1024 * SCALE))
+
+
+def _deep_nesting(root):
+    path = root
+    for depth in range(64):
+        path = path / ("level%d" % depth)
+        path.mkdir()
+        for idx in range(4 * SCALE):
+            (path / ("file%d.txt" % idx)).write_bytes(b"depth %d file %d\n" % (depth, idx))
+
+
+def _duplicates(root):
+    data = os.urandom(256 * 1024)
+    for idx in range(50 * SCALE):
+        plugin_dir = root / ("plugin%d" % idx)
+        plugin_dir.mkdir()
+        (plugin_dir / "vendored.dll").write_bytes(data)
+        (plugin_dir / "plugin.dll").write_bytes(os.urandom(1024))
+
+
+TREES = {
+    "tiny_files": _tiny_files,
+    "huge_files": _huge_files,
+    "deep_nesting": _deep_nesting,
+    "duplicates": _duplicates,
+}
+
+
+@pytest.fixture(scope="module", params=sorted(TREES))
+def tree(request, tmp_path_factory):
+    """A synthetic source tree, returns the path with a trailing separator."""
+    root = tmp_path_factory.mktemp(request.param)
+    TREES[request.param](root)
+    return str(root) + os.path.sep
+
+
+def _plugin(monkeypatch, tmp_path, transfer, task_args=None, module=None):
+    task = MagicMock(Task)
+    task.args = task_args or {}
+    task.check_mode = False
+    task.async_val = 0
+
+    connection = MagicMock()
+    connection._shell.tmpdir = None
+    connection._shell.join_path = ntpath.join
+    connection._shell.path_has_trailing_slash = lambda path: path.endswith(("/", "\\"))
+
+    loader = MagicMock()
+    loader.get_real_file.side_effect = lambda path, decrypt=True: path
+
+    plugin = win_copy.ActionModule(task, connection, MagicMock(), loader=loader, templar=None,
+                                   shared_loader_obj=None)
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", transfer)
+    monkeypatch.setattr(plugin, "_execute_module", module or MagicMock(return_value={"changed": True}))
+    monkeypatch.setattr(plugin, "_find_needle", lambda dirname, needle: needle)
+    monkeypatch.setattr(plugin, "_make_tmp_path", MagicMock(return_value="C:\\tmp"))
+    monkeypatch.setattr(plugin, "_remove_tmp_path", MagicMock())
+
+    return plugin
+
+
+def _walk(src):
+    loader = MagicMock()
+    loader.get_real_file.side_effect = lambda path, decrypt=True: path
+    return win_copy._walk_dirs(src, loader, checksum_check=False)
+
+
+def test_walk(benchmark, tree):
+    benchmark.group = "win_copy walk"
+    actual = benchmark(_walk, tree)
+    benchmark.extra_info["files"] = len(actual["files"])
+    benchmark.extra_info["directories"] = len(actual["directories"])
+
+
+@pytest.fixture(scope="module")
+def large_tree(tmp_path_factory):
+    """A wide and deep tree of small files used to compare the walkers."""
+    root = tmp_path_factory.mktemp("large")
+    for idx in range(20000 * SCALE):
+        path = root / ("a%d" % (idx % 20)) / ("b%d" % (idx % 400)) / ("file%d.txt" % idx)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    return str(root) + os.path.sep
+
+
+def _os_walk_dirs(topdir, loader):
+    """The os.walk based walker used before _iter_walk_dirs moved to
+    os.scandir, kept as the baseline for test_walk_scandir. It checks each
+    entry for a symlink and resolves and stats each path on its own like the
+    old walker did, symlinks are not handled as the tree has none."""
+    offset = len(topdir)
+    entries = []
+    for base_path, sub_folders, files in os.walk(topdir):
+        sub_folders.sort()
+        for filename in sorted(files):
+            filepath = os.path.join(base_path, filename)
+            if not os.path.islink(filepath):
+                real_file = loader.get_real_file(filepath, decrypt=True)
+                entries.append(win_copy._get_file_entry(real_file, filepath[offset:]))
+
+        for dirname in sub_folders:
+            dirpath = os.path.join(base_path, dirname)
+            os.stat(os.path.realpath(dirpath))
+            if not os.path.islink(dirpath):
+                entries.append(win_copy._WalkEntry("d", dirpath, dirpath[offset:]))
+
+    return entries
+
+
+class LoaderStandIn:
+    """A loader without vault files for the os.walk baseline, a MagicMock
+    costs more per call than the syscalls being compared."""
+
+    def get_real_file(self, path, decrypt=True):
+        return path
+
+
+@pytest.mark.parametrize("walker", ["os_walk", "scandir"])
+def test_walk_scandir(benchmark, large_tree, walker):
+    benchmark.group = "win_copy walker"
+    loader = LoaderStandIn()
+
+    if walker == "os_walk":
+        def walk():
+            return _os_walk_dirs(large_tree, loader)
+    else:
+        def walk():
+            return list(win_copy._iter_walk_dirs(large_tree))
+
+    actual = benchmark(walk)
+    benchmark.extra_info["entries"] = len(actual)
+    assert sorted(e.dest for e in actual) == sorted(e.dest for e in _os_walk_dirs(large_tree, loader))
+
+
+def test_hash(benchmark, tree):
+    benchmark.group = "win_copy hash"
+    paths = [f["src"] for f in _walk(tree)["files"]]
+    benchmark(checksum_files, paths)
+    benchmark.extra_info["bytes"] = sum(os.path.getsize(p) for p in paths)
+
+
+@pytest.fixture(scope="module")
+def hash_tree(tmp_path_factory):
+    """Incompressible files used to compare the checksum algorithms."""
+    root = tmp_path_factory.mktemp("hash")
+    _huge_files(root)
+    return sorted(str(p) for p in root.iterdir())
+
+
+@pytest.mark.parametrize("algorithm", ["sha1", "sha256", "crc32"])
+def test_hash_algorithm(benchmark, hash_tree, algorithm):
+    benchmark.group = "win_copy hash algorithm"
+    actual = benchmark(checksum_files, hash_tree, algorithm=algorithm)
+    assert len(actual) == len(hash_tree)
+
+    size = sum(os.path.getsize(p) for p in hash_tree)
+    benchmark.extra_info["bytes"] = size
+    if benchmark.stats:
+        benchmark.extra_info["bytes_per_second"] = int(size / benchmark.stats.stats.min)
+
+
+def test_zip(benchmark, monkeypatch, tmp_path, tree):
+    benchmark.group = "win_copy zip"
+    walked = _walk(tree)
+    transfer = TransferStandIn(bandwidth=0)
+    plugin = _plugin(monkeypatch, tmp_path, transfer)
+
+    def create_zip():
+        zip_path = plugin._create_zip_tempfile(walked["files"], walked["directories"])
+        size = os.path.getsize(zip_path)
+        os.remove(zip_path)
+        os.rmdir(os.path.dirname(zip_path))
+        return size
+
+    benchmark.extra_info["payload_bytes"] = benchmark(create_zip)
+
+
+def test_run(benchmark, monkeypatch, tmp_path, tree):
+    benchmark.group = "win_copy run"
+    transfer = TransferStandIn(bandwidth=0)
+    module = ModuleStandIn(transfer)
+    plugin = _plugin(monkeypatch, tmp_path, transfer, task_args={"src": tree, "dest": "C:\\dest"}, module=module)
+
+    def run():
+        transfer.calls = transfer.bytes = 0
+        module.calls = []
+        plugin._connection._shell.tmpdir = None
+        result = plugin.run(task_vars={})
+        assert result.get("failed") is not True, result
+        return result
+
+    result = benchmark.pedantic(run, rounds=3)
+
+    benchmark.extra_info["payload_bytes"] = transfer.bytes
+    benchmark.extra_info["transfers"] = transfer.calls
+    benchmark.extra_info["module_calls"] = len(module.calls)
+    benchmark.extra_info["bytes_saved"] = result.get("bytes_saved", 0)
+
+
+@pytest.mark.parametrize("compression", [
+    ("never", 6),
+    ("always", 1),
+    ("always", 6),
+    ("always", 9),
+    ("auto", 1),
+    ("auto", 6),
+    ("auto", 9),
+], ids=lambda c: "%s-%s" % c)
+def test_copy_zip_file_compression(benchmark, monkeypatch, tmp_path, mixed_tree, compression):
+    benchmark.group = "win_copy compression"
+    transfer = TransferStandIn()
+    plugin = _plugin(monkeypatch, tmp_path, transfer)
+
+    benchmark.pedantic(plugin._copy_zip_file, args=("C:\\dest", mixed_tree, [], {}, "C:\\tmp", False),
+                       kwargs={"compression": compression}, rounds=3)
+
+    benchmark.extra_info["payload_bytes"] = transfer.bytes // transfer.calls
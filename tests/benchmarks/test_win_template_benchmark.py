@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright: Contributors to the Ansible project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Benchmarks for the win_template action plugin.
+
+These are kept out of tests/unit so the unit tests do not spend time on the
+timing loops. They require pytest-benchmark and are skipped when it is not
+installed. Run them with:
+
+    pytest tests/benchmarks/test_win_template_benchmark.py --benchmark-only
+
+The task vars of each host are simulated with WIN_TEMPLATE_BENCHMARK_VARS host
+vars, which defaults to 50000. test_template_vars compares the vars and search
+path win_template builds for each host against the copy of task_vars it
+replaced, the peak memory allocated for one host is added to the extra_info
+of the report as peak_bytes. test_render times the whole render of a template
+for one host with the same task vars.
+"""
+
+import os
+import tracemalloc
+from unittest.mock import MagicMock
+
+import pytest
+
+from ansible.parsing.dataloader import DataLoader
+from ansible.playbook.task import Task
+from ansible.template import Templar
+from ansible_collections.ansible.windows.plugins.action import win_template
+
+pytest.importorskip("pytest_benchmark")
+
+HOST_VARS = int(os.environ.get("WIN_TEMPLATE_BENCHMARK_VARS", 50000))
+
+
+@pytest.fixture(scope="module")
+def task_vars():
+    task_vars = {"host_var%d" % idx: {"name": "value%d" % idx, "items": [idx, idx + 1]} for idx in range(HOST_VARS)}
+    task_vars["ansible_search_path"] = ["/roles/app", "/playbooks", "/roles/app"]
+    return task_vars
+
+
+def _copy_template_vars(task_vars, basedir, source, dest):
+    """The template vars and search path built by win_template before they
+    were layered over task_vars, kept as the baseline for test_template_vars.
+    The search path is a copy so the fixture is not changed by each round."""
+    searchpath = list(task_vars.get('ansible_search_path', []))
+    searchpath.extend([basedir, os.path.dirname(source)])
+    newsearchpath = []
+    for p in searchpath:
+        newsearchpath.append(os.path.join(p, 'templates'))
+        newsearchpath.append(p)
+
+    temp_vars = task_vars.copy()
+    temp_vars.update(
+        win_template.generate_ansible_template_vars(
+            source,
+            fullpath=source,
+            dest_path=dest,
+            include_ansible_managed='ansible_managed' not in temp_vars
+        )
+    )
+    return newsearchpath, temp_vars
+
+
+def _overlay_template_vars(task_vars, basedir, source, dest):
+    searchpath = win_template._get_template_searchpath(task_vars, basedir, source)
+    temp_vars = win_template.collections.ChainMap(
+        win_template.generate_ansible_template_vars(
+            source,
+            fullpath=source,
+            dest_path=dest,
+            include_ansible_managed='ansible_managed' not in task_vars
+        ),
+        task_vars,
+    )
+    return searchpath, temp_vars
+
+
+@pytest.mark.parametrize("builder", ["copy", "overlay"])
+def test_template_vars(benchmark, tmp_path, task_vars, builder):
+    benchmark.group = "win_template vars"
+    source = tmp_path / "config.j2"
+    source.write_text("{{ host_var1.name }}")
+    build = _copy_template_vars if builder == "copy" else _overlay_template_vars
+    args = (task_vars, str(tmp_path), str(source), "C:\\config.ini")
+
+    tracemalloc.start()
+    try:
+        build(*args)
+        benchmark.extra_info["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    searchpath, temp_vars = benchmark(build, *args)
+    benchmark.extra_info["search_paths"] = len(searchpath)
+    assert temp_vars["host_var1"]["name"] == "value1"
+    assert temp_vars["template_path"] == str(source)
+
+
+def test_render(benchmark, tmp_path, task_vars):
+    benchmark.group = "win_template render"
+    source = tmp_path / "config.j2"
+    source.write_text("{% for idx in range(50) %}{{ host_var1.name }} {{ idx }}\n{% endfor %}")
+
+    loader = DataLoader()
+    loader.set_basedir(str(tmp_path))
+    plugin = win_template.ActionModule(MagicMock(Task), MagicMock(), MagicMock(), loader=loader,
+                                       templar=Templar(loader=loader), shared_loader_obj=None)
+
+    overrides = dict(trim_blocks=True, lstrip_blocks=False)
+    actual = benchmark(plugin._render_template, str(source), str(source), "C:\\config.ini", task_vars, overrides, "\r\n")
+    assert actual.startswith("value1 0\r\n")
@@ -0,0 +1,106 @@
+#!/usr/bin/env pwsh
+
+# Copyright: Contributors to the Ansible project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+<#
+.SYNOPSIS
+Benchmarks the checksum algorithms of win_copy on the remote host.
+
+.DESCRIPTION
+Generates files of random data and times how long the Get-WinCopyChecksum
+function of win_copy.ps1 takes to hash them with each checksum_algorithm.
+This is the remote side of the test_hash_algorithm benchmark in
+tests/benchmarks/test_win_copy_benchmark.py.
+
+The functions are loaded from win_copy.ps1 without running the module so this
+runs under pwsh on Linux as well as on Windows. Add-CSharpType and
+Get-FileChecksum are imported from the ansible-core install found by python,
+or set -ModuleUtilsPath to the directory with Ansible.ModuleUtils.AddType.psm1
+and Ansible.ModuleUtils.Legacy.psm1.
+
+    pwsh tests/benchmarks/win_copy_checksum_benchmark.ps1 -FileSize 256MB
+
+.PARAMETER FileCount
+The number of files to hash.
+
+.PARAMETER FileSize
+The size in bytes of each file.
+
+.PARAMETER Algorithm
+The checksum algorithms to benchmark.
+
+.PARAMETER Iterations
+The number of times each algorithm is run, the fastest run is reported.
+
+.PARAMETER ModuleUtilsPath
+The directory with the ansible-core PowerShell module utils.
+#>
+[CmdletBinding()]
+param (
+    [int]$FileCount = 3,
+    [int]$FileSize = 64MB,
+    [string[]]$Algorithm = @("sha1", "sha256", "crc32"),
+    [int]$Iterations = 3,
+    [string]$ModuleUtilsPath
+)
+
+$ErrorActionPreference = 'Stop'
+
+if (-not $ModuleUtilsPath) {
+    $ModuleUtilsPath = python -c "import os, ansible; print(os.path.join(os.path.dirname(ansible.__file__), 'module_utils', 'powershell'))"
+}
+Import-Module -Name ([System.IO.Path]::Combine($ModuleUtilsPath, "Ansible.ModuleUtils.AddType.psm1"))
+Import-Module -Name ([System.IO.Path]::Combine($ModuleUtilsPath, "Ansible.ModuleUtils.Legacy.psm1"))
+
+# define the checksum functions of the module in this scope, the
+# $checksum_algorithm variable they use is set for each run
+$module_path = [System.IO.Path]::Combine($PSScriptRoot, "..", "..", "plugins", "modules", "win_copy.ps1")
+$module_ast = [System.Management.Automation.Language.Parser]::ParseFile($module_path, [ref]$null, [ref]$null)
+$functions = $module_ast.FindAll({
+        $args[0] -is [System.Management.Automation.Language.FunctionDefinitionAst] -and
+        $args[0].Name -in @("Import-WinCopyHelper", "Get-WinCopyChecksum")
+    }, $false)
+foreach ($function in $functions) {
+    . ([ScriptBlock]::Create($function.Extent.Text))
+}
+$_remote_tmp = [System.IO.Path]::GetTempPath()
+
+$root = [System.IO.Path]::Combine([System.IO.Path]::GetTempPath(), "win_copy-checksum-$([System.Guid]::NewGuid())")
+$null = [System.IO.Directory]::CreateDirectory($root)
+try {
+    $random = New-Object -TypeName System.Random -ArgumentList 0
+    $data = New-Object -TypeName byte[] -ArgumentList $FileSize
+    $paths = for ($i = 0; $i -lt $FileCount; $i++) {
+        $path = [System.IO.Path]::Combine($root, "file$i.bin")
+        $random.NextBytes($data)
+        [System.IO.File]::WriteAllBytes($path, $data)
+        $path
+    }
+    $total_bytes = [Int64]$FileCount * $FileSize
+
+    # compile the helper before anything is timed
+    Import-WinCopyHelper
+
+    foreach ($checksum_algorithm in $Algorithm) {
+        $times = for ($i = 0; $i -lt $Iterations; $i++) {
+            $stopwatch = [System.Diagnostics.Stopwatch]::StartNew()
+            foreach ($path in $paths) {
+                $null = Get-WinCopyChecksum -path $path
+            }
+            $stopwatch.Elapsed.TotalSeconds
+        }
+
+        $seconds = ($times | Measure-Object -Minimum).Minimum
+        [PSCustomObject]@{
+            Algorithm = $checksum_algorithm
+            Files = $FileCount
+            Bytes = $total_bytes
+            Seconds = [Math]::Round($seconds, 3)
+            BytesPerSecond = [Int64]($total_bytes / $seconds)
+        }
+    }
+}
+finally {
+    [System.IO.Directory]::Delete($root, $true)
+}
@@ -0,0 +1,185 @@
+#!/usr/bin/env pwsh
+
+# Copyright: Contributors to the Ansible project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+<#
+.SYNOPSIS
+Benchmarks the extraction of a win_copy explode archive.
+
+.DESCRIPTION
+Generates an archive in the same format the win_copy action plugin sends for
+a directory copy, entry names are the base64 encoded relative paths, and times
+how long it takes to extract it with the Expand-Zip function of win_copy.ps1
+at each degree of parallelism as well as with the per entry extraction it
+replaced.
+
+The functions are loaded from win_copy.ps1 without running the module so this
+runs under pwsh on Linux as well as on Windows. Add-CSharpType is imported
+from the ansible-core install found by python, or set -AddTypePath to the path
+of Ansible.ModuleUtils.AddType.psm1.
+
+    pwsh tests/benchmarks/win_copy_extract_benchmark.ps1 -FileCount 20000
+
+.PARAMETER FileCount
+The number of small files in the archive, spread over 100 directories.
+
+.PARAMETER FileSize
+The size in bytes of each small file.
+
+.PARAMETER LargeFileCount
+The number of large files in the archive.
+
+.PARAMETER LargeFileSize
+The size in bytes of each large file.
+
+.PARAMETER Parallel
+The maximum number of files written at the same time to benchmark, 0 uses
+the default of the module.
+
+.PARAMETER Iterations
+The number of times each extraction is run, the fastest run is reported.
+
+.PARAMETER AddTypePath
+The path to Ansible.ModuleUtils.AddType.psm1.
+#>
+[CmdletBinding()]
+param (
+    [int]$FileCount = 5000,
+    [int]$FileSize = 4096,
+    [int]$LargeFileCount = 4,
+    [int]$LargeFileSize = 32MB,
+    [int[]]$Parallel = @(1, 2, 4, 8, 0),
+    [int]$Iterations = 3,
+    [string]$AddTypePath
+)
+
+$ErrorActionPreference = 'Stop'
+
+Function Expand-ZipPerEntry($src, $dest) {
+    # the per entry extraction used by win_copy.ps1 before the compiled
+    # extractor, kept as the baseline
+    $archive = [System.IO.Compression.ZipFile]::Open($src, [System.IO.Compression.ZipArchiveMode]::Read, [System.Text.Encoding]::UTF8)
+    foreach ($entry in $archive.Entries) {
+        $archive_name = $entry.FullName
+        $is_dir = $archive_name.Length % 4 -eq 1
+        $base64_name = if ($is_dir) { $archive_name.Substring(0, $archive_name.Length - 1) } else { $archive_name }
+
+        $decoded_archive_name = [System.Text.Encoding]::UTF8.GetString([System.Convert]::FromBase64String($base64_name))
+        if ($is_dir) {
+            $decoded_archive_name = "$decoded_archive_name/"
+        }
+        $entry_target_path = [System.IO.Path]::Combine($dest, $decoded_archive_name)
+        $entry_dir = [System.IO.Path]::GetDirectoryName($entry_target_path)
+
+        if (-not (Test-Path -LiteralPath $entry_dir)) {
+            New-Item -Path $entry_dir -ItemType Directory | Out-Null
+        }
+
+        if (-not $is_dir) {
+            [System.IO.Compression.ZipFileExtensions]::ExtractToFile($entry, $entry_target_path, $true)
+        }
+    }
+    $archive.Dispose()
+}
+
+Function New-BenchmarkArchive($path) {
+    $random = New-Object -TypeName System.Random -ArgumentList 0
+    $large = New-Object -TypeName byte[] -ArgumentList $LargeFileSize
+    $random.NextBytes($large)
+
+    $archive = [System.IO.Compression.ZipFile]::Open($path, [System.IO.Compression.ZipArchiveMode]::Create)
+    try {
+        for ($i = 0; $i -lt 100; $i++) {
+            $null = $archive.CreateEntry("$([System.Convert]::ToBase64String([System.Text.Encoding]::UTF8.GetBytes("dir$i")))/")
+        }
+
+        for ($i = 0; $i -lt ($FileCount + $LargeFileCount); $i++) {
+            if ($i -lt $FileCount) {
+                $name = "dir$($i % 100)/file$i.txt"
+                # text like content so the small files are deflated
+                $data = [System.Text.Encoding]::UTF8.GetBytes(("file $i line " * ($FileSize / 10 + 1)).Substring(0, $FileSize))
+                $level = [System.IO.Compression.CompressionLevel]::Optimal
+            }
+            else {
+                $name = "large$i.bin"
+                $data = $large
+                $level = [System.IO.Compression.CompressionLevel]::NoCompression
+            }
+
+            $entry = $archive.CreateEntry([System.Convert]::ToBase64String([System.Text.Encoding]::UTF8.GetBytes($name)), $level)
+            $stream = $entry.Open()
+            try {
+                $stream.Write($data, 0, $data.Length)
+            }
+            finally {
+                $stream.Dispose()
+            }
+        }
+    }
+    finally {
+        $archive.Dispose()
+    }
+}
+
+if (-not $AddTypePath) {
+    $AddTypePath = python -c "import os, ansible; print(os.path.join(os.path.dirname(ansible.__file__), 'module_utils', 'powershell', 'Ansible.ModuleUtils.AddType.psm1'))"
+}
+Import-Module -Name $AddTypePath
+Add-Type -AssemblyName System.IO.Compression
+Add-Type -AssemblyName System.IO.Compression.FileSystem
+
+# define the extraction functions of the module in this scope along with the
+# module variables they use
+$module_path = [System.IO.Path]::Combine($PSScriptRoot, "..", "..", "plugins", "modules", "win_copy.ps1")
+$module_ast = [System.Management.Automation.Language.Parser]::ParseFile($module_path, [ref]$null, [ref]$null)
+$functions = $module_ast.FindAll({
+        $args[0] -is [System.Management.Automation.Language.FunctionDefinitionAst] -and
+        $args[0].Name -in @("Import-WinCopyExtractor", "Expand-Zip")
+    }, $false)
+foreach ($function in $functions) {
+    . ([ScriptBlock]::Create($function.Extent.Text))
+}
+$check_mode = $false
+$_remote_tmp = [System.IO.Path]::GetTempPath()
+
+$root = [System.IO.Path]::Combine([System.IO.Path]::GetTempPath(), "win_copy-extract-$([System.Guid]::NewGuid())")
+$null = [System.IO.Directory]::CreateDirectory($root)
+try {
+    $src = [System.IO.Path]::Combine($root, "source.zip")
+    New-BenchmarkArchive -path $src
+    $archive_size = (Get-Item -LiteralPath $src).Length
+
+    # compile the extractor before anything is timed
+    Import-WinCopyExtractor
+
+    $runs = @(@{ Name = "per_entry"; Parallel = $null }) + @($Parallel | ForEach-Object { @{ Name = "compiled"; Parallel = $_ } })
+    foreach ($run in $runs) {
+        $times = for ($i = 0; $i -lt $Iterations; $i++) {
+            $dest = [System.IO.Path]::Combine($root, "dest")
+            if ([System.IO.Directory]::Exists($dest)) {
+                [System.IO.Directory]::Delete($dest, $true)
+            }
+
+            $stopwatch = [System.Diagnostics.Stopwatch]::StartNew()
+            if ($null -eq $run.Parallel) {
+                Expand-ZipPerEntry -src $src -dest $dest
+            }
+            else {
+                Expand-Zip -src $src -dest $dest -manifest_files @{} -cache $null -max_parallel $run.Parallel
+            }
+            $stopwatch.Elapsed.TotalSeconds
+        }
+
+        [PSCustomObject]@{
+            Extractor = $run.Name
+            Parallel = if ($run.Parallel -eq 0) { "default" } else { $run.Parallel }
+            Files = $FileCount + $LargeFileCount
+            ArchiveBytes = $archive_size
+            Seconds = [Math]::Round(($times | Measure-Object -Minimum).Minimum, 3)
+        }
+    }
+}
+finally {
+    [System.IO.Directory]::Delete($root, $true)
+}
@@ -2,7 +2,45 @@
 # Copyright: Contributors to the Ansible project
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import base64
+import gzip
+import hashlib
+import io
+import ntpath
+import os
+import sqlite3
+import zipfile
+from unittest.mock import MagicMock
+
+import pytest
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.playbook.task import Task
 from ansible_collections.ansible.windows.plugins.action import win_copy
+from ansible_collections.ansible.windows.plugins.plugin_utils import _checksum
+
+
+def win_copy_init(task_args, check_mode=False):
+    task = MagicMock(Task)
+    task.args = task_args
+    task.check_mode = check_mode
+    task.async_val = 0
+
+    connection = MagicMock()
+    connection._shell.tmpdir = None
+    connection._shell.join_path = ntpath.join
+    connection._shell.path_has_trailing_slash = lambda path: path.endswith(("/", "\\"))
+
+    loader = MagicMock()
+    loader.get_real_file.side_effect = lambda path, decrypt=True: path
+
+    plugin = win_copy.ActionModule(task, connection, MagicMock(), loader=loader, templar=None,
+                                   shared_loader_obj=None)
+    plugin._find_needle = lambda dirname, needle: needle
+    plugin._make_tmp_path = MagicMock(return_value="C:\\tmp")
+    plugin._remove_tmp_path = MagicMock()
+
+    return plugin
 
 
 def test_walk_dirs_with_symlink(mocker):
@@ -17,8 +55,1158 @@ def test_walk_dirs_with_symlink(mocker):
         "symlinks": [
             {
                 "dest": "file.txt",
-                "src": "/path/to/real/file.txt",
+                "src": "real\\file.txt",
+                "directory": False,
             }
         ],
     }
     assert ret == expected
+
+
+def test_walk_dirs_symlinks_without_follow(tmp_path):
+    src = tmp_path / "src"
+    (src / "assets").mkdir(parents=True)
+    (src / "assets" / "logo.png").write_bytes(b"png")
+    (src / "plugin").mkdir()
+    os.symlink(os.path.join("..", "assets"), str(src / "plugin" / "assets"))
+    os.symlink(str(src / "assets" / "logo.png"), str(src / "plugin" / "logo.png"))
+    os.symlink(str(tmp_path), str(src / "outside"))
+
+    loader = MagicMock()
+    loader.get_real_file.side_effect = lambda path, decrypt=True: path
+
+    ret = win_copy._walk_dirs(str(src) + os.path.sep, loader, local_follow=False)
+    assert [f["dest"] for f in ret["files"]] == [os.path.join("assets", "logo.png")]
+    assert sorted(ret["symlinks"], key=lambda s: s["dest"]) == [
+        {"src": "..\\assets", "dest": os.path.join("plugin", "assets"), "directory": True},
+        {"src": "..\\assets\\logo.png", "dest": os.path.join("plugin", "logo.png"), "directory": False},
+    ]
+
+
+@pytest.mark.parametrize("trailing_slash", [True, False])
+def test_walk_dirs_symlinks_outside_dest(tmp_path, monkeypatch, trailing_slash):
+    src = tmp_path / "src"
+    (src / "plugin").mkdir(parents=True)
+    os.symlink(os.path.join("..", "..", ".."), str(src / "plugin" / "root"))
+    os.symlink(os.path.join("..", "plugin"), str(src / "plugin" / "self"))
+    os.symlink(os.path.join("..", "other"), str(src / "other"))
+    mock_warning = MagicMock()
+    monkeypatch.setattr(win_copy.display, "warning", mock_warning)
+
+    ret = win_copy._walk_dirs(str(src) + (os.path.sep if trailing_slash else ""), MagicMock(), local_follow=False)
+    prefix = "" if trailing_slash else "src" + os.path.sep
+    expected = [{"src": "..\\plugin", "dest": prefix + os.path.join("plugin", "self"), "directory": True}]
+    if not trailing_slash:
+        # the link resolves to dest itself when src is copied into dest
+        expected.insert(0, {"src": "..\\other", "dest": prefix + "other", "directory": False})
+    assert sorted(ret["symlinks"], key=lambda s: s["dest"]) == expected
+
+    warnings = [c[1][0] for c in mock_warning.mock_calls]
+    assert len(warnings) == (2 if trailing_slash else 1)
+    assert all("is outside of the destination directory" in w for w in warnings)
+
+
+def test_copy_folder_creates_symlinks(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_bytes(b"a")
+    os.symlink("a.txt", str(src / "b.txt"))
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+
+    link = {"src": "a.txt", "dest": "b.txt", "directory": False}
+
+    def execute_module(module_name, module_args, task_vars):
+        if module_args["_copy_mode"] == "query":
+            assert module_args["symlinks"] == [link]
+            return {"changed_entries": [], "symlinks": module_args["symlinks"]}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+    copy_zip_file = MagicMock(return_value={})
+    monkeypatch.setattr(plugin, "_copy_zip_file", copy_zip_file)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert copy_zip_file.call_args[0][1:3] == ([], [])
+    assert copy_zip_file.call_args[1]["symlinks"] == [link]
+
+
+def test_walk_dirs_checksums_files(tmp_path):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.txt").write_bytes(b"a")
+    (src / "sub" / "b.txt").write_bytes(b"b")
+
+    loader = MagicMock()
+    loader.get_real_file.side_effect = lambda path, decrypt=True: path
+
+    ret = win_copy._walk_dirs(str(src) + os.path.sep, loader, checksum_check=True)
+    actual = {f["dest"]: f["checksum"] for f in ret["files"]}
+    assert actual == {
+        "a.txt": "86f7e437faa5a7fce15d1ddcb9eaeaea377667b8",
+        os.path.join("sub", "b.txt"): "e9d71f5ee7c92d6dc9e92ffdad17b8bd49418f98",
+    }
+
+
+def test_iter_walk_dirs_is_lazy(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "b").mkdir(parents=True)
+    (src / "a.txt").write_bytes(b"a")
+    (src / "b" / "c.txt").write_bytes(b"c")
+    os.symlink(str(src / "b"), str(src / "loop"))
+    os.symlink(str(src), str(src / "b" / "parent"))
+
+    entries = win_copy._iter_walk_dirs(str(src) + os.path.sep, local_follow=True)
+    first = next(entries)
+    assert first.type == "f"
+    assert first.dest == "a.txt"
+    assert first.size == 1
+    assert not hasattr(first, "__dict__")
+
+    rest = [(e.type, e.dest) for e in entries]
+    assert rest == [
+        ("d", "b"),
+        ("d", "loop"),
+        ("f", os.path.join("loop", "c.txt")),
+        ("l", os.path.join("loop", "parent")),
+        ("f", os.path.join("b", "c.txt")),
+        ("l", os.path.join("b", "parent")),
+    ]
+
+
+@pytest.mark.parametrize("trailing_slash", [True, False])
+def test_iter_walk_dirs_path_filter(tmp_path, mocker, trailing_slash):
+    src = tmp_path / "src"
+    for path in ["app.dll", "app.pdb", "obj/app.obj", ".git/HEAD", "bin/Debug/app.dll", "bin/Release/app.dll",
+                 "docs/readme.md", "docs/obj"]:
+        (src / path).parent.mkdir(parents=True, exist_ok=True)
+        (src / path).write_bytes(b"data")
+
+    scan_dir = mocker.spy(win_copy, "_scan_dir")
+    path_filter = win_copy._get_path_filter(exclude=["*.pdb", "obj/", ".git/", "bin/Debug"], include=["*.dll", "obj"])
+    topdir = str(src) + (os.path.sep if trailing_slash else "")
+    actual = [(e.type, e.dest) for e in win_copy._iter_walk_dirs(topdir, path_filter=path_filter)]
+
+    prefix = "" if trailing_slash else "src/"
+    assert actual == [
+        ("f", prefix + "app.dll"),
+        ("d", prefix + "bin"),
+        ("d", prefix + "docs"),
+        ("d", prefix + "bin/Release"),
+        ("f", prefix + "bin/Release/app.dll"),
+        ("f", prefix + "docs/obj"),
+    ]
+    scanned = sorted(os.path.relpath(c.args[0], str(src)) for c in scan_dir.call_args_list)
+    assert scanned == [".", "bin", os.path.join("bin", "Release"), "docs"]
+
+
+def test_read_entries_batches(tmp_path, mocker):
+    entries = []
+    for idx in range(5):
+        path = tmp_path / ("%d.txt" % idx)
+        path.write_bytes(b"%d" % idx)
+        entries.append(win_copy._WalkEntry("f", str(path), path.name))
+    entries.insert(2, win_copy._WalkEntry("d", str(tmp_path), "dir"))
+
+    loader = MagicMock()
+    checksum_files = mocker.spy(win_copy, "checksum_files")
+    actual = list(win_copy._read_entries(iter(entries), loader, checksum_check=True, batch_size=2))
+
+    assert actual == entries
+    assert [len(c.args[0]) for c in checksum_files.call_args_list] == [2, 2, 1]
+    assert actual[0]["checksum"] == hashlib.sha1(b"0").hexdigest()
+    assert actual[2].get("checksum") is None
+    assert loader.get_real_file.call_count == 0
+
+
+@pytest.mark.parametrize("checksum_check", [True, False])
+def test_read_entries_only_decrypts_vault_files(tmp_path, checksum_check):
+    plain = tmp_path / "plain.txt"
+    plain.write_bytes(b"plain")
+    vault = tmp_path / "vault.txt"
+    vault.write_bytes(b"$ANSIBLE_VAULT;1.1;AES256\n3031")
+    decrypted = tmp_path / "decrypted"
+    decrypted.write_bytes(b"secret")
+
+    loader = MagicMock()
+    loader.get_real_file.return_value = str(decrypted)
+
+    entries = [win_copy._get_file_entry(str(p), p.name) for p in [plain, vault, vault]]
+    vault_mtime = entries[1].mtime
+    tempfiles = []
+    actual = list(win_copy._read_entries(iter(entries), loader, checksum_check=checksum_check, tempfiles=tempfiles))
+
+    loader.get_real_file.assert_called_once_with(str(vault), decrypt=True)
+    assert tempfiles == [str(decrypted)]
+    assert [e.src for e in actual] == [str(plain), str(decrypted), str(decrypted)]
+    assert actual[1].size == 6
+    assert actual[1].mtime == vault_mtime
+    if checksum_check:
+        assert [e.checksum for e in actual] == [hashlib.sha1(b"plain").hexdigest()] + [hashlib.sha1(b"secret").hexdigest()] * 2
+    else:
+        assert [e.checksum for e in actual] == [None, None, None]
+
+
+def test_read_entries_without_decrypt(tmp_path):
+    vault = tmp_path / "vault.txt"
+    vault.write_bytes(b"$ANSIBLE_VAULT;1.1;AES256\n3031")
+
+    loader = MagicMock()
+    actual = list(win_copy._read_entries(iter([win_copy._get_file_entry(str(vault), "vault.txt")]), loader,
+                                         decrypt=False, checksum_check=True))
+    assert actual[0].src == str(vault)
+    assert actual[0].checksum == hashlib.sha1(vault.read_bytes()).hexdigest()
+    assert loader.get_real_file.call_count == 0
+
+
+def test_read_entries_never_caches_vault_files(tmp_path):
+    vault = tmp_path / "vault.txt"
+    vault.write_bytes(b"$ANSIBLE_VAULT;1.1;AES256\n3031")
+    decrypted = tmp_path / "decrypted"
+    decrypted.write_bytes(b"secret")
+    cache_path = str(tmp_path / "checksums.db")
+
+    loader = MagicMock()
+    loader.get_real_file.return_value = str(decrypted)
+
+    def read(decrypt):
+        with _checksum.LocalChecksumCache(cache_path) as cache:
+            entries = [win_copy._get_file_entry(str(vault), "vault.txt")]
+            return list(win_copy._read_entries(iter(entries), loader, decrypt=decrypt, checksum_check=True,
+                                               checksum_cache=cache))[0]
+
+    actual = read(False)
+    assert actual.checksum == hashlib.sha1(vault.read_bytes()).hexdigest()
+    assert loader.get_real_file.call_count == 0
+
+    # the raw checksum stored by a run without decrypt must not be used
+    actual = read(True)
+    loader.get_real_file.assert_called_once_with(str(vault), decrypt=True)
+    assert actual.src == str(decrypted)
+    assert actual.checksum == hashlib.sha1(b"secret").hexdigest()
+
+    with _checksum.LocalChecksumCache(cache_path) as cache:
+        assert cache.get(str(vault), os.stat(str(vault))) is None
+        assert cache.get(str(decrypted), os.stat(str(decrypted))) is None
+
+
+def test_copy_vault_file_skips_checksum_cache(tmp_path, monkeypatch):
+    vault = tmp_path / "vault.txt"
+    vault.write_bytes(b"$ANSIBLE_VAULT;1.1;AES256\n3031")
+    decrypted = tmp_path / "decrypted"
+    decrypted.write_bytes(b"secret")
+    cache_path = tmp_path / "checksums.db"
+
+    plugin = win_copy_init({"src": str(vault), "dest": "C:\\dest", "local_checksum_cache": str(cache_path)})
+    plugin._loader.get_real_file.side_effect = lambda path, decrypt=True: str(decrypted)
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_execute_module", MagicMock(return_value={"files": [], "directories": [], "symlinks": []}))
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is False
+    assert actual["checksum"] == hashlib.sha1(b"secret").hexdigest()
+    assert not cache_path.exists()
+
+
+def test_copy_folder_cleans_up_vault_tempfiles(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "plain.txt").write_bytes(b"plain")
+    (src / "vault.txt").write_bytes(b"$ANSIBLE_VAULT;1.1;AES256\n3031")
+    decrypted = tmp_path / "decrypted"
+    decrypted.write_bytes(b"secret")
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    plugin._loader.get_real_file.side_effect = lambda path, decrypt=True: str(decrypted) if path.endswith("vault.txt") else path
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+    monkeypatch.setattr(plugin, "_execute_module", MagicMock(return_value={"changed_entries": [], "symlinks": []}))
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is False
+    plugin._loader.get_real_file.assert_called_once_with(str(src / "vault.txt"), decrypt=True)
+    plugin._loader.cleanup_tmp_file.assert_called_once_with(str(decrypted))
+
+
+def test_checksum_cache_reuses_unchanged_files(tmp_path, mocker):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"a")
+    cache_path = str(tmp_path / "cache" / "checksums.db")
+
+    with _checksum.LocalChecksumCache(cache_path) as cache:
+        assert _checksum.checksum_files([str(src)], cache=cache) == ["86f7e437faa5a7fce15d1ddcb9eaeaea377667b8"]
+
+    mock_checksum = mocker.patch.object(_checksum, "_checksum_file", return_value=("changed", True))
+    with _checksum.LocalChecksumCache(cache_path) as cache:
+        assert _checksum.checksum_files([str(src)], cache=cache) == ["86f7e437faa5a7fce15d1ddcb9eaeaea377667b8"]
+    assert mock_checksum.call_count == 0
+
+    src.write_bytes(b"ab")
+    with _checksum.LocalChecksumCache(cache_path) as cache:
+        assert _checksum.checksum_files([str(src)], cache=cache) == ["changed"]
+    assert mock_checksum.call_count == 1
+
+
+@pytest.mark.parametrize("algorithm, expected", [
+    ("sha1", "86f7e437faa5a7fce15d1ddcb9eaeaea377667b8"),
+    ("sha256", "ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb"),
+    ("crc32", "e8b7be43"),
+])
+def test_checksum_files_algorithm(tmp_path, algorithm, expected):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"a")
+    cache_path = str(tmp_path / "checksums.db")
+
+    with _checksum.LocalChecksumCache(cache_path, algorithm=algorithm) as cache:
+        assert _checksum.checksum_files([str(src)], cache=cache, algorithm=algorithm) == [expected]
+
+    # the checksums of each algorithm are cached separately
+    with _checksum.LocalChecksumCache(cache_path) as cache:
+        cached = cache.get(str(src), os.stat(str(src)))
+    assert cached == (expected if algorithm == "sha1" else None)
+
+
+def test_checksum_cache_evicts_least_recently_used(tmp_path):
+    files = []
+    for idx in range(3):
+        path = tmp_path / ("file%d.txt" % idx)
+        path.write_bytes(b"%d" % idx)
+        files.append(str(path))
+    cache_path = str(tmp_path / "checksums.db")
+
+    with _checksum.LocalChecksumCache(cache_path, max_entries=2) as cache:
+        _checksum.checksum_files(files, cache=cache)
+
+    conn = sqlite3.connect(cache_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+    finally:
+        conn.close()
+    assert count == 2
+
+
+def test_checksum_cache_shared_by_forks(tmp_path, mocker):
+    files = []
+    for idx in range(2):
+        path = tmp_path / ("file%d.txt" % idx)
+        path.write_bytes(b"%d" % idx)
+        files.append(str(path))
+    cache_path = str(tmp_path / "checksums.db")
+    mock_display = mocker.patch.object(_checksum, "display")
+
+    with _checksum.LocalChecksumCache(cache_path) as cache1, _checksum.LocalChecksumCache(cache_path) as cache2:
+        _checksum.checksum_files(files[:1], cache=cache1)
+
+        # the first cache is still open but does not hold the write lock
+        conn = sqlite3.connect(cache_path, timeout=0)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.rollback()
+        finally:
+            conn.close()
+
+        _checksum.checksum_files(files[1:], cache=cache2)
+        assert cache2.get(files[0], os.stat(files[0])) == hashlib.sha1(b"0").hexdigest()
+        assert cache1.get(files[1], os.stat(files[1])) == hashlib.sha1(b"1").hexdigest()
+
+    assert mock_display.warning.call_count == 0
+
+
+def test_transfer_zip_stream(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    files = []
+    for idx in range(4):
+        path = src / ("file%d.bin" % idx)
+        path.write_bytes(os.urandom(1024))
+        files.append({"src": str(path), "dest": "file%d.bin" % idx})
+
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    plugin = win_copy_init({})
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+
+    actual = plugin._transfer_zip_stream(files, [], "C:\\tmp\\source.zip", 1000)
+    assert actual == ["C:\\tmp\\source.zip.%d" % idx for idx in range(len(actual))]
+    assert len(actual) > 4
+    assert all(len(transferred[part]) == 1000 for part in actual[:-1])
+
+    # Only the source files remain, each chunk is removed once transferred
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src"]
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(transferred[part] for part in actual))) as zip_file:
+        for file_entry in files:
+            name = base64.b64encode(file_entry["dest"].encode()).decode()
+            with open(file_entry["src"], "rb") as fd:
+                assert zip_file.read(name) == fd.read()
+
+
+def test_copy_single_file_resumes_staged_transfer(tmp_path, monkeypatch):
+    src = tmp_path / "src.iso"
+    data = os.urandom(10000)
+    src.write_bytes(data)
+
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest\\src.iso"})
+
+    staged = bytearray(data[:3000])
+    transferred = {}
+    resets = []
+    calls = []
+
+    def transfer_file(local, remote):
+        # drop the connection while the third chunk is being sent
+        if len(transferred) == 1 and not resets:
+            raise AnsibleConnectionFailure("connection reset")
+        transferred[len(transferred)] = open(local, "rb").read()
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "single":
+            return {"changed": True}
+
+        assert module_args["_checksum"] == hashlib.sha1(data).hexdigest()
+        if "src" in module_args:
+            chunk = transferred[len(transferred) - 1]
+            assert module_args["_offset"] == len(staged)
+            assert module_args["_chunk_checksum"] == hashlib.sha1(chunk).hexdigest()
+            staged.extend(chunk)
+
+        return {"changed": False, "offset": len(staged), "staging_path": "C:\\dest\\src.iso.win_copy_partial"}
+
+    monkeypatch.setattr(plugin, "_transfer_file", transfer_file)
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+    plugin._connection.reset.side_effect = lambda: resets.append(True)
+
+    actual = plugin._copy_single_file(str(src), "C:\\dest\\src.iso", "src.iso", "src.iso", {}, "C:\\tmp", False,
+                                      chunk_size=4000)
+    assert actual == {"changed": True}
+    assert bytes(staged) == data
+    assert len(resets) == 1
+
+    # The first stage call resumes at the existing offset, after the reset the
+    # offset is queried again before the chunk is resent
+    assert [("src" in c, c.get("_offset")) for c in calls[:-1]] == [
+        (False, None), (True, 3000), (False, None), (True, 7000),
+    ]
+    assert calls[-1]["_src_staged"] is True
+    assert calls[-1]["src"] == "C:\\dest\\src.iso.win_copy_partial"
+
+    # Each local chunk is removed once transferred
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src.iso"]
+
+
+def test_copy_single_file_smaller_than_chunk_size(tmp_path, monkeypatch):
+    src = tmp_path / "src.txt"
+    src.write_bytes(b"data")
+
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest\\src.txt"})
+    transfer_file = MagicMock()
+    execute_module = MagicMock(return_value={"changed": True})
+    monkeypatch.setattr(plugin, "_transfer_file", transfer_file)
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    plugin._copy_single_file(str(src), "C:\\dest\\src.txt", "src.txt", "src.txt", {}, "C:\\tmp", False, chunk_size=4)
+    transfer_file.assert_called_once_with(str(src), "C:\\tmp\\source")
+    module_args = execute_module.call_args[1]["module_args"]
+    assert module_args["_copy_mode"] == "single"
+    assert module_args["_src_staged"] is False
+
+
+def test_transfer_file_streams(tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    data = os.urandom(10000)
+    src.write_bytes(data)
+
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(win_copy, "_MIN_STREAM_PART_SIZE", 3000)
+    plugin = win_copy_init({})
+
+    transferred = {}
+
+    def put_file(name):
+        def _put_file(local, remote):
+            transferred[remote] = (name, open(local, "rb").read())
+        return _put_file
+
+    connections = []
+
+    def create_transfer_connection():
+        connection = MagicMock()
+        connection.put_file.side_effect = put_file("connection%d" % len(connections))
+        connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(plugin, "_transfer_file", put_file("task"))
+    monkeypatch.setattr(plugin, "_create_transfer_connection", create_transfer_connection)
+
+    # Limited to 4 streams as each part must be at least 3000 bytes
+    actual = plugin._transfer_file_streams(str(src), "C:\\tmp\\source", 8)
+    assert actual == ["C:\\tmp\\source.%d" % idx for idx in range(4)]
+    assert [transferred[part][0] for part in actual] == ["task", "connection0", "connection1", "connection2"]
+    assert b"".join(transferred[part][1] for part in actual) == data
+    assert all(c.close.call_count == 1 for c in connections)
+
+    # Each local part is removed once transferred
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src.bin"]
+
+
+def test_transfer_file_streams_failure(tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    src.write_bytes(os.urandom(10000))
+
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(win_copy, "_MIN_STREAM_PART_SIZE", 3000)
+    plugin = win_copy_init({})
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+
+    connections = []
+
+    def create_transfer_connection():
+        connection = MagicMock()
+        if len(connections) == 1:
+            connection.put_file.side_effect = AnsibleConnectionFailure("stream failed")
+        if len(connections) == 2:
+            connection.close.side_effect = Exception("close failed")
+        connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(plugin, "_create_transfer_connection", create_transfer_connection)
+
+    with pytest.raises(AnsibleConnectionFailure, match="stream failed"):
+        plugin._transfer_file_streams(str(src), "C:\\tmp\\source", 4)
+
+    assert len(connections) == 3
+    assert all(c.close.call_count == 1 for c in connections)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src.bin"]
+
+
+def test_create_transfer_connection():
+    plugin = win_copy_init({})
+    plugin._task._uuid = "uuid"
+    plugin._connection._load_name = "winrm"
+    plugin._connection.has_option.return_value = True
+    plugin._connection.get_option.return_value = {"ansible_winrm_transport": "ntlm"}
+    plugin._connection.get_options.return_value = {"remote_addr": "host"}
+    plugin._shared_loader_obj = MagicMock()
+    new_connection = plugin._shared_loader_obj.connection_loader.get.return_value
+
+    assert plugin._create_transfer_connection() is new_connection
+    assert plugin._shared_loader_obj.connection_loader.get.call_args[0] == ("winrm", plugin._play_context)
+    new_connection.set_options.assert_called_once_with(var_options={"_extras": {"ansible_winrm_transport": "ntlm"}},
+                                                       direct={"remote_addr": "host"})
+    assert new_connection.close.call_count == 0
+
+    new_connection.set_options.side_effect = KeyError("option")
+    with pytest.raises(KeyError):
+        plugin._create_transfer_connection()
+    assert new_connection.close.call_count == 1
+
+
+def test_transfer_file_streams_small_file(tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"data")
+
+    plugin = win_copy_init({})
+    transfer_file = MagicMock()
+    monkeypatch.setattr(plugin, "_transfer_file", transfer_file)
+    monkeypatch.setattr(plugin, "_create_transfer_connection", MagicMock(side_effect=AssertionError))
+
+    assert plugin._transfer_file_streams(str(src), "C:\\tmp\\source", 4) is None
+    transfer_file.assert_called_once_with(str(src), "C:\\tmp\\source")
+
+
+def test_invalid_transfer_streams(tmp_path):
+    src = tmp_path / "src.txt"
+    src.write_bytes(b"data")
+
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest", "transfer_streams": 0})
+    actual = plugin.run(task_vars={})
+    assert actual["failed"] is True
+    assert actual["msg"] == "transfer_streams must be greater than 0"
+
+
+def read_manifest(b_data):
+    lines = gzip.decompress(b_data).decode().splitlines()
+    assert lines[0] == "win_copy-manifest\t1"
+    return [line.split("\t", 4) for line in lines[1:]]
+
+
+def test_copy_folder_only_sends_changed_entries(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    for name in ["a.txt", "b.txt", os.path.join("sub", "c.txt")]:
+        (src / name).write_bytes(name.encode())
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+
+    def execute_module(module_name, module_args, task_vars):
+        if module_args["_copy_mode"] == "query":
+            entries = read_manifest(transferred[module_args["_manifest"]])
+            changed = [idx for idx, e in enumerate(entries) if e[4] != "a.txt"]
+            return {"changed_entries": changed, "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+    copy_zip_file = MagicMock(return_value={})
+    monkeypatch.setattr(plugin, "_copy_zip_file", copy_zip_file)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert copy_zip_file.call_count == 1
+    sent_files = copy_zip_file.call_args[0][1]
+    assert [f["dest"] for f in sent_files] == ["b.txt", "sub/c.txt"]
+    assert [d["dest"] for d in copy_zip_file.call_args[0][2]] == ["sub"]
+    assert copy_zip_file.call_args[1]["manifest"] == "C:\\tmp\\manifest.gz"
+
+
+def test_copy_folder_single_file_sends_checksum(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["a.txt", "b.txt"]:
+        (src / name).write_bytes(name.encode())
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest", "remote_checksum_cache": True})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            entries = read_manifest(transferred[module_args["_manifest"]])
+            return {"changed_entries": [idx for idx, e in enumerate(entries) if e[4] == "b.txt"], "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert [c["_copy_mode"] for c in calls] == ["query", "single"]
+    assert calls[0]["remote_checksum_cache"] is True
+
+    single_args = calls[1]
+    assert single_args["remote_checksum_cache"] is True
+    assert single_args["_original_basename"] == "b.txt"
+    assert single_args["_checksum"] == hashlib.sha1(b"b.txt").hexdigest()
+    assert single_args["_mtime"] == os.stat(str(src / "b.txt")).st_mtime_ns // 100 + 116444736000000000
+
+
+def test_copy_file_size_mtime_sends_size(tmp_path, monkeypatch):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"content")
+
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest", "checksum_algorithm": "size_mtime"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            return {"files": module_args["files"], "directories": [], "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert actual["checksum"] is None
+    assert [c["_copy_mode"] for c in calls] == ["query", "single"]
+
+    mtime = os.stat(str(src)).st_mtime_ns // 100 + 116444736000000000
+    query_file = calls[0]["files"][0]
+    assert query_file["checksum"] is None
+    assert query_file["size"] == 7
+    assert query_file["mtime"] == mtime
+    assert calls[1]["_mtime"] == mtime
+
+
+@pytest.mark.parametrize("changed", [True, False])
+def test_copy_rendered_content(tmp_path, monkeypatch, changed):
+    plugin = win_copy_init({"src": str(tmp_path / "config.j2"), "dest": "C:\\dest\\"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = []
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.append(open(local, "rb").read()))
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            return {"files": module_args["files"] if changed else [], "directories": [], "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run_rendered("config.j2", b"rendered", task_vars={})
+    assert actual["changed"] is changed
+    assert actual["checksum"] == hashlib.sha1(b"rendered").hexdigest()
+    assert actual["size"] == 8
+    assert actual["dest"] == "C:\\dest\\config.j2"
+    assert calls[0]["files"] == [{"src": None, "dest": "config.j2", "checksum": hashlib.sha1(b"rendered").hexdigest()}]
+
+    if changed:
+        assert [c["_copy_mode"] for c in calls] == ["query", "single"]
+        assert transferred == [b"rendered"]
+    else:
+        assert [c["_copy_mode"] for c in calls] == ["query"]
+        assert transferred == []
+
+    # the rendered content is only written to a tempfile that is removed once copied
+    assert os.listdir(str(tmp_path)) == []
+
+    # the rendered content is not kept by the plugin for a later run of src
+    (tmp_path / "config.j2").write_bytes(b"source")
+    calls.clear()
+    plugin.run(task_vars={})
+    assert calls[0]["files"][0]["checksum"] == hashlib.sha1(b"source").hexdigest()
+
+
+@pytest.mark.parametrize("dests, expected", [
+    (["C:\\app\\a.ini", "C:\\app\\conf\\b.ini", "c:\\APP\\c.ini"],
+     [("C:\\app", [(0, "a.ini"), (1, "conf\\b.ini"), (2, "c.ini")])]),
+    (["C:\\app\\a.ini", "D:\\data\\b.ini", "C:\\ProgramData\\c.ini"],
+     [("C:\\", [(0, "app\\a.ini"), (2, "ProgramData\\c.ini")]), ("D:\\data", [(1, "b.ini")])]),
+    (["C:/app/a.ini"], [("C:\\app", [(0, "a.ini")])]),
+])
+def test_group_by_common_dir(dests, expected):
+    assert win_copy._group_by_common_dir(dests) == expected
+
+
+def test_copy_rendered_files(tmp_path, monkeypatch):
+    plugin = win_copy_init({"src": None, "dest": None})
+    plugin._task.args = {}
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+
+    calls = []
+    zipped = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            # b.ini is up to date and conf is an existing directory
+            changed = [dict(f) for f in module_args["files"] if f["dest"] != "b.ini"]
+            for f in changed:
+                if f["dest"] == "conf":
+                    f["dest"] = "conf\\" + f["src"]
+            return {"files": changed, "directories": [], "symlinks": []}
+        return {"changed": True}
+
+    def copy_zip_file(dest, files, directories, task_vars, tmp, backup, **kwargs):
+        zipped.append((dest, [(f["dest"], open(f["src"], "rb").read()) for f in files]))
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+    monkeypatch.setattr(plugin, "_copy_zip_file", copy_zip_file)
+
+    rendered = [
+        {"src": "/templates/a.ini.j2", "dest": "C:\\app\\a.ini", "content": b"a"},
+        {"src": "/templates/b.ini.j2", "dest": "C:\\app\\b.ini", "content": b"b"},
+        {"src": "/templates/c.ini.j2", "dest": "C:\\app\\conf", "content": b"c"},
+        {"src": "/templates/d.ini.j2", "dest": "C:\\app\\sub\\", "content": b"d"},
+    ]
+    actual = plugin.run_rendered_files(rendered, task_vars={})
+
+    assert actual["changed"] is True
+    assert actual["dest"] == ["C:\\app\\a.ini", "C:\\app\\b.ini", "C:\\app\\conf", "C:\\app\\sub\\d.ini.j2"]
+    assert [f["changed"] for f in actual["files"]] == [True, False, True, True]
+    assert actual["files"][0]["checksum"] == hashlib.sha1(b"a").hexdigest()
+
+    assert [c["_copy_mode"] for c in calls] == ["query"]
+    assert calls[0]["dest"] == "C:\\app"
+    assert [f["dest"] for f in calls[0]["files"]] == ["a.ini", "b.ini", "conf", "sub\\d.ini.j2"]
+    assert zipped == [("C:\\app", [("a.ini", b"a"), ("conf\\c.ini.j2", b"c"), ("sub\\d.ini.j2", b"d")])]
+
+    # the rendered contents are only written to a tempdir that is removed
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_invalid_checksum_algorithm(tmp_path):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"content")
+
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest", "checksum_algorithm": "md5"})
+    actual = plugin.run(task_vars={})
+    assert actual["failed"] is True
+    assert actual["msg"] == "checksum_algorithm must be one of: sha1, sha256, crc32, size_mtime"
+
+
+def test_dedupe_files():
+    files = [
+        {"src": "/src/a/lib.dll", "dest": "a/lib.dll", "checksum": "1", "size": 10},
+        {"src": "/src/b/lib.dll", "dest": "b/lib.dll", "checksum": "1", "size": 10},
+        {"src": "/src/c/lib.dll", "dest": "c/lib.dll", "checksum": "1", "size": 10},
+        {"src": "/src/app.exe", "dest": "app.exe", "checksum": "2", "size": 20},
+        {"src": "/src/empty", "dest": "empty", "checksum": "3", "size": 0},
+        {"src": "/src/empty2", "dest": "empty2", "checksum": "3", "size": 0},
+        {"src": "/src/nocheck", "dest": "nocheck", "checksum": None, "size": 5},
+    ]
+    existing = [{"src": "/src/old.exe", "dest": "old.exe", "checksum": "2", "size": 20}]
+
+    unique, duplicates, bytes_saved = win_copy._dedupe_files(files, existing)
+    assert [f["dest"] for f in unique] == ["a/lib.dll", "empty", "empty2", "nocheck"]
+    assert duplicates == [
+        {"src": "a/lib.dll", "dest": ["b/lib.dll", "c/lib.dll"]},
+        {"src": "old.exe", "dest": ["app.exe"]},
+    ]
+    assert bytes_saved == 40
+
+
+@pytest.mark.parametrize("trailing_slash, mirror_root", [(True, ""), (False, "src")])
+def test_copy_folder_mirror(tmp_path, monkeypatch, trailing_slash, mirror_root):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_bytes(b"a")
+
+    src_path = str(src) + (os.path.sep if trailing_slash else "")
+    plugin = win_copy_init({"src": src_path, "dest": "C:\\dest", "mirror": True, "exclude": ["obj/"]})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+
+    prefix = mirror_root + "\\" if mirror_root else ""
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            return {
+                "changed_entries": [],
+                "symlinks": [],
+                "extra_entries": [
+                    {"dest": prefix + "old.txt", "directory": False},
+                    {"dest": prefix + "obj", "directory": True},
+                ],
+            }
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert actual["removed"] == [prefix + "old.txt"]
+    assert [c["_copy_mode"] for c in calls] == ["query", "explode"]
+    assert calls[0]["mirror"] is True
+    assert calls[0]["_mirror_root"] == mirror_root
+    assert calls[0]["_mirror_recurse"] is True
+    assert calls[1]["_purge"] == [prefix + "old.txt"]
+
+
+def test_get_mirror_purge_keeps_excluded_entries():
+    plugin = win_copy_init({})
+    path_filter = win_copy._get_path_filter(exclude=["obj/", "*.log"])
+    query_return = {"extra_entries": [
+        {"dest": "src\\old.txt", "directory": False},
+        {"dest": "src\\cache", "directory": True},
+        {"dest": "src\\cache\\nested", "directory": True},
+        {"dest": "src\\cache\\nested\\keep.log", "directory": False},
+        {"dest": "src\\cache\\nested\\old.txt", "directory": False},
+        {"dest": "src\\cache\\other", "directory": True},
+        {"dest": "src\\cache\\other\\old.txt", "directory": False},
+        {"dest": "src\\obj", "directory": True},
+        {"dest": "src\\obj\\old.txt", "directory": False},
+    ]}
+
+    actual = plugin._get_mirror_purge(query_return, "src", path_filter=path_filter)
+    assert actual == ["src\\old.txt", "src\\cache\\nested\\old.txt", "src\\cache\\other"]
+
+
+def test_mirror_with_remote_src():
+    plugin = win_copy_init({"src": "C:\\src", "dest": "C:\\dest", "mirror": True, "remote_src": True})
+    actual = plugin.run(task_vars={})
+    assert actual["failed"] is True
+    assert actual["msg"] == "mirror is not supported when remote_src=True"
+
+
+def test_copy_folder_timings(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    for name in ["a.txt", "b.txt", os.path.join("sub", "c.txt")]:
+        (src / name).write_bytes(name.encode())
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest", "timings": True})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+
+    def execute_module(module_name, module_args, task_vars):
+        assert module_args["timings"] is True
+        if module_args["_copy_mode"] == "query":
+            entries = read_manifest(transferred[module_args["_manifest"]])
+            changed = [idx for idx, e in enumerate(entries) if e[4] != "a.txt"]
+            return {"changed_entries": changed, "symlinks": [], "timings": {"manifest": 0.5, "compare": 0.25}}
+        return {"changed": True, "timings": {"extract": 1.5}}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    timings = actual["timings"]
+    assert sorted(timings["stages"]) == ["explode", "hash", "manifest", "query", "transfer", "walk", "zip"]
+    assert all(v >= 0 for v in timings["stages"].values())
+    assert sum(timings["stages"].values()) <= timings["total"]
+    assert timings["bytes"] == {"source": 19, "transferred": sum(len(v) for v in transferred.values())}
+    assert timings["entries"] == {"files": 3, "directories": 1, "symlinks": 0, "changed": 3}
+    assert timings["remote"] == {"query": {"manifest": 0.5, "compare": 0.25}, "explode": {"extract": 1.5}}
+
+
+def test_copy_without_timings(tmp_path, monkeypatch):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"content")
+
+    plugin = win_copy_init({"src": str(src), "dest": "C:\\dest"})
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+    monkeypatch.setattr(plugin, "_execute_module", MagicMock(return_value={"files": [], "directories": [], "symlinks": []}))
+
+    actual = plugin.run(task_vars={})
+    assert "timings" not in actual
+
+
+def test_copy_folder_sends_duplicates_once(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["a.dll", "b.dll", "c.dll"]:
+        (src / name).write_bytes(b"same content")
+    (src / "d.txt").write_bytes(b"other")
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            entries = read_manifest(transferred[module_args["_manifest"]])
+            return {"changed_entries": [idx for idx, e in enumerate(entries) if e[4] != "d.txt"], "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert actual["bytes_saved"] == 24
+
+    explode_args = calls[-1]
+    assert explode_args["_copy_mode"] == "explode"
+    assert explode_args["_duplicates"] == [{"src": "a.dll", "dest": ["b.dll", "c.dll"]}]
+    with zipfile.ZipFile(io.BytesIO(transferred[explode_args["src"]])) as zip_file:
+        assert [base64.b64decode(n).decode() for n in zip_file.namelist()] == ["a.dll"]
+
+
+def test_query_manifest_reads_changed_entries_from_index(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.dll").write_bytes(b"same content")
+    (src / "b.txt").write_bytes(b"other")
+    (src / "sub" / "c.dll").write_bytes(b"same content")
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    monkeypatch.setattr(plugin, "_transfer_file", MagicMock())
+
+    entries = win_copy._read_entries(win_copy._iter_walk_dirs(str(src) + os.path.sep), plugin._loader, checksum_check=True)
+    manifest = plugin._transfer_manifest(entries, "C:\\tmp")
+    try:
+        # the walked entries are only kept in the local index
+        assert (manifest["files"], manifest["directories"], manifest["size"]) == (3, 1, 29)
+        assert "entries" not in manifest
+
+        monkeypatch.setattr(plugin, "_execute_module", MagicMock(return_value={"changed_entries": [3], "symlinks": []}))
+        actual = plugin._query_manifest("C:\\dest", True, manifest, {})
+    finally:
+        os.remove(manifest["index"])
+
+    assert [(e.src, e.dest) for e in actual["files"]] == [(str(src / "sub" / "c.dll"), "sub/c.dll")]
+    assert actual["directories"] == []
+    # only the unchanged files with the content of a changed file are returned
+    assert [e.dest for e in actual["unchanged_files"]] == ["a.dll"]
+
+
+def test_copy_folder_to_multiple_dests(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    for name in ["a.txt", "b.txt", os.path.join("sub", "c.txt")]:
+        (src / name).write_bytes(name.encode())
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": ["C:\\one", "C:\\two", "C:\\three"]})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+
+    def transfer_file(local, remote):
+        assert remote not in transferred
+        transferred[remote] = open(local, "rb").read()
+
+    monkeypatch.setattr(plugin, "_transfer_file", transfer_file)
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            entries = read_manifest(transferred[module_args["_manifest"]])
+            changed = {
+                "C:\\one\\": ["a.txt"],
+                "C:\\two\\": [],
+                "C:\\three\\": ["b.txt"],
+            }[module_args["dest"]]
+            return {"changed_entries": [idx for idx, e in enumerate(entries) if e[4] in changed], "symlinks": []}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is True
+    assert actual["dest"] == ["C:\\one\\", "C:\\two\\", "C:\\three\\"]
+    assert [d["changed"] for d in actual["destinations"]] == [True, False, True]
+    assert sorted(transferred) == ["C:\\tmp\\manifest.gz", "C:\\tmp\\source.zip"]
+    assert [(c["_copy_mode"], c["dest"]) for c in calls] == [
+        ("query", "C:\\one\\"),
+        ("query", "C:\\two\\"),
+        ("query", "C:\\three\\"),
+        ("explode", "C:\\one\\"),
+        ("explode", "C:\\three\\"),
+    ]
+    with zipfile.ZipFile(io.BytesIO(transferred["C:\\tmp\\source.zip"])) as zip_file:
+        assert sorted(base64.b64decode(n).decode() for n in zip_file.namelist()) == ["a.txt", "b.txt"]
+
+
+def test_copy_file_to_multiple_dests(tmp_path, monkeypatch):
+    src = tmp_path / "file.txt"
+    src.write_bytes(b"content")
+
+    plugin = win_copy_init({"src": str(src), "dest": ["C:\\one\\", "C:\\two\\file.txt"]})
+    transferred = []
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.append(remote))
+
+    calls = []
+
+    def execute_module(module_name, module_args, task_vars):
+        calls.append(module_args)
+        if module_args["_copy_mode"] == "query":
+            return {"files": module_args["files"], "directories": [], "symlinks": []}
+        if module_args["dest"] == "C:\\two\\file.txt":
+            return {"failed": True, "msg": "access denied"}
+        return {"changed": True}
+
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert transferred == ["C:\\tmp\\source"]
+    assert [(c["_copy_mode"], c["dest"]) for c in calls] == [
+        ("query", "C:\\one\\"),
+        ("query", "C:/two"),
+        ("single", "C:\\one\\"),
+        ("single", "C:\\two\\file.txt"),
+    ]
+    assert calls[0]["files"][0]["dest"] == "file.txt"
+    assert actual["dest"] == ["C:\\one\\file.txt", "C:\\two\\file.txt"]
+    assert actual["failed"] is True
+    assert actual["msg"] == "failed to copy to 1 of 2 dests, first failure for C:\\two\\file.txt: access denied"
+
+
+def test_query_manifest_format(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "sub" / "b.txt").write_bytes(b"b")
+    (src / "a.txt").write_bytes(b"a")
+    os.utime(str(src / "a.txt"), ns=(0, 1000000000))
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    transferred = {}
+    monkeypatch.setattr(plugin, "_transfer_file", lambda local, remote: transferred.setdefault(remote, open(local, "rb").read()))
+    execute_module = MagicMock(return_value={"changed_entries": [], "symlinks": []})
+    monkeypatch.setattr(plugin, "_execute_module", execute_module)
+
+    actual = plugin.run(task_vars={})
+    assert actual["changed"] is False
+
+    module_args = execute_module.call_args[1]["module_args"]
+    assert "files" not in module_args
+    assert "directories" not in module_args
+    entries = read_manifest(transferred[module_args["_manifest"]])
+    assert entries == [
+        ["f", "1", "116444736010000000", "86f7e437faa5a7fce15d1ddcb9eaeaea377667b8", "a.txt"],
+        ["d", "", "", "", "sub"],
+        ["f", "1", str(os.stat(str(src / "sub" / "b.txt")).st_mtime_ns // 100 + 116444736000000000),
+         "e9d71f5ee7c92d6dc9e92ffdad17b8bd49418f98", "sub/b.txt"],
+    ]
+
+    # The local manifest is removed once it has been transferred
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src"]
+
+
+@pytest.mark.parametrize("fail_at", ["hash", "transfer"])
+def test_copy_folder_failure_removes_manifest(tmp_path, monkeypatch, fail_at):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_bytes(b"a")
+
+    plugin = win_copy_init({"src": str(src) + os.path.sep, "dest": "C:\\dest"})
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+    if fail_at == "hash":
+        monkeypatch.setattr(win_copy, "checksum_files", MagicMock(side_effect=KeyboardInterrupt))
+    else:
+        monkeypatch.setattr(plugin, "_transfer_file", MagicMock(side_effect=AnsibleConnectionFailure("failed")))
+
+    with pytest.raises((KeyboardInterrupt, AnsibleConnectionFailure)):
+        plugin.run(task_vars={})
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["src"]
+    plugin._remove_tmp_path.assert_called_once_with("C:\\tmp")
+
+
+def test_create_zip_tempfile_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(win_copy.C, "DEFAULT_LOCAL_TMP", str(tmp_path))
+
+    with pytest.raises(OSError):
+        win_copy_init({})._create_zip_tempfile([{"src": str(tmp_path / "missing"), "dest": "missing"}], [])
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_zip_entries_compression_policy(tmp_path):
+    text_file = tmp_path / "text.txt"
+    text_file.write_bytes(b"abc" * 4096)
+    random_file = tmp_path / "random.bin"
+    random_file.write_bytes(os.urandom(32768))
+    archive_file = tmp_path / "archive.zip"
+    archive_file.write_bytes(b"abc" * 4096)
+    files = [
+        {"src": str(text_file), "dest": "text.txt"},
+        {"src": str(random_file), "dest": "random.bin"},
+        {"src": str(archive_file), "dest": "archive.zip"},
+    ]
+
+    def get_compress_types(compression):
+        b_data = io.BytesIO()
+        with zipfile.ZipFile(b_data, "w") as zip_file:
+            win_copy_init({})._write_zip_entries(zip_file, files, [], compression=compression)
+
+        with zipfile.ZipFile(b_data) as zip_file:
+            return [i.compress_type for i in zip_file.infolist()]
+
+    deflated = zipfile.ZIP_DEFLATED
+    stored = zipfile.ZIP_STORED
+    assert get_compress_types(("auto", 6)) == [deflated, stored, stored]
+    assert get_compress_types(("always", 1)) == [deflated, deflated, deflated]
+    assert get_compress_types(("never", 6)) == [stored, stored, stored]
+
+
+def test_invalid_compression_level():
+    plugin = win_copy_init({"src": "src", "dest": "C:\\dest", "compression_level": 10})
+
+    actual = plugin.run(task_vars={})
+    assert actual["failed"] is True
+    assert actual["msg"] == "compression_level must be between 1 and 9"
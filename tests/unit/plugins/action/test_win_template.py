@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright: Contributors to the Ansible project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from ansible.errors import AnsibleActionFail
+from ansible.parsing.dataloader import DataLoader
+from ansible.playbook.task import Task
+from ansible.template import Templar
+from ansible_collections.ansible.windows.plugins.action import win_template
+
+
+def win_template_init(task_args, tmp_path):
+    task = MagicMock(Task)
+    task.args = task_args
+    task.check_mode = False
+    task.async_val = 0
+
+    rendered = []
+
+    def copy_run_rendered(basename, b_content, task_vars=None):
+        rendered.append(b_content)
+        return {"changed": True}
+
+    def copy_run_rendered_files(files, task_vars=None):
+        rendered.extend((os.path.basename(f["src"]), f["dest"], f["content"]) for f in files)
+        return {"changed": True, "dest": [f["dest"] for f in files], "files": [{"src": f["src"]} for f in files]}
+
+    new_task = MagicMock(Task)
+    new_task.args = dict(task_args)
+    new_task.async_val = 0
+    task.copy.return_value = new_task
+
+    copy_action = MagicMock()
+    copy_action.run_rendered.side_effect = copy_run_rendered
+    copy_action.run_rendered_files.side_effect = copy_run_rendered_files
+    shared_loader_obj = MagicMock()
+    shared_loader_obj.action_loader.get.return_value = copy_action
+
+    loader = DataLoader()
+    loader.set_basedir(str(tmp_path))
+
+    plugin = win_template.ActionModule(task, MagicMock(), MagicMock(), loader=loader, templar=Templar(loader=loader),
+                                       shared_loader_obj=None)
+    plugin._shared_loader_obj = shared_loader_obj
+    plugin._find_needle = lambda dirname, needle: needle
+    plugin._remove_tmp_path = MagicMock()
+
+    return plugin, rendered
+
+
+def test_template_multiple(tmp_path):
+    for name in ["a", "b"]:
+        (tmp_path / ("%s.j2" % name)).write_text("%s={{ value }} {{ template_path | basename }}\n" % name)
+
+    templates = [
+        {"src": str(tmp_path / "a.j2"), "dest": "C:\\app\\a.ini"},
+        {"src": str(tmp_path / "b.j2"), "dest": "C:\\app\\b.ini"},
+    ]
+    plugin, rendered = win_template_init({"templates": templates, "newline_sequence": "\n"}, tmp_path)
+    actual = plugin.run(task_vars={"value": 1, "ansible_search_path": ["/search"]})
+
+    assert actual["changed"] is True
+    assert actual["templates"] == [{"src": str(tmp_path / "a.j2")}, {"src": str(tmp_path / "b.j2")}]
+    assert rendered == [
+        ("a.j2", "C:\\app\\a.ini", b"a=1 a.j2\n"),
+        ("b.j2", "C:\\app\\b.ini", b"b=1 b.j2\n"),
+    ]
+    assert "templates" not in plugin._task.copy.return_value.args
+
+
+@pytest.mark.parametrize("task_args, expected", [
+    ({"templates": [], "src": "a.j2"}, "templates is mutually exclusive with src and dest"),
+    ({"templates": [{"src": "a.j2"}]}, "templates must be a list of dictionaries with the keys src and dest"),
+    ({"templates": "a.j2"}, "templates must be a list of dictionaries with the keys src and dest"),
+    ({"templates": [{"src": "a.j2", "dest": "C:\\a"}], "backup": True}, "backup cannot be used with templates"),
+])
+def test_template_multiple_invalid(tmp_path, task_args, expected):
+    plugin, rendered = win_template_init(task_args, tmp_path)
+    with pytest.raises(AnsibleActionFail, match=expected):
+        plugin.run(task_vars={})
+
+
+def test_template_searchpath_not_changed(tmp_path):
+    src = tmp_path / "config.j2"
+    src.write_text("{{ template_path | basename }} {{ value }}\n")
+    search_path = [str(tmp_path), "/role", str(tmp_path)]
+    task_vars = {"value": 1, "ansible_search_path": search_path}
+
+    for dummy in range(2):
+        plugin, rendered = win_template_init({"src": str(src), "dest": "C:\\config.ini"}, tmp_path)
+        plugin.run(task_vars=task_vars)
+        assert rendered == [b"config.j2 1\r\n"]
+
+    assert task_vars == {"value": 1, "ansible_search_path": [str(tmp_path), "/role", str(tmp_path)]}
+    assert task_vars["ansible_search_path"] is search_path
+
+
+def test_get_template_searchpath():
+    actual = win_template._get_template_searchpath({"ansible_search_path": ["/role", "/play", "/role"]}, "/play",
+                                                   "/role/templates/config.j2")
+    assert actual == [
+        "/role/templates", "/role",
+        "/play/templates", "/play",
+        "/role/templates/templates",
+    ]